@@ -7,9 +7,9 @@ time.tzset()
 
 from urllib.parse import urlparse
 from utils.retry import retry
-from config.settings import Settings
+from config.settings import get_settings
 
-settings = Settings()
+settings = get_settings()
 
 class CameraConfig:
     def __init__(self):
@@ -18,7 +18,7 @@ class CameraConfig:
         self.retry_interval = settings.CAMERA_RETRY_INTERVAL
         self.cap = None
 
-    @retry(max_retries=5, delay=2, backoff=2)
+    @retry(max_retries=5, delay=2, backoff=2, dependency='camera')
     def connect(self):
         if self.cap and self.cap.isOpened():
             self.cap.release()
@@ -1,33 +1,64 @@
 """config/database.py"""
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc as sa_exc
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.pool import QueuePool
-from config.settings import Settings
+from config.settings import get_settings
+from utils import metrics
+from utils.retry import circuit_breaker
 import time
 import os
+import threading
 os.environ['TZ'] = 'Asia/Jakarta'
 time.tzset()
 
 
 from contextlib import contextmanager
 
-settings = Settings()
+settings = get_settings()
 
 # Deklarasikan Base di sini
 Base = declarative_base()
 
+# Kegagalan koneksi/DB sibuk, bukan kesalahan data (mis. constraint): hanya ini yang layak di-retry
+DB_TRANSIENT_ERRORS = (ConnectionError, TimeoutError, sa_exc.OperationalError, sa_exc.InterfaceError,
+                       sa_exc.DisconnectionError)
+
+# Kesalahan yang memang bisa disebabkan satu baris (constraint, nilai tidak valid): hanya ini yang dihitung sebagai percobaan
+DB_ROW_ERRORS = (sa_exc.IntegrityError, sa_exc.DataError)
+
+# Data yang ditolak DB tidak membuka breaker, supaya satu baris buruk tidak memblokir semua penulisan
+circuit_breaker('db', trip_on=DB_TRANSIENT_ERRORS)
+
 class DatabaseConfig:
+    """Engine and session factory, created on the first session (importing or constructing never connects)"""
+
     def __init__(self):
-        self.engine = None
-        self.session_factory = None
-        self._initialize()
+        self._engine = None
+        self._session_factory = None
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        self._ensure_initialized()
+        return self._engine
+
+    @property
+    def session_factory(self):
+        self._ensure_initialized()
+        return self._session_factory
+
+    def _ensure_initialized(self):
+        if self._session_factory is None:
+            with self._lock:
+                if self._session_factory is None:
+                    self._initialize()
 
     def _initialize(self):
         db_url = f"mysql+pymysql://{settings.DB_USER}:{settings.DB_PASS}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
         
-        self.engine = create_engine(
+        engine = create_engine(
             db_url,
             poolclass=QueuePool,
             pool_size=5,
@@ -36,10 +67,18 @@ class DatabaseConfig:
             pool_recycle=3600,
             connect_args={'connect_timeout': 10}
         )
+
+        pool = engine.pool
+        metrics.gauge('db_pool_size', 'Connections kept open by the pool', pool.size)
+        metrics.gauge('db_pool_checked_out', 'Pool connections currently in use', pool.checkedout)
+        metrics.gauge('db_pool_checked_in', 'Idle connections in the pool', pool.checkedin)
+        metrics.gauge('db_pool_overflow', 'Connections beyond pool_size (negative while the pool fills)', pool.overflow)
         
-        self.session_factory = scoped_session(
+        self._engine = engine
+        # Assigned last: _ensure_initialized checks it without the lock
+        self._session_factory = scoped_session(
             sessionmaker(
-                bind=self.engine,
+                bind=engine,
                 autocommit=False,
                 autoflush=False
             )
@@ -70,5 +109,17 @@ class DatabaseConfig:
                 time.sleep(2 ** attempt)
         return False
 
+_database = None
+_database_lock = threading.Lock()
+
+def get_database():
+    """DatabaseConfig shared by the whole process, so every service uses one connection pool"""
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = DatabaseConfig()
+    return _database
+
 # Export Base untuk digunakan di modul lain
-__all__ = ['DatabaseConfig', 'Base']
+__all__ = ['DatabaseConfig', 'Base', 'get_database']
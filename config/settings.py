@@ -1,6 +1,7 @@
 """config/settings.py"""
 
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,24 +10,117 @@ class Settings:
     def __init__(self):
         # Camera settings
         self.CAMERA_URL = os.getenv('CAMERA_URL')
+        # Beberapa kamera dalam satu proses: daftar URL dipisahkan koma (default: CAMERA_URL)
+        self.CAMERA_URLS = [url.strip() for url in os.getenv('CAMERA_URLS', self.CAMERA_URL or '').split(',') if url.strip()]
         self.CAMERA_TIMEOUT = int(os.getenv('CAMERA_TIMEOUT', '10'))
         self.CAMERA_RETRY_INTERVAL = int(os.getenv('CAMERA_RETRY_INTERVAL', '5'))
+        self.CAMERA_THREADED = os.getenv('CAMERA_THREADED', 'true').lower() == 'true'  # Baca frame di background thread
+        self.CAMERA_BUFFER_SIZE = int(os.getenv('CAMERA_BUFFER_SIZE', '1'))  # Jumlah frame terbaru yang disimpan
+        # 'opencv' (default, cv2.VideoCapture seperti sebelumnya), 'mjpeg' (reader MJPEG bawaan, grayscale),
+        # 'replay' (file video/direktori gambar) atau 'auto' (path lokal -> replay, http(s) -> mjpeg, lainnya -> opencv)
+        self.CAMERA_SOURCE = os.getenv('CAMERA_SOURCE', 'opencv')
+        self.FRAME_DECODE_SCALE = int(os.getenv('FRAME_DECODE_SCALE', '1'))  # Decode JPEG pada 1/N resolusi (1, 2, 4, 8)
+        self.REPLAY_FPS = float(os.getenv('REPLAY_FPS', '0'))  # 0 = secepat mungkin
+        self.REPLAY_LOOP = os.getenv('REPLAY_LOOP', 'true').lower() == 'true'
+        self.MATCH_WORKERS = int(os.getenv('MATCH_WORKERS', str(os.cpu_count() or 1)))  # Worker pencocokan (multi-kamera)
+        self.MATCH_SHARDS = int(os.getenv('MATCH_SHARDS', '0'))  # Proses pencocokan galeri (shared memory), 0 = di proses utama
+        self.MATCH_SHARD_TIMEOUT = float(os.getenv('MATCH_SHARD_TIMEOUT', '2.0'))  # Detik menunggu jawaban shard sebelum kembali ke proses utama
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # Endpoint Prometheus /metrics, 0 = nonaktif
+        self.METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.STATS_INTERVAL = int(os.getenv('STATS_INTERVAL', '60'))  # Detik antar log statistik
         
         # Database settings
         self.DB_HOST = os.getenv('DB_HOST')
-        self.DB_PORT = int(os.getenv('DB_PORT'))
+        self.DB_PORT = int(os.getenv('DB_PORT', '3306'))
         self.DB_USER = os.getenv('DB_USER')
         self.DB_PASS = os.getenv('DB_PASS')
         self.DB_NAME = os.getenv('DB_NAME')
         
         # Directory settings
         self.PHOTO_DIR = 'photos'  # Direktori untuk menyimpan foto asli
-        self.FEATURES_DIR = 'detection/features'  # Direktori untuk menyimpan fitur SIFT
+        self.FEATURES_DIR = 'detection/features'  # Direktori untuk menyimpan fitur (SIFT/ORB/AKAZE)
+        self.MANIFEST_FILE = os.getenv('MANIFEST_FILE', os.path.join(self.FEATURES_DIR, 'manifest.json'))  # Manifest sinkronisasi foto
+        self.GALLERY_FILE = os.getenv('GALLERY_FILE', os.path.join(self.FEATURES_DIR, 'gallery.bin'))  # Galeri fitur gabungan (memory-mapped)
         self.LOG_DIR = 'logs'
         
         # Detection settings
         self.MIN_MATCH_COUNT = int(os.getenv('MIN_MATCH_COUNT', '10'))
         self.REQUIRED_DETECTION_DURATION = int(os.getenv('REQUIRED_DETECTION_DURATION', '3'))
+        self.MATCH_MODE = os.getenv('MATCH_MODE', 'gallery')  # 'gallery' atau 'per_student'
+        self.FEATURE_BACKEND = os.getenv('FEATURE_BACKEND', 'sift')  # 'sift', 'orb' atau 'akaze' (fitur harus diekstrak ulang)
+        self.FEATURE_INDEX = os.getenv('FEATURE_INDEX', 'flann')  # 'flann' (KD-tree/LSH) atau 'bf' (brute force)
+        self.ORB_FEATURES = int(os.getenv('ORB_FEATURES', '1000'))  # Keypoint maksimal ORB per gambar
+        self.FACE_DETECTION = os.getenv('FACE_DETECTION', 'false').lower() == 'true'  # Deteksi wajah sebelum SIFT
+        # Beberapa wajah per frame: setiap mahasiswa yang lolos ambang dan verifikasi homografi RANSAC
+        self.MULTI_FACE = os.getenv('MULTI_FACE', 'false').lower() == 'true'
+        self.MAX_FACES = int(os.getenv('MAX_FACES', '10'))  # Batas wajah per frame
+        self.MIN_INLIERS = int(os.getenv('MIN_INLIERS', str(self.MIN_MATCH_COUNT)))  # Match konsisten minimal per wajah
+        self.HOMOGRAPHY_THRESHOLD = float(os.getenv('HOMOGRAPHY_THRESHOLD', '8.0'))  # Error reproyeksi RANSAC (piksel)
+        self.FACE_CASCADE_FILE = os.getenv('FACE_CASCADE_FILE', 'haarcascade_frontalface_default.xml')
+        self.FACE_DETECT_WIDTH = int(os.getenv('FACE_DETECT_WIDTH', '320'))  # Lebar frame saat deteksi wajah
+        self.FACE_CROP_SIZE = int(os.getenv('FACE_CROP_SIZE', '256'))  # Ukuran crop wajah untuk SIFT
+        self.FACE_PADDING = float(os.getenv('FACE_PADDING', '0.25'))
+        self.FACE_SCALE_FACTOR = float(os.getenv('FACE_SCALE_FACTOR', '1.1'))  # Lebih besar = lebih cepat, recall lebih rendah
+        self.FACE_STATS_SAMPLE_EVERY = int(os.getenv('FACE_STATS_SAMPLE_EVERY', '50'))  # Ukur SIFT full-frame tiap N frame
+        # Gerbang frame: lewati frame statis, buram, atau terlalu gelap/terang sebelum pencocokan
+        self.FRAME_GATE = os.getenv('FRAME_GATE', 'false').lower() == 'true'
+        self.FRAME_GATE_WIDTH = int(os.getenv('FRAME_GATE_WIDTH', '160'))
+        self.FRAME_GATE_MOTION_THRESHOLD = int(os.getenv('FRAME_GATE_MOTION_THRESHOLD', '25'))  # Selisih piksel (0-255)
+        self.FRAME_GATE_MOTION_RATIO = float(os.getenv('FRAME_GATE_MOTION_RATIO', '0.01'))  # Porsi piksel yang berubah
+        self.FRAME_GATE_MIN_SHARPNESS = float(os.getenv('FRAME_GATE_MIN_SHARPNESS', '50'))  # Varians Laplacian
+        self.FRAME_GATE_MIN_BRIGHTNESS = float(os.getenv('FRAME_GATE_MIN_BRIGHTNESS', '40'))
+        self.FRAME_GATE_MAX_BRIGHTNESS = float(os.getenv('FRAME_GATE_MAX_BRIGHTNESS', '220'))
+        self.FRAME_GATE_LEARNING_RATE = float(os.getenv('FRAME_GATE_LEARNING_RATE', '0.05'))
+        self.FRAME_GATE_REFRESH = float(os.getenv('FRAME_GATE_REFRESH', '10'))  # Paksa pencocokan tiap N detik
+        self.FACE_TRACKING = os.getenv('FACE_TRACKING', 'false').lower() == 'true'  # Lacak wajah dengan optical flow setelah cocok
+        self.TRACK_WIDTH = int(os.getenv('TRACK_WIDTH', '320'))  # Lebar frame untuk optical flow
+        self.TRACK_MIN_POINTS = int(os.getenv('TRACK_MIN_POINTS', '10'))  # Titik minimal sebelum track dianggap hilang
+        self.TRACK_VERIFY_INTERVAL = float(os.getenv('TRACK_VERIFY_INTERVAL', '2.0'))  # Detik antar verifikasi ke mahasiswa yang dilacak
+        self.TRACK_MAX_ERROR = float(os.getenv('TRACK_MAX_ERROR', '1.0'))  # Batas error forward-backward (piksel)
+        self.GALLERY_RELOAD_INTERVAL = int(os.getenv('GALLERY_RELOAD_INTERVAL', '30'))  # Detik, 0 = nonaktif
+        # Penulisan presensi asinkron (antrean + batch INSERT)
+        self.ATTENDANCE_ASYNC = os.getenv('ATTENDANCE_ASYNC', 'true').lower() == 'true'
+        self.ATTENDANCE_QUEUE_SIZE = int(os.getenv('ATTENDANCE_QUEUE_SIZE', '1000'))
+        self.ATTENDANCE_BATCH_SIZE = int(os.getenv('ATTENDANCE_BATCH_SIZE', '50'))
+        self.ATTENDANCE_FLUSH_INTERVAL = float(os.getenv('ATTENDANCE_FLUSH_INTERVAL', '2'))  # Detik
+        self.ATTENDANCE_PUT_TIMEOUT = float(os.getenv('ATTENDANCE_PUT_TIMEOUT', '0.1'))  # Detik menunggu saat antrean penuh
+        # Outbox lokal (SQLite) agar presensi tetap tersimpan saat RDS lambat/tidak terjangkau
+        self.ATTENDANCE_OUTBOX = os.getenv('ATTENDANCE_OUTBOX', 'true').lower() == 'true'
+        self.ATTENDANCE_OUTBOX_FILE = os.getenv('ATTENDANCE_OUTBOX_FILE', os.path.join('data', 'attendance_outbox.db'))
+        self.ATTENDANCE_OUTBOX_COMMIT_INTERVAL = float(os.getenv('ATTENDANCE_OUTBOX_COMMIT_INTERVAL', '0.01'))  # Detik mengumpulkan event per fsync
+        self.ATTENDANCE_REPLAY_INTERVAL = float(os.getenv('ATTENDANCE_REPLAY_INTERVAL', '2'))  # Detik antar pengecekan outbox
+        self.ATTENDANCE_REPLAY_MAX_BACKOFF = float(os.getenv('ATTENDANCE_REPLAY_MAX_BACKOFF', '60'))  # Detik maksimal saat DB gagal
+        self.ATTENDANCE_REPLAY_MAX_ATTEMPTS = int(os.getenv('ATTENDANCE_REPLAY_MAX_ATTEMPTS', '5'))  # Event yang terus ditolak DB dipindah ke outbox_dead
+        # Ketahanan I/O: circuit breaker per dependensi (camera, db, photo_http) dan anggaran retry
+        self.BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # Kegagalan beruntun sebelum breaker terbuka
+        self.BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))  # Detik sebelum panggilan percobaan (half-open)
+        self.RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', '0.2'))  # Retry maksimal per panggilan (rata-rata)
+        self.RETRY_BUDGET_TOKENS = int(os.getenv('RETRY_BUDGET_TOKENS', '10'))  # Retry beruntun yang boleh sekaligus
+        self.RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '10'))  # Detik tunggu terlama antar percobaan
+        self.SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', '900'))  # Detik sebelum cache sesi harian dimuat ulang
+        self.SESSION_NEGATIVE_TTL = int(os.getenv('SESSION_NEGATIVE_TTL', '300'))  # Detik mengingat "tidak ada sesi"
+        # Unduh foto paralel: thread pool untuk HTTP, process pool untuk ekstraksi SIFT
+        self.DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '8'))
+        self.EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+        self.DOWNLOAD_QUEUE_SIZE = int(os.getenv('DOWNLOAD_QUEUE_SIZE', '32'))  # Foto yang menunggu ekstraksi
+        self.SYNC_REMOVE_STALE = os.getenv('SYNC_REMOVE_STALE', 'true').lower() == 'true'  # Hapus fitur mahasiswa yang tidak aktif
+        # Galeri ringkas: batas keypoint per mahasiswa, tipe penyimpanan dan reduksi PCA
+        self.MAX_KEYPOINTS = int(os.getenv('MAX_KEYPOINTS', '0'))  # 0 = simpan semua keypoint
+        # Praproses foto referensi: decode diperkecil, crop wajah, normalisasi, tampilan augmentasi, deduplikasi
+        self.ENROL_PREPROCESS = os.getenv('ENROL_PREPROCESS', 'false').lower() == 'true'  # Mengubahnya mengekstrak ulang semua mahasiswa
+        self.ENROL_MAX_SIDE = int(os.getenv('ENROL_MAX_SIDE', '1024'))  # Sisi terpanjang foto setelah decode, 0 = ukuran asli
+        self.ENROL_FACE_SIZE = int(os.getenv('ENROL_FACE_SIZE', '256'))  # Sisi terpanjang crop wajah
+        self.ENROL_ILLUMINATION = os.getenv('ENROL_ILLUMINATION', 'stretch')  # 'stretch' (kontras persentil), 'clahe' atau 'none'
+        self.ENROL_VIEWS = int(os.getenv('ENROL_VIEWS', '4'))  # Tampilan augmentasi per mahasiswa (maks. 8)
+        self.ENROL_MAX_DESCRIPTORS = int(os.getenv('ENROL_MAX_DESCRIPTORS', '500'))  # 0 = tanpa batas
+        self.ENROL_DEDUP_DISTANCE = float(os.getenv('ENROL_DEDUP_DISTANCE', '0'))  # 0 = default per backend
+        self.ENROL_EXTRA_PHOTOS_DIR = os.getenv('ENROL_EXTRA_PHOTOS_DIR', os.path.join(self.PHOTO_DIR, 'extra'))  # <dir>/<student_id>/*.jpg
+        self.GALLERY_DTYPE = os.getenv('GALLERY_DTYPE', 'float32')  # float32, float16 atau uint8
+        self.GALLERY_PCA_DIMS = int(os.getenv('GALLERY_PCA_DIMS', '0'))  # 0 = tanpa PCA
+        self.SHORTLIST_SIZE = int(os.getenv('SHORTLIST_SIZE', '0'))  # Kandidat tahap kasar (VLAD), 0 = nonaktif
+        self.VOCABULARY_SIZE = int(os.getenv('VOCABULARY_SIZE', '32'))  # Jumlah visual word untuk VLAD
+        self.VOCABULARY_FILE = os.getenv('VOCABULARY_FILE', os.path.join(self.FEATURES_DIR, 'shortlist', 'vocabulary.npy'))  # Subdirektori, agar tidak terbaca sebagai file mahasiswa
+        self.INDEX_PARAMS_FILE = os.getenv('INDEX_PARAMS_FILE', os.path.join(self.FEATURES_DIR, 'index_params.json'))  # Hasil kalibrasi indeks, '' = abaikan
         self.TARGET_COURSES = ['Struktur Data', 'Algoritma Lanjut', 'Sistem Operasi']
         self.LOG_FILE = os.path.join(self.LOG_DIR, 'detection.log')
         self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -34,4 +128,16 @@ class Settings:
         # Create required directories
         os.makedirs(self.PHOTO_DIR, exist_ok=True)
         os.makedirs(self.FEATURES_DIR, exist_ok=True)
-        os.makedirs(self.LOG_DIR, exist_ok=True)
\ No newline at end of file
+        os.makedirs(self.LOG_DIR, exist_ok=True)
+
+_settings = None
+_settings_lock = threading.Lock()
+
+def get_settings():
+    """Shared Settings: the environment is read (and the directories created) once per process"""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
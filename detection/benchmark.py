@@ -0,0 +1,401 @@
+"""detection/benchmark.py"""
+
+import os
+import sys
+import time
+import platform
+import resource
+import numpy as np
+import cv2
+from detection.enrolment import EnrolmentPipeline
+from detection.feature_backend import FeatureBackend
+from detection.gallery import FeatureGallery
+from detection.matcher import FaceMatcher
+from detection.sharded_matcher import ShardedMatcher
+from utils.images import IMAGE_EXTENSIONS
+
+# Prefix of the student ids generated by scale_gallery
+SYNTHETIC_PREFIX = 'syn'
+
+# Percentiles reported for every stage
+PERCENTILES = (50, 90, 95, 99)
+
+def _perturb(descriptors, noise, bit_noise, rng):
+    """Gaussian noise for float descriptors, random bit flips for binary ones"""
+    if descriptors.dtype == np.uint8:
+        bits = np.unpackbits(descriptors, axis=1)
+        flips = (rng.random(bits.shape) < bit_noise).astype(np.uint8)
+        return np.packbits(bits ^ flips, axis=1)
+    noisy = descriptors + rng.normal(0, noise, descriptors.shape).astype(np.float32)
+    return np.clip(noisy, 0, None)
+
+def scale_gallery(gallery, students, noise=4.0, seed=0, bit_noise=0.05):
+    """
+    Grow a gallery to ``students`` entries with synthetic distractors.
+
+    Every synthetic student gets as many descriptors as a randomly chosen real
+    student, drawn from the pooled descriptors of all real students plus
+    noise. They share the statistics of real descriptors without belonging
+    to any one face, so they load the matcher like extra enrolments.
+    Args:
+        gallery (FeatureGallery): Real gallery (kept as the first entries)
+        students (int): Total number of students wanted
+        noise (float): Standard deviation of the added noise
+        bit_noise (float): Share of flipped bits for binary descriptors
+    Returns:
+        FeatureGallery: Scaled gallery (the input if it is already large enough)
+    """
+    extra = students - len(gallery)
+    if extra <= 0:
+        return gallery
+
+    rng = np.random.default_rng(seed)
+    pool = gallery.working_descriptors()
+    sizes = np.diff(gallery.offsets)
+    features = dict(gallery.working_items())
+    for i in range(extra):
+        count = int(rng.choice(sizes))
+        rows = rng.integers(0, len(pool), count)
+        features[f"{SYNTHETIC_PREFIX}{i:06d}"] = _perturb(pool[rows], noise, bit_noise, rng)
+    return FeatureGallery.from_features(features, backend=gallery.backend)
+
+def descriptor_probes(gallery, per_student=2, sample=300, noise=8.0, seed=0, bit_noise=0.1):
+    """
+    Synthetic queries for identification accuracy without camera frames:
+    noisy subsets of every real student's descriptors.
+    Returns:
+        list: (student_id, descriptors) pairs
+    """
+    rng = np.random.default_rng(seed)
+    probes = []
+    for student_id in gallery.student_ids:
+        if student_id.startswith(SYNTHETIC_PREFIX):
+            continue
+        reference = gallery.get(student_id)
+        reference = np.asarray(reference, dtype=np.uint8 if gallery.binary else np.float32)
+        for _ in range(per_student):
+            rows = rng.choice(len(reference), min(sample, len(reference)), replace=False)
+            probes.append((student_id, np.ascontiguousarray(_perturb(reference[rows], noise, bit_noise, rng))))
+    return probes
+
+def negative_probes(frames, extractor):
+    """
+    Descriptors of frames without an enrolled face; these should match nobody
+    Returns:
+        list: (None, descriptors) pairs
+    """
+    probes = []
+    for _, frame in frames:
+        _, descriptors = extractor.detectAndCompute(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), None)
+        if descriptors is not None:
+            probes.append((None, descriptors))
+    return probes
+
+def synthetic_frames(count, width=640, height=480, seed=0):
+    """
+    Textured BGR frames for latency runs when no recorded frames are available.
+    They contain no enrolled face, so they are labelled None.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        frame = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_CUBIC)
+        for _ in range(12):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.circle(frame, center, int(rng.integers(10, 80)), color, -1)
+        frames.append((None, cv2.GaussianBlur(frame, (3, 3), 0)))
+    return frames
+
+def load_video_frames(path, limit=None):
+    """Decode a recorded video into unlabelled frames"""
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while limit is None or len(frames) < limit:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append((None, frame))
+    capture.release()
+    return frames
+
+def summarise(seconds):
+    """
+    Latency summary of one stage
+    Returns:
+        dict: count, mean/max and percentiles in milliseconds, throughput per second
+    """
+    if not seconds:
+        return {'count': 0}
+    ms = np.asarray(seconds) * 1000
+    summary = {
+        'count': len(ms),
+        'mean_ms': float(ms.mean()),
+        'max_ms': float(ms.max()),
+        'per_second': float(len(ms) / (ms.sum() / 1000)) if ms.sum() else 0.0,
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = float(np.percentile(ms, p))
+    return summary
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def environment():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine(),
+    }
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def run_stages(matcher, detector, extractor, frames, extract, repeat=1):
+    """
+    Replay frames through every pipeline stage
+    Args:
+        matcher (FaceMatcher): Matcher under test
+        detector (FaceDetector): Detector whose ``process_frame`` is timed
+        extractor: Feature extractor for the standalone extraction stages
+        frames (list): (label, frame) pairs
+        extract (callable): Enrolment extraction, ``extract(extractor, gray)``
+        repeat (int): Number of passes over the frames
+    Returns:
+        tuple: (stage timings in seconds, predictions of the first pass)
+    """
+    timings = {'extract': [], 'extract_features': [], 'match_face': [], 'process_frame': []}
+    predictions = []
+    for iteration in range(repeat):
+        for _, frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            _, elapsed = _timed(extractor.detectAndCompute, gray, None)
+            timings['extract'].append(elapsed)
+
+            try:
+                _, elapsed = _timed(extract, extractor, gray)
+                timings['extract_features'].append(elapsed)
+            except ValueError:
+                # Too few keypoints: the downloader would reject this photo too
+                pass
+
+            (detected_face, _, _), elapsed = _timed(matcher.match_face, frame)
+            timings['match_face'].append(elapsed)
+            if iteration == 0:
+                predictions.append(detected_face)
+
+            _, elapsed = _timed(detector.process_frame, frame, matcher)
+            timings['process_frame'].append(elapsed)
+    return timings, predictions
+
+def run_probes(matcher, probes):
+    """
+    Identify descriptor probes with ``match_descriptors``
+    Returns:
+        tuple: (seconds per probe, predictions)
+    """
+    timings, predictions = [], []
+    for _, descriptors in probes:
+        (detected_face, _, _), elapsed = _timed(matcher.match_descriptors, descriptors)
+        timings.append(elapsed)
+        predictions.append(detected_face)
+    return timings, predictions
+
+def accuracy(labels, predictions):
+    """
+    Identification accuracy split into enrolled and non-enrolled queries
+    Returns:
+        dict: Overall accuracy, true-positive rate and false-positive rate
+    """
+    total = len(labels)
+    positives = [(label, prediction) for label, prediction in zip(labels, predictions) if label is not None]
+    negatives = [prediction for label, prediction in zip(labels, predictions) if label is None]
+    return {
+        'queries': total,
+        'accuracy': sum(l == p for l, p in zip(labels, predictions)) / total if total else None,
+        'true_positive_rate': (sum(l == p for l, p in positives) / len(positives)) if positives else None,
+        'false_positive_rate': (sum(p is not None for p in negatives) / len(negatives)) if negatives else None,
+    }
+
+def compare_reports(baseline, current, tolerance=0.10, accuracy_tolerance=0.02):
+    """
+    List regressions of ``current`` against ``baseline``
+    Args:
+        tolerance (float): Allowed relative increase of p50/p99 latency
+        accuracy_tolerance (float): Allowed absolute accuracy drop
+    Returns:
+        list: Human-readable regression descriptions (empty if none)
+    """
+    regressions = []
+    for stage, summary in current.get('stages', {}).items():
+        previous = baseline.get('stages', {}).get(stage, {})
+        for key in ('p50_ms', 'p99_ms'):
+            if key in summary and previous.get(key):
+                change = summary[key] / previous[key] - 1
+                if change > tolerance:
+                    regressions.append(f"{stage} {key}: {previous[key]:.2f} -> {summary[key]:.2f} ({change:+.0%})")
+
+    for source, result in current.get('accuracy', {}).items():
+        previous = baseline.get('accuracy', {}).get(source) or {}
+        if not result or previous.get('accuracy') is None or result.get('accuracy') is None:
+            continue
+        if previous['accuracy'] - result['accuracy'] > accuracy_tolerance:
+            regressions.append(f"{source} accuracy: {previous['accuracy']:.1%} -> {result['accuracy']:.1%}")
+    return regressions
+
+def load_photos(photos_dir):
+    """
+    Enrolment photos laid out as ``photos_dir/<student_id>.jpg``
+    Returns:
+        dict: ``{student_id: grayscale photo}``, sorted by student id
+    """
+    photos = {}
+    for file in sorted(os.listdir(photos_dir)):
+        student_id, extension = os.path.splitext(file)
+        if extension.lower() in IMAGE_EXTENSIONS:
+            photo = cv2.imread(os.path.join(photos_dir, file), cv2.IMREAD_GRAYSCALE)
+            if photo is not None:
+                photos[student_id] = photo
+    return photos
+
+def augmented_views(photos, per_photo=3, width=640, height=480, seed=0):
+    """
+    Labelled test frames made from the enrolment photos when no recorded
+    frames exist: every photo is scaled, rotated, re-lit, blurred and pasted
+    onto a synthetic background, as a camera view of the student would be.
+    Returns:
+        list: (student_id, BGR frame) pairs
+    """
+    rng = np.random.default_rng(seed)
+    backgrounds = synthetic_frames(len(photos) * per_photo, width, height, seed=seed + 1)
+    frames = []
+    for student_id, photo in photos.items():
+        for _ in range(per_photo):
+            scale = min(width, height) * rng.uniform(0.5, 0.9) / max(photo.shape)
+            angle = rng.uniform(-15, 15)
+            h, w = photo.shape
+            matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, scale)
+            x = rng.uniform(0, max(width - w * scale, 0))
+            y = rng.uniform(0, max(height - h * scale, 0))
+            matrix[:, 2] += (x - w / 2 + w * scale / 2, y - h / 2 + h * scale / 2)
+
+            face = cv2.warpAffine(photo, matrix, (width, height))
+            mask = cv2.warpAffine(np.full_like(photo, 255), matrix, (width, height)) > 0
+            face = cv2.convertScaleAbs(face, alpha=rng.uniform(0.7, 1.3), beta=rng.uniform(-30, 30))
+            face = cv2.GaussianBlur(face, (3, 3), rng.uniform(0.1, 1.2))
+
+            frame = backgrounds[len(frames)][1].copy()
+            frame[mask] = cv2.cvtColor(face, cv2.COLOR_GRAY2BGR)[mask]
+            frames.append((student_id, frame))
+    return frames
+
+def compare_backends(backends, photos, frames, extract, min_match_count=None, pipeline=False):
+    """
+    Enrol the same photos with every backend and identify the same frames
+    Args:
+        backends (list): (name, index) pairs, e.g. ('orb', 'flann')
+        photos (dict): Enrolment photos from ``load_photos``
+        frames (list): (label, frame) pairs
+        extract (callable): Enrolment extraction, ``extract(extractor, gray)``
+        min_match_count (int): Matcher threshold (default: MIN_MATCH_COUNT)
+        pipeline (bool): Enrol through ``EnrolmentPipeline`` (face crop,
+            normalisation, views, deduplication) instead of ``extract``
+    Returns:
+        dict: Per backend, enrolment and matching latency, gallery size and accuracy
+    """
+    labels = [label for label, _ in frames]
+    results = {}
+    for name, index in backends:
+        backend = FeatureBackend(name, index)
+        extractor = backend.create_extractor()
+        enrolment = EnrolmentPipeline(backend) if pipeline else None
+        features, points, enrol_timings = {}, {}, []
+        for student_id, photo in photos.items():
+            try:
+                if enrolment is not None:
+                    (positions, descriptors, _), elapsed = _timed(enrolment.enrol, extractor, [photo])
+                else:
+                    (keypoints, descriptors), elapsed = _timed(extract, extractor, photo)
+                    positions = cv2.KeyPoint_convert(keypoints)
+            except ValueError:
+                continue
+            enrol_timings.append(elapsed)
+            features[student_id] = descriptors
+            points[student_id] = positions
+
+        gallery = FeatureGallery.from_features(features, points, backend.name)
+        matcher = FaceMatcher(gallery=gallery, shortlist_size=0, min_match_count=min_match_count, backend=backend)
+
+        extract_timings, match_timings, predictions = [], [], []
+        for _, frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            _, elapsed = _timed(extractor.detectAndCompute, gray, None)
+            extract_timings.append(elapsed)
+            (detected_face, _, _), elapsed = _timed(matcher.match_face, frame)
+            match_timings.append(elapsed)
+            predictions.append(detected_face)
+
+        results[f"{name}/{index}"] = {
+            'students': len(gallery),
+            'skipped_photos': len(photos) - len(gallery),
+            'descriptors_per_student': gallery.size / max(len(gallery), 1),
+            'gallery_megabytes': gallery.nbytes / 1e6,
+            'enrol_extract': summarise(enrol_timings),
+            'frame_extract': summarise(extract_timings),
+            'match_face': summarise(match_timings),
+            'accuracy': accuracy(labels, predictions),
+        }
+    return results
+
+def shard_scaling(gallery, probes, worker_counts, backend=None, min_match_count=None, repeat=1):
+    """
+    Latency of gallery matching in one process and sharded over worker processes
+    Args:
+        gallery (FeatureGallery): Gallery to shard
+        probes (list): (label, descriptors) pairs, as from ``descriptor_probes``
+        worker_counts (list): Worker process counts to measure, e.g. [1, 2, 4]
+        backend (FeatureBackend): Index settings shared by every configuration
+    Returns:
+        dict: 'in_process' timing and, per worker count, timing, speedup over the
+              in-process matcher, scaling efficiency (speedup / workers) and
+              agreement with the in-process identities (FLANN indexes are
+              randomised per process, so borderline probes can differ; exact
+              'bf' search agrees fully)
+    """
+    def _measure(matcher):
+        timings, predictions = [], []
+        for _ in range(repeat):
+            seconds, predictions = run_probes(matcher, probes)
+            timings += seconds
+        return timings, predictions
+
+    options = dict(gallery=gallery, mode='gallery', shortlist_size=0, min_match_count=min_match_count,
+                   backend=backend or FeatureBackend(gallery.backend))
+    in_process_timings, expected = _measure(FaceMatcher(**options))
+    results = {'cpu_count': os.cpu_count(), 'in_process': summarise(in_process_timings), 'workers': {}}
+
+    baseline = float(np.mean(in_process_timings)) if in_process_timings else 0.0
+    for workers in worker_counts:
+        matcher = ShardedMatcher(workers=workers, **options)
+        try:
+            timings, predictions = _measure(matcher)
+        finally:
+            matcher.close()
+        mean = float(np.mean(timings)) if timings else 0.0
+        speedup = baseline / mean if mean else 0.0
+        results['workers'][str(workers)] = {
+            **summarise(timings),
+            'speedup': speedup,
+            'efficiency': speedup / workers,
+            'agreement': float(np.mean([a == b for a, b in zip(expected, predictions)])) if probes else 1.0,
+        }
+    return results
+
@@ -0,0 +1,127 @@
+"""detection/calibration.py"""
+
+import time
+import numpy as np
+from detection.feature_backend import FeatureBackend
+from detection.matcher import RATIO
+
+# FLANN index algorithms swept for float descriptors
+_KDTREE = 1
+_KMEANS = 2
+_LSH = 6
+_AUTOTUNED = 255
+
+def candidate_configs(backend_name):
+    """
+    Index configurations to try for a backend
+    Returns:
+        list: (label, index type, index_params, search_params)
+    """
+    configs = []
+    if FeatureBackend(backend_name, 'bf').binary:
+        for table_number in (6, 12):
+            for key_size in (12, 16, 20):
+                for multi_probe_level in (0, 1, 2):
+                    configs.append((
+                        f"lsh tables={table_number} key={key_size} probe={multi_probe_level}", 'flann',
+                        dict(algorithm=_LSH, table_number=table_number, key_size=key_size,
+                             multi_probe_level=multi_probe_level),
+                        dict(checks=32)
+                    ))
+    else:
+        for trees in (1, 2, 4, 8):
+            for checks in (16, 32, 64, 128, 256):
+                configs.append((f"kdtree trees={trees} checks={checks}", 'flann',
+                                dict(algorithm=_KDTREE, trees=trees), dict(checks=checks)))
+        for branching in (16, 32):
+            for checks in (32, 64, 128):
+                configs.append((f"kmeans branching={branching} checks={checks}", 'flann',
+                                dict(algorithm=_KMEANS, branching=branching, iterations=11), dict(checks=checks)))
+        # OpenCV's Python bindings only pass integer FLANN parameters, so the
+        # autotuned index runs with its defaults (target precision 0.8)
+        configs.append(("autotuned", 'flann', dict(algorithm=_AUTOTUNED), dict(checks=32)))
+    configs.append(("brute force", 'bf', {}, {}))
+    return configs
+
+def _identify(distances, labels, n_students, min_match_count):
+    good = distances[:, 0] < RATIO * distances[:, 1]
+    votes = np.bincount(labels[good], minlength=n_students)
+    best = int(np.argmax(votes))
+    return best if votes[best] >= min_match_count else None
+
+def calibrate(gallery, frame_descriptors, target_recall=0.9, target_agreement=0.98, sample=20000,
+              min_match_count=10, seed=0, progress=None):
+    """
+    Sweep index configurations against exact (brute-force) neighbours.
+
+    Gallery rows (up to ``sample``) are the queries and every frame's
+    descriptors the indexed data, as in ``FaceMatcher._match_gallery``.
+    Recall is the share of queries whose nearest neighbour is as close as the
+    exact one; agreement is the share of frames identified as the same
+    student (or nobody) as with exact search.
+    Args:
+        gallery (FeatureGallery): Gallery to calibrate for
+        frame_descriptors (list): Descriptors of sample frames, already projected
+        progress (callable): Called with every finished result
+    Returns:
+        dict: 'results' for every configuration (fastest first) and the
+              'chosen' one, or None when no configuration meets the targets
+    """
+    queries = gallery.working_descriptors()
+    labels = gallery.labels
+    if gallery.size > sample:
+        rows = np.sort(np.random.default_rng(seed).choice(gallery.size, sample, replace=False))
+        queries, labels = queries[rows], labels[rows]
+
+    frame_descriptors = [descriptors for descriptors in frame_descriptors if len(descriptors) >= 2]
+    if not frame_descriptors:
+        raise ValueError("No frame has enough descriptors to calibrate with")
+
+    exact_backend = FeatureBackend(gallery.backend, 'bf')
+    exact = []
+    for descriptors in frame_descriptors:
+        _, distances = exact_backend.knn_search(descriptors, queries)
+        exact.append((distances[:, 0], _identify(distances, labels, len(gallery), min_match_count)))
+
+    results = []
+    for label, index, index_params, search_params in candidate_configs(gallery.backend):
+        backend = FeatureBackend(gallery.backend, index)
+        backend.index_params = index_params
+        backend.search_params = search_params
+        # Autotuning happens on every index build (once per frame), so one frame shows its cost
+        frames = frame_descriptors[:1] if index_params.get('algorithm') == _AUTOTUNED else frame_descriptors
+
+        found = agreed = 0
+        elapsed = []
+        for descriptors, (exact_nearest, exact_identity) in zip(frames, exact):
+            start = time.perf_counter()
+            _, distances = backend.knn_search(descriptors, queries)
+            elapsed.append(time.perf_counter() - start)
+            found += np.count_nonzero(distances[:, 0] <= exact_nearest * (1 + 1e-4) + 1e-3)
+            agreed += _identify(distances, labels, len(gallery), min_match_count) == exact_identity
+
+        result = {
+            'label': label,
+            'index': index,
+            'index_params': index_params,
+            'search_params': search_params,
+            'recall': found / (len(frames) * len(queries)),
+            'agreement': agreed / len(frames),
+            'search_ms': float(np.mean(elapsed) * 1000),
+            'frames': len(frames),
+        }
+        results.append(result)
+        if progress:
+            progress(result)
+
+    results.sort(key=lambda result: result['search_ms'])
+    passing = [
+        result for result in results
+        if result['recall'] >= target_recall and result['agreement'] >= target_agreement
+    ]
+    return {
+        'queries': len(queries),
+        'frames': len(frame_descriptors),
+        'results': results,
+        'chosen': passing[0] if passing else None,
+    }
@@ -6,25 +6,64 @@ os.environ['TZ'] = 'Asia/Jakarta'
 time.tzset()
 
 import logging
-from config.settings import Settings
+import cv2
+from config.settings import get_settings
+from detection.frame_gate import FrameGate, STATIC
+from detection.tracker import FaceTracker, LOST_VERIFICATION
 from services.attendance_service import AttendanceService
-from utils.retry import retry
+from utils import metrics
 
-settings = Settings()
+settings = get_settings()
 logger = logging.getLogger('face_detection.detector')
 
+_PROCESS_FRAME_SECONDS = metrics.stage('process_frame')
+_VERIFY_SECONDS = metrics.stage('track_verify')
+
 class FaceDetector:
-    def __init__(self):
-        self.attendance_service = AttendanceService()
+    def __init__(self, attendance_service=None, camera_id=None, gate=None, attendance_writer=None, tracker=None):
+        # Detectors of several cameras can share one AttendanceService (and its DB pool)
+        self.attendance_service = attendance_service or AttendanceService()
+        # With a writer, attendance is queued and written in batches off the frame loop
+        self.attendance_writer = attendance_writer
+        self.camera_id = camera_id
+        # The gate keeps a per-camera background model, so each detector owns one
+        self.gate = gate if gate is not None else (FrameGate() if settings.FRAME_GATE else None)
+        # Follows the identified face between full matches (per camera, like the gate)
+        self.tracker = tracker if tracker is not None else (FaceTracker() if settings.FACE_TRACKING else None)
+        self.last_result = (None, 0, [])
         self.current_detection = None
         self.detection_start_time = None
+        # Multi-face mode times every identity in view separately (the tracker is not used)
+        self.multi_face = settings.MULTI_FACE
+        self.last_faces = []
+        self.detection_starts = {}
         self.logged_faces = set()
         self.last_attendance_time = {}
 
-    @retry(max_retries=3, delay=1)
+    @metrics.timed(_PROCESS_FRAME_SECONDS)
     def process_frame(self, frame, matcher):
         try:
-            detected_face, max_matches, good_matches = matcher.match_face(frame)
+            if self.gate is not None:
+                admitted, reason = self.gate.admit(frame)
+                if not admitted:
+                    metrics.counter('frames_skipped_total', 'Frames not matched by the frame gate', reason=reason).inc()
+                if not admitted and reason != STATIC:
+                    # Unusable frame: no evidence either way, leave the timing state as is
+                    return
+                if self.multi_face:
+                    self._update_identities(self.last_faces if not admitted else matcher.match_faces(frame))
+                    return
+                if not admitted:
+                    # Nothing moved since the last match, so its result still holds
+                    detected_face, max_matches, good_matches = self.last_result
+                else:
+                    detected_face, max_matches, good_matches = self._identify(frame, matcher)
+            elif self.multi_face:
+                self._update_identities(matcher.match_faces(frame))
+                return
+            else:
+                detected_face, max_matches, good_matches = self._identify(frame, matcher)
+            self.last_result = (detected_face, max_matches, good_matches)
             
             if detected_face == self.current_detection and detected_face is not None:
                 detection_duration = time.time() - self.detection_start_time
@@ -43,8 +82,64 @@ class FaceDetector:
             logger.error(f"Error processing frame: {e}")
             raise
 
+    def _update_identities(self, faces):
+        """
+        Per-identity version of the duration check in ``process_frame``: each
+        student in view keeps their own start time, and leaving the frame resets it.
+        Args:
+            faces (list): FaceMatch results of the current frame
+        """
+        self.last_faces = faces
+        now = time.time()
+        present = {face.student_id: face for face in faces}
+        for student_id in list(self.detection_starts):
+            if student_id not in present:
+                del self.detection_starts[student_id]
+
+        for student_id, face in present.items():
+            start = self.detection_starts.setdefault(student_id, now)
+            if now - start >= settings.REQUIRED_DETECTION_DURATION:
+                self._log_detection(student_id, face.matches)
+
+                if student_id not in self.logged_faces:
+                    self._record_attendance(student_id)
+                    self.logged_faces.add(student_id)
+
+    def _identify(self, frame, matcher):
+        """
+        Full gallery match, or the tracked identity while the track holds.
+        Returns:
+            tuple: (student_id or None, match count, good matches) like ``match_face``;
+                   good matches are empty for tracked frames
+        """
+        if self.tracker is None:
+            return matcher.match_face(frame)
+
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        tracker = self.tracker
+        if tracker.active and tracker.update(gray):
+            if not tracker.due_for_verification():
+                return tracker.student_id, tracker.matches, []
+
+            # Re-verify against the tracked student only, on the tracked region
+            x0, y0, x1, y1 = tracker.region(gray.shape)
+            with _VERIFY_SECONDS.time():
+                matches = matcher.verify(tracker.student_id, gray[y0:y1, x0:x1])
+            if matches >= matcher.min_match_count:
+                tracker.confirm(matches)
+                return tracker.student_id, matches, []
+            tracker.stop(LOST_VERIFICATION)
+
+        # No track (or it was just lost): full search, and track whatever it finds
+        detected_face, max_matches, good_matches, points = matcher.locate_face(gray)
+        if detected_face is not None:
+            tracker.start(gray, detected_face, points, max_matches)
+        return detected_face, max_matches, good_matches
+
     def _log_detection(self, detected_face, matches_count):
         log_message = f"Detected {detected_face} (Matches: {matches_count})"
+        if self.camera_id is not None:
+            log_message = f"[{self.camera_id}] {log_message}"
         logger.info(log_message)
 
     def _record_attendance(self, student_id):
@@ -56,7 +151,10 @@ class FaceDetector:
             
         try:
             date_str = time.strftime("%Y-%m-%d")
-            success = self.attendance_service.record_attendance(student_id, date_str)
+            if self.attendance_writer is not None:
+                success = self.attendance_writer.submit(student_id, date_str, now)
+            else:
+                success = self.attendance_service.record_attendance(student_id, date_str)
             if success:
                 self.last_attendance_time[student_id] = now
         except Exception as e:
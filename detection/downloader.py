@@ -1,35 +1,132 @@
 """detection/downloader.py"""
 
 import os
+import json
+import time
+import queue
+import hashlib
+import threading
 import numpy as np
 import cv2
 import requests
 import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
 from sqlalchemy import text
-from config.database import DatabaseConfig
-from config.settings import Settings
+from config.database import get_database
+from config.settings import get_settings
+from detection.enrolment import (
+    EnrolmentPipeline, decode_photo, extra_photos_fingerprint, load_extra_photos, select_keypoints
+)
+from detection.feature_backend import FeatureBackend
+from detection.gallery import FeatureGallery, KEYPOINTS_DIR, student_feature_files
 from models.student import Student
-from utils.retry import retry
+from utils.retry import circuit_breaker, retry
 
 # Initialize settings and database
-settings = Settings()
-db_config = DatabaseConfig()
+settings = get_settings()
+
+# Only an unreachable or unresponsive photo server opens the breaker; a missing photo (404) does not
+circuit_breaker('photo_http', trip_on=(requests.ConnectionError, requests.Timeout))
+
+MIN_DESCRIPTORS = 10
+
+# Face crop, normalisation, augmented views and deduplication (None: whole photo as downloaded)
+_enrolment = EnrolmentPipeline() if settings.ENROL_PREPROCESS else None
+
+# Recorded in the manifest; features extracted with other parameters are re-extracted
+EXTRACTOR_PARAMS = {
+    'extractor': settings.FEATURE_BACKEND,
+    'min_descriptors': MIN_DESCRIPTORS,
+    'max_keypoints': settings.MAX_KEYPOINTS,
+    'keypoint_positions': True,
+    'enrolment': _enrolment.params if _enrolment else None,
+    'opencv': cv2.__version__,
+}
+
+# Extractor of an extraction worker process (created on first use)
+_worker_extractor = None
+
+def extract_descriptors(extractor, image, max_keypoints=None):
+    """
+    Run the feature extractor on a grayscale image
+    Returns:
+        tuple: (keypoints, descriptors), capped to MAX_KEYPOINTS
+    Raises:
+        ValueError: If fewer than MIN_DESCRIPTORS descriptors are found
+    """
+    keypoints, descriptors = extractor.detectAndCompute(image, None)
+    if descriptors is None or len(descriptors) < MIN_DESCRIPTORS:
+        raise ValueError("Not enough features detected")
+    max_keypoints = settings.MAX_KEYPOINTS if max_keypoints is None else max_keypoints
+    return select_keypoints(keypoints, descriptors, max_keypoints)
+
+def enrol_student(extractor, images):
+    """
+    Descriptor set of one student from their photos (the primary one first)
+    Returns:
+        tuple: (Nx2 keypoint positions, descriptors, counts) where counts has at
+               least 'extracted' and 'kept'
+    Raises:
+        ValueError: If fewer than MIN_DESCRIPTORS descriptors are left
+    """
+    if _enrolment is not None:
+        return _enrolment.enrol(extractor, images, MIN_DESCRIPTORS)
+    keypoints, descriptors = extractor.detectAndCompute(images[0], None)
+    if descriptors is None or len(descriptors) < MIN_DESCRIPTORS:
+        raise ValueError("Not enough features detected")
+    extracted = len(descriptors)
+    keypoints, descriptors = select_keypoints(keypoints, descriptors, settings.MAX_KEYPOINTS)
+    return cv2.KeyPoint_convert(keypoints), descriptors, {'extracted': extracted, 'kept': len(descriptors)}
+
+def _extract_in_worker(images):
+    """Process-pool entry point: keypoints are not picklable, so their positions are returned instead"""
+    global _worker_extractor
+    if _worker_extractor is None:
+        _worker_extractor = FeatureBackend().create_extractor()
+    return enrol_student(_worker_extractor, images)
+
+def _save_atomic(path, array):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
 
 class PhotoDownloader:
     def __init__(self):
-        """Initialize the downloader with SIFT detector and required directories"""
-        self.sift = cv2.SIFT_create()
+        """Initialize the downloader with the feature extractor and required directories"""
+        self.backend = FeatureBackend()
+        self.extractor = self.backend.create_extractor()
+        self.http = self._init_http()
         self._ensure_directories()
         self.processed_files = set()
+        self.saved_count = 0
         self._load_existing_features()
+        self.manifest = self._load_manifest()
+        self.report = dict.fromkeys(('added', 'updated', 'removed', 'unchanged', 'failed'), 0)
+        # Descriptors found in the photos vs. kept for the gallery, over the students extracted in this run
+        self.report.update(descriptors_extracted=0, descriptors_kept=0)
         
         # Configure logging
         self.logger = logging.getLogger('face_detection.downloader')
         self.logger.setLevel(settings.LOG_LEVEL)
 
+    def _init_http(self):
+        """Shared HTTP session so photo downloads reuse pooled connections"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.DOWNLOAD_WORKERS,
+            pool_maxsize=settings.DOWNLOAD_WORKERS
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['User-Agent'] = 'FaceDetectionApp/1.0'
+        return session
+
     def _ensure_directories(self):
         """Ensure required directories exist"""
         os.makedirs(settings.FEATURES_DIR, exist_ok=True)
+        os.makedirs(os.path.join(settings.FEATURES_DIR, KEYPOINTS_DIR), exist_ok=True)
         os.makedirs(settings.PHOTO_DIR, exist_ok=True)
         
         # Debugging: Print the paths to verify
@@ -40,11 +137,75 @@ class PhotoDownloader:
         """Load already processed files to avoid re-processing"""
         if os.path.exists(settings.FEATURES_DIR):
             self.processed_files = {
-                f.split('.')[0] for f in os.listdir(settings.FEATURES_DIR) 
-                if f.endswith('.npy')
+                student_id for student_id, _ in student_feature_files(settings.FEATURES_DIR)
+            }
+        if os.path.exists(settings.GALLERY_FILE):
+            self.processed_files.update(FeatureGallery.open(settings.GALLERY_FILE).student_ids)
+
+    def _load_manifest(self):
+        """
+        Load the sync manifest: per student photo URL, HTTP validators,
+        content hash, extractor parameters and extraction time
+        """
+        if not os.path.exists(settings.MANIFEST_FILE):
+            return {}
+        with open(settings.MANIFEST_FILE) as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        tmp_path = f"{settings.MANIFEST_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, settings.MANIFEST_FILE)
+
+    def _cached_entry(self, student):
+        """
+        Manifest entry usable for a conditional request, or None when the photo
+        must be fetched and extracted unconditionally
+        """
+        entry = self.manifest.get(student.student_id)
+        if (entry
+                and student.student_id in self.processed_files
+                and entry.get('photo_url') == student.photo_url
+                and entry.get('extractor') == EXTRACTOR_PARAMS
+                and entry.get('extra_photos', []) == self._extra_fingerprint(student.student_id)):
+            return entry
+        return None
+
+    @staticmethod
+    def _extra_fingerprint(student_id):
+        return extra_photos_fingerprint(student_id) if _enrolment is not None else []
+
+    def _record_photo(self, student_id, photo, extracted):
+        """Update the manifest after a photo was extracted or confirmed unchanged"""
+        if extracted:
+            self.manifest[student_id] = {
+                **photo,
+                'extractor': EXTRACTOR_PARAMS,
+                'extracted_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
             }
+        else:
+            self.manifest[student_id] = {**self.manifest[student_id], **photo}
 
-    @retry(max_retries=3, delay=1, backoff=2)
+    def _remove_stale(self, active_ids):
+        """Delete features of students no longer returned by get_students_with_photos"""
+        stale = (self.processed_files | set(self.manifest)) - set(active_ids)
+        for student_id in sorted(stale):
+            feature_path = os.path.join(settings.FEATURES_DIR, f"{student_id}.npy")
+            points_path = os.path.join(settings.FEATURES_DIR, KEYPOINTS_DIR, f"{student_id}.npy")
+            try:
+                for path in (feature_path, points_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.processed_files.discard(student_id)
+                self.manifest.pop(student_id, None)
+                self.report['removed'] += 1
+                self.logger.info(f"Removed features of inactive student: {student_id}")
+            except OSError as e:
+                self.logger.error(f"Failed to remove features for {student_id}: {str(e)}")
+        return len(stale)
+
+    @retry(max_retries=3, delay=1, backoff=2, dependency='db')
     def get_students_with_photos(self):
         """
         Retrieve students with photos from database
@@ -53,7 +214,7 @@ class PhotoDownloader:
         """
         students = []
         try:
-            with db_config.get_session() as session:
+            with get_database().get_session() as session:
                 query = text("""
                     SELECT DISTINCT s.student_id, s.name, s.photo as photo_url
                     FROM Students s
@@ -96,67 +257,120 @@ class PhotoDownloader:
             self.logger.error(f"Failed to fetch students from database: {str(e)}")
             raise
 
-    @retry(max_retries=3, delay=2, backoff=2)
-    def _download_photo(self, student):
+    @retry(max_retries=3, delay=2, backoff=2, dependency='photo_http')
+    def _fetch_photo(self, student, cached=None):
+        """
+        Fetch a student photo (the retried I/O step of ``_download_photo``)
+        Returns:
+            tuple: (photo bytes, or None if the photo is unchanged; photo metadata)
+        """
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.http.get(student.photo_url, timeout=10, headers=headers)
+        if cached and response.status_code == 304:
+            return None, {}
+        response.raise_for_status()
+
+        photo = {
+            'photo_url': student.photo_url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash': hashlib.sha256(response.content).hexdigest(),
+        }
+        # Server without validators: fall back to comparing content
+        if cached and cached.get('content_hash') == photo['content_hash']:
+            return None, photo
+        return response.content, photo
+
+    def _download_photo(self, student, cached=None):
         """
         Download individual student photo
         Args:
             student (Student): Student object containing photo_url
+            cached (dict): Manifest entry; makes the request conditional
         Returns:
-            np.ndarray: Downloaded image in grayscale
+            tuple: (grayscale images, the downloaded photo first and then the
+                    student's extra photos, or None if nothing changed; photo metadata)
         """
         try:
-            response = requests.get(
-                student.photo_url,
-                timeout=10,
-                headers={'User-Agent': 'FaceDetectionApp/1.0'}
-            )
-            response.raise_for_status()
-            
-            img_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-            img = cv2.imdecode(img_array, cv2.IMREAD_GRAYSCALE)
-            
-            if img is None:
-                raise ValueError("Failed to decode image")
-                
-            return img
+            content, photo = self._fetch_photo(student, cached)
+            if content is None:
+                return None, photo
+
+            # Decoding is not retried: a corrupt photo stays corrupt
+            if _enrolment is None:
+                return [decode_photo(content, 0)], photo
+            extra, photo['extra_photos'] = load_extra_photos(student.student_id)
+            return [decode_photo(content)] + extra, photo
             
         except Exception as e:
             self.logger.error(f"Failed to download photo for {student.student_id}: {str(e)}")
             raise
 
-    def _extract_features(self, image):
+    def _extract_features(self, images):
         """
-        Extract SIFT features from an image
+        Extract features (FEATURE_BACKEND) from a student's photos
         Args:
-            image (np.ndarray): Grayscale image
+            images (list): Grayscale images, the primary photo first
         Returns:
-            tuple: (keypoints, descriptors) or (None, None) if extraction fails
+            tuple: (keypoint positions, descriptors, counts) or (None, None, None) if extraction fails
         """
         try:
-            keypoints, descriptors = self.sift.detectAndCompute(image, None)
-            if descriptors is None or len(descriptors) < 10:
-                raise ValueError("Not enough features detected")
-            return keypoints, descriptors
+            return enrol_student(self.extractor, images)
         except Exception as e:
             self.logger.warning(f"Feature extraction failed: {str(e)}")
-            return None, None
+            return None, None, None
 
-    def _save_features(self, student_id, descriptors):
+    def _count_descriptors(self, student_id, counts):
+        self.report['descriptors_extracted'] += counts['extracted']
+        self.report['descriptors_kept'] += counts['kept']
+        self.logger.debug(
+            f"Descriptors of {student_id}: " + ", ".join(f"{key}={value}" for key, value in counts.items())
+        )
+
+    def _save_features(self, student_id, descriptors, points=None):
         """
-        Save SIFT descriptors to disk
+        Save descriptors (and their keypoint positions) to disk
         Args:
             student_id (str): Student ID
-            descriptors (np.ndarray): SIFT descriptors
+            descriptors (np.ndarray): Descriptors of the configured backend
+            points (np.ndarray): Nx2 keypoint positions, used for geometric verification
         """
         try:
             feature_path = os.path.join(settings.FEATURES_DIR, f"{student_id}.npy")
-            np.save(feature_path, descriptors)
+            # Positions first: the matcher reloads when the descriptor file changes
+            if points is not None:
+                _save_atomic(os.path.join(settings.FEATURES_DIR, KEYPOINTS_DIR, f"{student_id}.npy"), points)
+            # Write then rename so a running FaceMatcher never reloads a partial file
+            _save_atomic(feature_path, descriptors)
             self.processed_files.add(student_id)
+            self.saved_count += 1
         except Exception as e:
             self.logger.error(f"Failed to save features for {student_id}: {str(e)}")
             raise
 
+    def build_gallery(self):
+        """
+        Rebuild the consolidated, memory-mappable gallery file from the .npy files
+        Returns:
+            FeatureGallery: The gallery that was written
+        """
+        gallery = FeatureGallery.from_directory(settings.FEATURES_DIR, self.backend.name).compact(
+            settings.GALLERY_DTYPE, settings.GALLERY_PCA_DIMS
+        )
+        gallery.save(settings.GALLERY_FILE)
+        self.logger.info(
+            f"Gallery written to {settings.GALLERY_FILE}: "
+            f"{len(gallery)} students, {gallery.size} {gallery.backend} descriptors "
+            f"({gallery.descriptors.dtype}, {gallery.descriptors.shape[1]} dims)"
+        )
+        return gallery
+
     def process_student(self, student):
         """
         Process a single student: download photo and extract features
@@ -165,28 +379,159 @@ class PhotoDownloader:
         Returns:
             bool: True if successful, False otherwise
         """
-        if student.student_id in self.processed_files:
-            self.logger.debug(f"Skipping already processed student: {student.student_id}")
-            return True
+        cached = self._cached_entry(student)
+        change = 'updated' if student.student_id in self.processed_files else 'added'
             
         try:
-            # Step 1: Download photo
+            # Step 1: Download photo (conditional when the manifest has it)
             self.logger.info(f"Processing student: {student.student_id}")
-            img = self._download_photo(student)
+            images, photo = self._download_photo(student, cached)
+            if images is None:
+                self.logger.debug(f"Photo unchanged: {student.student_id}")
+                self._record_photo(student.student_id, photo, extracted=False)
+                self.report['unchanged'] += 1
+                return True
             
             # Step 2: Extract features
-            _, descriptors = self._extract_features(img)
+            points, descriptors, counts = self._extract_features(images)
             if descriptors is None:
+                self.report['failed'] += 1
                 return False
                 
             # Step 3: Save features
-            self._save_features(student.student_id, descriptors)
+            self._save_features(student.student_id, descriptors, points)
+            self._count_descriptors(student.student_id, counts)
+            self._record_photo(student.student_id, photo, extracted=True)
+            self.report[change] += 1
             return True
             
         except Exception as e:
             self.logger.error(f"Failed to process student {student.student_id}: {str(e)}")
+            self.report['failed'] += 1
             return False
 
+    def _log_progress(self, done, total_students, success_count):
+        if done % 10 == 0 or done == total_students:
+            progress = (done / total_students) * 100
+            self.logger.info(
+                f"Progress: {done}/{total_students} ({progress:.1f}%) | "
+                f"Success: {success_count} | Failed: {done - success_count}"
+            )
+
+    def _run_sequential(self, students):
+        total_students = len(students)
+        success_count = 0
+
+        # Process each student
+        for i, student in enumerate(students, 1):
+            try:
+                if self.process_student(student):
+                    success_count += 1
+                
+                # Log progress
+                self._log_progress(i, total_students, success_count)
+                    
+            except Exception as e:
+                self.logger.error(f"Error processing student {student.student_id}: {str(e)}")
+                continue
+
+        return success_count
+
+    def _run_concurrent(self, students, download_workers=None, extract_workers=None, queue_size=None):
+        """
+        Download on a thread pool and extract features on a process pool.
+
+        Download threads put decoded photos on a bounded queue (blocking when
+        extraction falls behind); the main thread feeds them to the process
+        pool, keeping at most ``queue_size`` extractions in flight, and saves
+        the results. ``_download_photo`` keeps its per-student retry.
+        Returns:
+            int: Number of students processed successfully
+        """
+        download_workers = download_workers or settings.DOWNLOAD_WORKERS
+        extract_workers = extract_workers or settings.EXTRACT_WORKERS
+        queue_size = queue_size or settings.DOWNLOAD_QUEUE_SIZE
+
+        total_students = len(students)
+        success_count = done = 0
+
+        # Manifest lookups happen here; download threads never touch shared state
+        todo = queue.Queue()
+        for student in students:
+            change = 'updated' if student.student_id in self.processed_files else 'added'
+            todo.put((student, self._cached_entry(student), change))
+        downloaded = queue.Queue(maxsize=queue_size)
+
+        def _download_worker():
+            while True:
+                try:
+                    student, cached, change = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self.logger.info(f"Processing student: {student.student_id}")
+                    images, photo = self._download_photo(student, cached)
+                    downloaded.put((student, change, images, photo))
+                except Exception as e:
+                    self.logger.error(f"Failed to process student {student.student_id}: {str(e)}")
+                    downloaded.put((student, 'failed', None, None))
+
+        threads = [
+            threading.Thread(target=_download_worker, name=f'photo-download-{i}', daemon=True)
+            for i in range(min(download_workers, total_students))
+        ]
+        for thread in threads:
+            thread.start()
+
+        with ProcessPoolExecutor(max_workers=extract_workers) as pool:
+            in_flight = {}
+            received = 0
+            while received < total_students or in_flight:
+                # Keep the process pool busy without holding more than queue_size images
+                while received < total_students and len(in_flight) < queue_size:
+                    try:
+                        student, change, images, photo = downloaded.get(timeout=0.1 if in_flight else None)
+                    except queue.Empty:
+                        break
+                    received += 1
+                    if images is None:
+                        done += 1
+                        if change == 'failed':
+                            self.report['failed'] += 1
+                        else:
+                            self._record_photo(student.student_id, photo, extracted=False)
+                            self.report['unchanged'] += 1
+                            success_count += 1
+                        self._log_progress(done, total_students, success_count)
+                        continue
+                    in_flight[pool.submit(_extract_in_worker, images)] = (student, change, photo)
+
+                if not in_flight:
+                    continue
+
+                finished, _ = wait(list(in_flight), timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    student, change, photo = in_flight.pop(future)
+                    done += 1
+                    try:
+                        points, descriptors, counts = future.result()
+                        self._save_features(student.student_id, descriptors, points)
+                        self._count_descriptors(student.student_id, counts)
+                        self._record_photo(student.student_id, photo, extracted=True)
+                        self.report[change] += 1
+                        success_count += 1
+                    except ValueError as e:
+                        self.logger.warning(f"Feature extraction failed: {str(e)}")
+                        self.report['failed'] += 1
+                    except Exception as e:
+                        self.logger.error(f"Failed to process student {student.student_id}: {str(e)}")
+                        self.report['failed'] += 1
+                    self._log_progress(done, total_students, success_count)
+
+        for thread in threads:
+            thread.join()
+        return success_count
+
     def run(self):
         """
         Main method to run the download and feature extraction process
@@ -197,35 +542,33 @@ class PhotoDownloader:
             # Get students from database
             students = self.get_students_with_photos()
             total_students = len(students)
-            success_count = 0
             
             if not students:
                 self.logger.warning("No students found with photos")
                 return
             
-            # Process each student
-            for i, student in enumerate(students, 1):
-                try:
-                    if self.process_student(student):
-                        success_count += 1
-                    
-                    # Log progress
-                    if i % 10 == 0 or i == total_students:
-                        progress = (i / total_students) * 100
-                        self.logger.info(
-                            f"Progress: {i}/{total_students} ({progress:.1f}%) | "
-                            f"Success: {success_count} | Failed: {i - success_count}"
-                        )
-                        
-                except Exception as e:
-                    self.logger.error(f"Error processing student {student.student_id}: {str(e)}")
-                    continue
+            if settings.DOWNLOAD_WORKERS > 1 or settings.EXTRACT_WORKERS > 1:
+                success_count = self._run_concurrent(students)
+            else:
+                success_count = self._run_sequential(students)
             
             self.logger.info(
                 f"Process completed. Success: {success_count}/{total_students} "
                 f"({success_count/total_students*100:.1f}%)"
             )
+
+            if settings.SYNC_REMOVE_STALE:
+                self._remove_stale(student.student_id for student in students)
+            self._save_manifest()
+            self.logger.info(
+                "Sync report: " + ", ".join(f"{key}={value}" for key, value in self.report.items())
+            )
+
+            # Keep the consolidated gallery in sync with the per-student files
+            if (self.saved_count or self.report['removed']) and os.path.exists(settings.GALLERY_FILE):
+                self.build_gallery()
+            return self.report
             
         except Exception as e:
             self.logger.error(f"Fatal error in downloader: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
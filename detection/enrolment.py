@@ -0,0 +1,305 @@
+"""detection/enrolment.py"""
+
+import os
+import struct
+import numpy as np
+import cv2
+from config.settings import get_settings
+from detection.face_region import FaceRegionDetector
+from detection.feature_backend import FeatureBackend
+from utils.images import IMAGE_EXTENSIONS, decode_flags
+
+settings = get_settings()
+
+# Near-duplicate distance per backend: SIFT L2 (descriptors have norm 512), ORB/AKAZE Hamming bits
+DEDUP_DISTANCES = {'sift': 90.0, 'orb': 20.0, 'akaze': 20.0}
+
+ILLUMINATION_MODES = ('stretch', 'clahe', 'none')
+
+# Augmented views of the face crop: (rotation degrees, scale, gamma), used in this order
+VIEW_TRANSFORMS = (
+    (8, 1.0, 1.0),
+    (-8, 1.0, 1.0),
+    (0, 0.85, 1.0),
+    (0, 1.15, 1.0),
+    (0, 1.0, 0.7),
+    (0, 1.0, 1.4),
+    (5, 0.9, 1.2),
+    (-5, 1.1, 0.8),
+)
+
+def select_keypoints(keypoints, descriptors, max_keypoints, grid=4):
+    """
+    Keep the strongest ``max_keypoints`` keypoints while preserving spatial spread.
+
+    Keypoints are bucketed into a ``grid`` x ``grid`` layout over their bounding
+    box and taken round-robin: the strongest of every cell first, then the
+    second strongest, and so on (ties broken by response).
+    Returns:
+        tuple: (keypoints, descriptors) limited to ``max_keypoints``
+    """
+    if not max_keypoints or len(keypoints) <= max_keypoints:
+        return keypoints, descriptors
+
+    points = np.array([kp.pt for kp in keypoints], dtype=np.float32)
+    responses = np.array([kp.response for kp in keypoints], dtype=np.float32)
+
+    low = points.min(axis=0)
+    span = np.maximum(points.max(axis=0) - low, 1e-6)
+    cells = np.minimum(((points - low) / span * grid).astype(int), grid - 1)
+    cell_ids = cells[:, 1] * grid + cells[:, 0]
+
+    # Rank of every keypoint within its cell, strongest first
+    order = np.lexsort((-responses, cell_ids))
+    sorted_cells = cell_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    rank_in_cell = np.empty(len(order), dtype=int)
+    rank_in_cell[order] = np.arange(len(order)) - np.repeat(starts, counts)
+
+    chosen = np.lexsort((-responses, rank_in_cell))[:max_keypoints]
+    return [keypoints[i] for i in chosen], descriptors[chosen]
+
+def photo_size(content):
+    """
+    (width, height) from a JPEG or PNG header, without decoding the image
+    Returns:
+        tuple: (width, height), or None for other formats or a damaged header
+    """
+    if content[:8] == b'\x89PNG\r\n\x1a\n' and len(content) >= 24:
+        return struct.unpack('>II', content[16:24])
+    if content[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(content):
+        if content[i] != 0xFF:
+            return None
+        marker = content[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = struct.unpack('>H', content[i + 2:i + 4])[0]
+        # Start-of-frame markers (baseline, progressive, ...) carry the size
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', content[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+def decode_photo(content, max_side=None):
+    """
+    Decode a photo to grayscale at the largest JPEG reduction (1/2, 1/4, 1/8)
+    that still leaves its longer side at least ``max_side`` pixels
+    Raises:
+        ValueError: If the image cannot be decoded
+    """
+    max_side = settings.ENROL_MAX_SIDE if max_side is None else max_side
+    scale = 1
+    size = photo_size(content) if max_side else None
+    if size:
+        while scale < 8 and max(size) // (scale * 2) >= max_side:
+            scale *= 2
+
+    img = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), decode_flags(scale, grayscale=True))
+    if img is None:
+        raise ValueError("Failed to decode image")
+    if max_side and max(img.shape[:2]) > max_side:
+        # PNG (or an odd JPEG) decoded at full size: shrink to the same bound
+        factor = max_side / max(img.shape[:2])
+        img = cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    return img
+
+def extra_photos(student_id, directory=None):
+    """Additional enrolment photos of a student: ``<directory>/<student_id>/*.jpg``, sorted"""
+    directory = os.path.join(directory or settings.ENROL_EXTRA_PHOTOS_DIR, student_id)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def extra_photos_fingerprint(student_id, directory=None):
+    """[[name, size, mtime_ns], ...] of the extra photos; changes when any of them does"""
+    fingerprint = []
+    for path in extra_photos(student_id, directory):
+        stat = os.stat(path)
+        fingerprint.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def load_extra_photos(student_id, directory=None, max_side=None):
+    """
+    Decoded extra photos and their fingerprint
+    Returns:
+        tuple: (list of grayscale images, fingerprint as ``extra_photos_fingerprint``)
+    """
+    images = []
+    for path in extra_photos(student_id, directory):
+        with open(path, 'rb') as f:
+            images.append(decode_photo(f.read(), max_side))
+    return images, extra_photos_fingerprint(student_id, directory)
+
+def deduplicate(descriptors, responses, distance, norm):
+    """
+    Indices of descriptors to keep: within every group closer than ``distance``
+    only the one with the strongest keypoint survives
+    """
+    matches = cv2.BFMatcher(norm).radiusMatch(descriptors, descriptors, maxDistance=distance)
+    kept = np.zeros(len(descriptors), dtype=bool)
+    for i in np.argsort(-responses, kind='stable'):
+        if not any(kept[match.trainIdx] for match in matches[i] if match.trainIdx != i):
+            kept[i] = True
+    return np.flatnonzero(kept)
+
+class EnrolmentPipeline:
+    """
+    Turns one or more reference photos into a compact descriptor set.
+
+    Every photo is reduced to its largest face (padded crop, longer side
+    ``face_size``) and its illumination normalised: 'stretch' maps the 1st-99th
+    intensity percentiles to the full range, 'clahe' equalises locally (more
+    keypoints, many of them noise that live frames do not show); the crop of the first
+    photo also yields ``views`` augmented copies (small rotations, scale and
+    gamma changes), so live frames that differ a little from the portrait
+    still find their keypoints. Descriptors of all photos and views are
+    merged, near-duplicates (the same keypoint seen in several views) are
+    dropped, and the strongest ``max_descriptors`` are kept with spatial
+    spread. Keypoint positions of augmented views are mapped back to the
+    first crop so geometric verification sees one consistent face.
+    """
+
+    def __init__(self, backend=None, face_size=None, illumination=None, views=None, max_descriptors=None,
+                 dedup_distance=None, face_regions=None):
+        self.backend = backend if isinstance(backend, FeatureBackend) else FeatureBackend(backend)
+        self.face_size = face_size or settings.ENROL_FACE_SIZE
+        self.illumination = illumination or settings.ENROL_ILLUMINATION
+        if self.illumination not in ILLUMINATION_MODES:
+            raise ValueError(f"Unknown illumination mode '{self.illumination}', expected one of {ILLUMINATION_MODES}")
+        self.views = min(settings.ENROL_VIEWS if views is None else views, len(VIEW_TRANSFORMS))
+        max_descriptors = settings.ENROL_MAX_DESCRIPTORS if max_descriptors is None else max_descriptors
+        # MAX_KEYPOINTS caps every student's gallery share, enrolled this way or not (0 = no cap)
+        caps = [cap for cap in (max_descriptors, settings.MAX_KEYPOINTS) if cap]
+        self.max_descriptors = min(caps) if caps else 0
+        self.dedup_distance = (
+            dedup_distance or settings.ENROL_DEDUP_DISTANCE or DEDUP_DISTANCES[self.backend.name]
+        )
+        self._face_regions = face_regions
+
+    @property
+    def params(self):
+        """Recorded in the sync manifest, so changing them re-extracts every student"""
+        return {
+            'face_size': self.face_size,
+            'illumination': self.illumination,
+            'views': self.views,
+            'max_descriptors': self.max_descriptors,
+            'dedup_distance': self.dedup_distance,
+            'max_side': settings.ENROL_MAX_SIDE,
+        }
+
+    @property
+    def face_regions(self):
+        if self._face_regions is None:
+            self._face_regions = FaceRegionDetector(crop_size=self.face_size)
+        return self._face_regions
+
+    def normalise(self, gray):
+        """
+        Face crop with normalised size and contrast
+        Returns:
+            tuple: (image, True if a face was found; otherwise the whole photo,
+                    at most twice ``face_size``, is used)
+        """
+        boxes = self.face_regions.detect(gray)
+        if boxes:
+            face = self.face_regions.crop(gray, max(boxes, key=lambda box: box[2] * box[3]))
+        else:
+            face = gray
+            factor = 2 * self.face_size / max(gray.shape[:2])
+            if factor < 1.0:
+                face = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+        if self.illumination == 'stretch':
+            low, high = np.percentile(face, (1, 99))
+            if high > low:
+                alpha = 255.0 / (high - low)
+                face = cv2.convertScaleAbs(face, alpha=alpha, beta=-low * alpha)
+        elif self.illumination == 'clahe':
+            face = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(face)
+        return face, bool(boxes)
+
+    def augment(self, face):
+        """
+        Augmented copies of a face crop
+        Returns:
+            list: (image, 2x3 affine mapping view coordinates back to the crop)
+        """
+        height, width = face.shape[:2]
+        center = (width / 2, height / 2)
+        views = []
+        for angle, scale, gamma in VIEW_TRANSFORMS[:self.views]:
+            matrix = cv2.getRotationMatrix2D(center, angle, scale)
+            view = cv2.warpAffine(face, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+            if gamma != 1.0:
+                table = (np.linspace(0, 1, 256) ** gamma * 255).astype(np.uint8)
+                view = cv2.LUT(view, table)
+            views.append((view, cv2.invertAffineTransform(matrix)))
+        return views
+
+    def enrol(self, extractor, photos, min_descriptors=1):
+        """
+        Descriptor set of one student
+        Args:
+            extractor: Feature extractor of ``self.backend``
+            photos (list): Grayscale reference photos, the primary one first
+            min_descriptors (int): Fewer kept descriptors than this is an error
+        Returns:
+            tuple: (Nx2 keypoint positions, descriptors, counts) where counts has
+                   'photos', 'faces', 'views', 'extracted', 'unique' and 'kept'
+        Raises:
+            ValueError: If not enough descriptors are left
+        """
+        images = []
+        faces = 0
+        for i, photo in enumerate(photos):
+            face, found = self.normalise(photo)
+            faces += found
+            images.append((face, None))
+            if i == 0:
+                images += self.augment(face)
+
+        keypoints, descriptors = [], []
+        for image, to_crop in images:
+            view_keypoints, view_descriptors = extractor.detectAndCompute(image, None)
+            if view_descriptors is None:
+                continue
+            if to_crop is not None:
+                points = cv2.KeyPoint_convert(view_keypoints) @ to_crop[:, :2].T + to_crop[:, 2]
+                view_keypoints = [
+                    cv2.KeyPoint(float(x), float(y), kp.size, kp.angle, kp.response, kp.octave)
+                    for (x, y), kp in zip(points, view_keypoints)
+                ]
+            keypoints += list(view_keypoints)
+            descriptors.append(view_descriptors)
+
+        counts = {'photos': len(photos), 'faces': faces, 'views': len(images), 'extracted': 0, 'unique': 0, 'kept': 0}
+        if descriptors:
+            descriptors = np.vstack(descriptors)
+            counts['extracted'] = len(descriptors)
+            responses = np.array([kp.response for kp in keypoints], dtype=np.float32)
+            # Deduplication is quadratic: weak keypoints beyond a few times the cap would be dropped anyway
+            candidates = np.arange(len(descriptors))
+            if self.max_descriptors and len(candidates) > 4 * self.max_descriptors:
+                candidates = np.sort(np.argsort(-responses, kind='stable')[:4 * self.max_descriptors])
+            unique = candidates[deduplicate(
+                descriptors[candidates], responses[candidates], self.dedup_distance, self.backend.norm
+            )]
+            keypoints, descriptors = select_keypoints(
+                [keypoints[i] for i in unique], descriptors[unique], self.max_descriptors
+            )
+            counts['unique'] = len(unique)
+            counts['kept'] = len(descriptors)
+
+        if counts['kept'] < max(min_descriptors, 1):
+            raise ValueError("Not enough features detected")
+        return cv2.KeyPoint_convert(keypoints), descriptors, counts
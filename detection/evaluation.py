@@ -0,0 +1,60 @@
+"""detection/evaluation.py"""
+
+import os
+import time
+import cv2
+
+# Subdirectory for labelled frames in which no enrolled student is visible
+NO_STUDENT_LABEL = 'none'
+
+def load_labelled_frames(frames_dir):
+    """
+    Load labelled frames laid out as ``frames_dir/<student_id>/*.jpg``
+    (``frames_dir/none/`` for frames without an enrolled student)
+    Returns:
+        list: (label, frame) pairs, label None for the ``none`` directory
+    """
+    frames = []
+    for label in sorted(os.listdir(frames_dir)):
+        label_dir = os.path.join(frames_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for file in sorted(os.listdir(label_dir)):
+            frame = cv2.imread(os.path.join(label_dir, file))
+            if frame is not None:
+                frames.append((None if label == NO_STUDENT_LABEL else label, frame))
+    return frames
+
+def run_matcher(matcher, frames):
+    """
+    Match every frame once
+    Returns:
+        tuple: (predicted student ids, per-frame seconds)
+    """
+    predictions, timings = [], []
+    for _, frame in frames:
+        start = time.perf_counter()
+        detected_face, _, _ = matcher.match_face(frame)
+        timings.append(time.perf_counter() - start)
+        predictions.append(detected_face)
+    return predictions, timings
+
+def compare_matchers(reference, candidate, frames):
+    """
+    Compare a candidate matcher with a full-precision reference on labelled frames
+    Returns:
+        dict: Agreement with the reference, accuracy of both and mean match time
+    """
+    labels = [label for label, _ in frames]
+    reference_predictions, reference_timings = run_matcher(reference, frames)
+    candidate_predictions, candidate_timings = run_matcher(candidate, frames)
+    total = max(len(frames), 1)
+
+    return {
+        'frames': len(frames),
+        'agreement': sum(a == b for a, b in zip(reference_predictions, candidate_predictions)) / total,
+        'reference_accuracy': sum(p == l for p, l in zip(reference_predictions, labels)) / total,
+        'candidate_accuracy': sum(p == l for p, l in zip(candidate_predictions, labels)) / total,
+        'reference_match_ms': sum(reference_timings) / total * 1000,
+        'candidate_match_ms': sum(candidate_timings) / total * 1000,
+    }
@@ -0,0 +1,157 @@
+"""detection/face_region.py"""
+
+import os
+import time
+import threading
+import cv2
+from config.settings import get_settings
+
+settings = get_settings()
+
+class FaceRegionDetector:
+    """
+    Cheap face localisation that runs before SIFT.
+
+    Uses the Haar cascade bundled with opencv-python-headless on a downscaled
+    copy of the frame and returns padded, size-normalised grayscale crops so
+    SIFT only has to describe the face regions.
+    """
+
+    def __init__(self, cascade_file=None, detect_width=None, crop_size=None, padding=None):
+        cascade_file = cascade_file or settings.FACE_CASCADE_FILE
+        if not os.path.isabs(cascade_file):
+            cascade_file = os.path.join(cv2.data.haarcascades, cascade_file)
+
+        self.cascade = cv2.CascadeClassifier(cascade_file)
+        if self.cascade.empty():
+            raise ValueError(f"Failed to load face cascade: {cascade_file}")
+
+        self.detect_width = detect_width or settings.FACE_DETECT_WIDTH
+        self.crop_size = crop_size or settings.FACE_CROP_SIZE
+        self.padding = settings.FACE_PADDING if padding is None else padding
+        self.scale_factor = settings.FACE_SCALE_FACTOR
+
+    def detect(self, gray):
+        """
+        Find face boxes in a grayscale frame
+        Args:
+            gray (np.ndarray): Grayscale frame
+        Returns:
+            list: (x, y, w, h) boxes in full-frame coordinates
+        """
+        height, width = gray.shape[:2]
+        scale = min(1.0, self.detect_width / width)
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+        small = cv2.equalizeHist(small)
+
+        faces = self.cascade.detectMultiScale(
+            small, scaleFactor=self.scale_factor, minNeighbors=5, minSize=(24, 24)
+        )
+        return [tuple(int(round(v / scale)) for v in face) for face in faces]
+
+    def crop(self, gray, box):
+        """Padded crop of one face box, resized so its longer side is ``crop_size``"""
+        return self.crop_with_origin(gray, box)[0]
+
+    def crop_with_origin(self, gray, box):
+        """
+        Like ``crop``, plus how to map crop coordinates back to the frame
+        Returns:
+            tuple: (crop, (x0, y0, scale)) where frame = (x0, y0) + crop / scale
+        """
+        x, y, w, h = box
+        pad_x, pad_y = int(w * self.padding), int(h * self.padding)
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(gray.shape[1], x + w + pad_x), min(gray.shape[0], y + h + pad_y)
+
+        region = gray[y0:y1, x0:x1]
+        scale = self.crop_size / max(region.shape[:2])
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+        return cv2.resize(region, None, fx=scale, fy=scale, interpolation=interpolation), (x0, y0, scale)
+
+    def regions(self, gray):
+        """
+        Detect faces and return their normalised crops
+        Returns:
+            tuple: (boxes, crops, detection_seconds)
+        """
+        boxes, crops, _, seconds = self.regions_with_origins(gray)
+        return boxes, crops, seconds
+
+    def regions_with_origins(self, gray):
+        """
+        Like ``regions``, plus the crop-to-frame mapping of every crop
+        Returns:
+            tuple: (boxes, crops, origins, detection_seconds)
+        """
+        start = time.perf_counter()
+        boxes = self.detect(gray)
+        crops, origins = [], []
+        for box in boxes:
+            crop, origin = self.crop_with_origin(gray, box)
+            crops.append(crop)
+            origins.append(origin)
+        return boxes, crops, origins, time.perf_counter() - start
+
+
+class FaceRegionStats:
+    """
+    Running totals comparing detection cost with the SIFT time it saves.
+
+    Match workers of several cameras share one instance, so every update
+    goes through the methods below, under the lock.
+    """
+
+    def __init__(self, sample_every=None):
+        self._lock = threading.Lock()
+        # Every Nth frame SIFT also runs on the full frame to measure the saving
+        self.sample_every = sample_every or settings.FACE_STATS_SAMPLE_EVERY
+        self.frames = 0
+        self.frames_without_face = 0
+        self.detect_time = 0.0
+        self.crop_sift_time = 0.0
+        self.full_sift_time = 0.0
+        self.full_sift_samples = 0
+
+    def start_frame(self, detect_time):
+        """
+        Count a frame and its detection time
+        Returns:
+            bool: True if SIFT should also run on the full frame for this one
+        """
+        with self._lock:
+            sample = self.sample_every > 0 and self.frames % self.sample_every == 0
+            self.frames += 1
+            self.detect_time += detect_time
+            return sample
+
+    def record_full_sift(self, elapsed):
+        with self._lock:
+            self.full_sift_time += elapsed
+            self.full_sift_samples += 1
+
+    def record_crops(self, elapsed):
+        with self._lock:
+            self.crop_sift_time += elapsed
+
+    def record_without_face(self):
+        with self._lock:
+            self.frames_without_face += 1
+
+    def summary(self):
+        with self._lock:
+            frames_seen, frames_without_face = self.frames, self.frames_without_face
+            detect_time, crop_sift_time = self.detect_time, self.crop_sift_time
+            full_sift_time, full_sift_samples = self.full_sift_time, self.full_sift_samples
+        frames = max(frames_seen, 1)
+        avg_full_sift = full_sift_time / full_sift_samples if full_sift_samples else None
+        avg_detect = detect_time / frames
+        avg_crop_sift = crop_sift_time / frames
+        return {
+            'frames': frames_seen,
+            'frames_without_face': frames_without_face,
+            'avg_detect_ms': avg_detect * 1000,
+            'avg_crop_sift_ms': avg_crop_sift * 1000,
+            'avg_full_sift_ms': avg_full_sift * 1000 if avg_full_sift is not None else None,
+            'avg_saved_ms': (avg_full_sift - avg_detect - avg_crop_sift) * 1000 if avg_full_sift is not None else None,
+        }
@@ -0,0 +1,158 @@
+"""detection/feature_backend.py"""
+
+import os
+import json
+import numpy as np
+import cv2
+from config.settings import get_settings
+
+settings = get_settings()
+
+# Descriptor layout of every backend: (dtype, dimensions, distance norm).
+# Layouts are distinct, so the backend of a raw .npy feature file can be told from its contents.
+DESCRIPTOR_LAYOUTS = {
+    'sift': ('float32', 128, cv2.NORM_L2),
+    'orb': ('uint8', 32, cv2.NORM_HAMMING),
+    'akaze': ('uint8', 61, cv2.NORM_HAMMING),
+}
+DEFAULT_BACKEND = 'sift'
+
+# 'flann': KD-tree (float) or LSH (binary) approximate search, 'bf': exact brute force
+INDEX_TYPES = ('flann', 'bf')
+
+_FLANN_KDTREE = 1
+_FLANN_LSH = 6
+
+def is_binary(name):
+    return DESCRIPTOR_LAYOUTS[name][2] == cv2.NORM_HAMMING
+
+def identify_backend(descriptors):
+    """Name of the backend whose descriptors look like these, or None"""
+    for name, (dtype, dims, _) in DESCRIPTOR_LAYOUTS.items():
+        if descriptors.dtype == dtype and descriptors.ndim == 2 and descriptors.shape[1] == dims:
+            return name
+    return None
+
+class FeatureBackend:
+    """
+    Extractor, descriptor type, nearest-neighbour index and distance that
+    belong together.
+
+    SIFT gives float descriptors compared by L2 distance (FLANN KD-tree);
+    ORB and AKAZE give binary descriptors compared by Hamming distance (FLANN
+    LSH). With ``index='bf'`` both use an exact brute-force matcher instead.
+    Descriptors of one backend mean nothing to another, so galleries record
+    the backend they were extracted with.
+    """
+
+    def __init__(self, name=None, index=None):
+        self.name = name or settings.FEATURE_BACKEND
+        if self.name not in DESCRIPTOR_LAYOUTS:
+            raise ValueError(f"Unknown feature backend '{self.name}', expected one of {sorted(DESCRIPTOR_LAYOUTS)}")
+        self.index = index or settings.FEATURE_INDEX
+        if self.index not in INDEX_TYPES:
+            raise ValueError(f"Unknown feature index '{self.index}', expected one of {INDEX_TYPES}")
+
+        dtype, self.dims, self.norm = DESCRIPTOR_LAYOUTS[self.name]
+        self.dtype = np.dtype(dtype)
+        self.binary = self.norm == cv2.NORM_HAMMING
+        if self.binary:
+            self.index_params = dict(algorithm=_FLANN_LSH, table_number=6, key_size=12, multi_probe_level=1)
+        else:
+            self.index_params = dict(algorithm=_FLANN_KDTREE, trees=5)
+        self.search_params = dict(checks=50)
+
+    def __repr__(self):
+        return f"FeatureBackend({self.name!r}, index={self.index!r})"
+
+    def load_tuned_params(self, path):
+        """
+        Apply index parameters chosen by ``photos/calibrate_index.py``
+        Args:
+            path (str): Parameter file saved next to the gallery
+        Returns:
+            dict: The calibration record, or None if there is none for this backend
+        """
+        try:
+            with open(path) as f:
+                tuned = json.load(f)
+        except FileNotFoundError:
+            return None
+        if tuned.get('backend') != self.name or tuned.get('index') not in INDEX_TYPES:
+            return None
+
+        # Updated in place: FaceMatcher exposes these dicts as index_params/search_params
+        self.index = tuned['index']
+        self.index_params.clear()
+        self.index_params.update(tuned['index_params'])
+        self.search_params.clear()
+        self.search_params.update(tuned['search_params'])
+        return tuned
+
+    def create_extractor(self):
+        """New keypoint detector/descriptor (OpenCV extractors are not thread-safe)"""
+        if self.name == 'orb':
+            return cv2.ORB_create(nfeatures=settings.ORB_FEATURES)
+        if self.name == 'akaze':
+            return cv2.AKAZE_create()
+        return cv2.SIFT_create()
+
+    def create_matcher(self):
+        """DescriptorMatcher for ``knnMatch`` (per-student matching and verification)"""
+        if self.index == 'bf':
+            return cv2.BFMatcher(self.norm)
+        return cv2.FlannBasedMatcher(self.index_params, self.search_params)
+
+    def accepts(self, descriptors):
+        return identify_backend(descriptors) == self.name
+
+    def knn_search(self, data, queries):
+        """
+        Two nearest ``data`` rows of every query row
+        Args:
+            data (np.ndarray): Descriptors to index (the frame)
+            queries (np.ndarray): Descriptors to look up (the gallery)
+        Returns:
+            tuple: (Qx2 neighbour indices, Qx2 distances); rows without two
+                   neighbours (possible with LSH) get infinite distances
+        """
+        if self.index == 'bf':
+            pairs = cv2.BFMatcher(self.norm).knnMatch(queries, data, k=2)
+            neighbours = np.array([[m.trainIdx, n.trainIdx] for m, n in pairs], dtype=np.int32).reshape(-1, 2)
+            distances = np.array([[m.distance, n.distance] for m, n in pairs], dtype=np.float32).reshape(-1, 2)
+            return neighbours, distances
+
+        index = cv2.flann_Index(data, self.index_params)
+        neighbours, distances = index.knnSearch(queries, 2, params=self.search_params)
+        if self.binary:
+            distances = distances.astype(np.float32)
+            distances[(neighbours < 0).any(axis=1)] = np.inf
+        else:
+            # FLANN reports squared L2 distances
+            distances = np.sqrt(distances)
+        return neighbours, distances
+
+def save_tuned_params(path, backend_name, result, **details):
+    """
+    Write a calibration result for ``FeatureBackend.load_tuned_params`` (atomically replaced)
+    Args:
+        path (str): Destination, normally INDEX_PARAMS_FILE next to the gallery
+        backend_name (str): Backend the parameters were calibrated for
+        result (dict): Chosen configuration from ``detection.calibration.calibrate``
+        details: Extra fields recorded for reference (targets, gallery size, ...)
+    """
+    record = {
+        'backend': backend_name,
+        'index': result['index'],
+        'index_params': result['index_params'],
+        'search_params': result['search_params'],
+        'label': result['label'],
+        'recall': result['recall'],
+        'agreement': result['agreement'],
+        'search_ms': result['search_ms'],
+        **details,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, path)
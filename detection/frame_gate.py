@@ -0,0 +1,94 @@
+"""detection/frame_gate.py"""
+
+import time
+import cv2
+import numpy as np
+from config.settings import get_settings
+
+settings = get_settings()
+
+# Alasan penolakan frame
+ADMITTED = 'admitted'
+STATIC = 'static'
+BLURRED = 'blurred'
+UNDEREXPOSED = 'underexposed'
+OVEREXPOSED = 'overexposed'
+
+class FrameGate:
+    """
+    Cheap admission check in front of ``FaceMatcher.match_face``.
+
+    Works on a small grayscale copy of the frame: rejects frames that are too
+    dark/bright or too blurry to match, and frames where nothing moved
+    relative to a running background. A full match is still forced every
+    ``refresh_interval`` seconds so slow scene changes are not missed.
+    """
+
+    def __init__(self, width=None, motion_threshold=None, motion_ratio=None,
+                 min_sharpness=None, min_brightness=None, max_brightness=None,
+                 learning_rate=None, refresh_interval=None):
+        self.width = width or settings.FRAME_GATE_WIDTH
+        self.motion_threshold = motion_threshold or settings.FRAME_GATE_MOTION_THRESHOLD
+        self.motion_ratio = settings.FRAME_GATE_MOTION_RATIO if motion_ratio is None else motion_ratio
+        self.min_sharpness = settings.FRAME_GATE_MIN_SHARPNESS if min_sharpness is None else min_sharpness
+        self.min_brightness = settings.FRAME_GATE_MIN_BRIGHTNESS if min_brightness is None else min_brightness
+        self.max_brightness = settings.FRAME_GATE_MAX_BRIGHTNESS if max_brightness is None else max_brightness
+        self.learning_rate = learning_rate or settings.FRAME_GATE_LEARNING_RATE
+        self.refresh_interval = settings.FRAME_GATE_REFRESH if refresh_interval is None else refresh_interval
+
+        self.background = None
+        self.last_admitted = 0.0
+        self.counts = {ADMITTED: 0, STATIC: 0, BLURRED: 0, UNDEREXPOSED: 0, OVEREXPOSED: 0}
+
+    def admit(self, frame):
+        """
+        Decide whether a frame is worth matching
+        Args:
+            frame (np.ndarray): BGR or grayscale frame
+        Returns:
+            tuple: (admitted, reason) where reason is one of the module constants
+        """
+        reason = self._check(frame)
+        self.counts[reason] += 1
+        if reason == ADMITTED:
+            self.last_admitted = time.time()
+        return reason == ADMITTED, reason
+
+    def _check(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        scale = self.width / gray.shape[1]
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+        # Motion against a running average background
+        motion = 1.0
+        if self.background is None:
+            self.background = small.astype(np.float32)
+        else:
+            diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+            motion = np.count_nonzero(diff > self.motion_threshold) / diff.size
+            cv2.accumulateWeighted(small, self.background, self.learning_rate)
+
+        brightness = float(small.mean())
+        if brightness < self.min_brightness:
+            return UNDEREXPOSED
+        if brightness > self.max_brightness:
+            return OVEREXPOSED
+
+        if cv2.Laplacian(small, cv2.CV_64F).var() < self.min_sharpness:
+            return BLURRED
+
+        stale = self.refresh_interval > 0 and time.time() - self.last_admitted >= self.refresh_interval
+        if motion < self.motion_ratio and not stale:
+            return STATIC
+
+        return ADMITTED
+
+    def stats(self):
+        total = sum(self.counts.values())
+        skipped = total - self.counts[ADMITTED]
+        return {
+            'frames': total,
+            'skipped': skipped,
+            'skipped_ratio': skipped / total if total else 0.0,
+            **self.counts,
+        }
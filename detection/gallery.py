@@ -0,0 +1,395 @@
+"""detection/gallery.py"""
+
+import os
+import struct
+import numpy as np
+from detection.feature_backend import DEFAULT_BACKEND, DESCRIPTOR_LAYOUTS, identify_backend, is_binary
+
+# On-disk layout of the consolidated gallery file (little endian):
+#   header | student ids (utf-8, newline separated) | offsets (int64, S+1) | descriptors (N x D)
+#   [| projection (float32, (D + 1) x D_in): PCA mean row followed by D component rows]
+#   [| points (float32, N x 2): keypoint position of every descriptor in its enrolment photo]
+# The header records the feature backend (v4+; older files are SIFT).
+# The descriptor block is aligned so it can be memory-mapped and shared between processes.
+GALLERY_MAGIC = b'FACEGAL\0'
+GALLERY_VERSION = 4
+_HEADER_V1 = struct.Struct('<8sII QQ 8s QQ Q Q')
+_HEADER_V2 = struct.Struct('<8sII QQ 8s QQ Q Q QQ')
+_HEADER_V3 = struct.Struct('<8sII QQ 8s QQ Q Q QQ Q')
+_HEADER = struct.Struct('<8sII QQ 8s QQ Q Q QQ Q 8s')
+_ALIGN = 64
+
+# Subdirectory of the features directory with per-student keypoint positions ({student_id}.npy, N x 2)
+KEYPOINTS_DIR = 'keypoints'
+
+# .npy files of the features directory that are not students (older builds saved the shortlist vocabulary there)
+RESERVED_FEATURE_FILES = ('vocabulary.npy',)
+
+# Storage types accepted by ``compact``; SIFT values are already integers in [0, 255]
+STORAGE_DTYPES = ('float32', 'float16', 'uint8')
+
+
+class FeatureGallery:
+    """
+    Reference descriptors of every student stacked into one contiguous matrix.
+
+    Row ``i`` of ``descriptors`` belongs to ``student_ids[labels[i]]`` and the rows
+    of student ``j`` are ``descriptors[offsets[j]:offsets[j + 1]]``.
+
+    Descriptors may be stored compactly (float16/uint8, optionally PCA-reduced);
+    ``projection`` then holds the PCA mean and components that frame
+    descriptors must be mapped through before matching.
+
+    ``points`` optionally holds the keypoint position of every descriptor in
+    the enrolment photo (NaN rows for students extracted before positions were
+    kept), which enables geometric verification of matches.
+
+    ``backend`` names the feature backend the descriptors were extracted with;
+    binary (ORB/AKAZE) descriptors are kept as uint8 bit strings.
+    """
+
+    def __init__(self, student_ids, descriptors, offsets, projection=None, points=None, backend=DEFAULT_BACKEND):
+        self.student_ids = list(student_ids)
+        self.descriptors = descriptors
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.projection = projection
+        self.points = points
+        self.backend = backend
+        self.binary = is_binary(backend)
+        self.labels = np.repeat(
+            np.arange(len(self.student_ids), dtype=np.int32),
+            np.diff(self.offsets)
+        )
+        self.index = {student_id: i for i, student_id in enumerate(self.student_ids)}
+        self._working = None
+
+    @classmethod
+    def from_features(cls, features, points=None, backend=None):
+        """
+        Build a gallery from a ``{student_id: descriptors}`` mapping
+        Args:
+            features (dict): Per-student descriptor arrays, in gallery order
+            points (dict): Optional ``{student_id: N x 2 keypoint positions}``
+            backend (str): Feature backend (default: recognised from the descriptors)
+        Returns:
+            FeatureGallery: Stacked gallery
+        Raises:
+            ValueError: If students were extracted with different backends
+        """
+        student_ids = list(features.keys())
+        counts = [len(features[student_id]) for student_id in student_ids]
+        offsets = np.zeros(len(student_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        if backend is None:
+            backend = identify_backend(features[student_ids[0]]) if student_ids else DEFAULT_BACKEND
+            if backend is None:
+                raise ValueError(f"Unrecognised descriptor layout for {student_ids[0]}")
+        dtype, dims, _ = DESCRIPTOR_LAYOUTS[backend]
+        for student_id in student_ids:
+            found = identify_backend(features[student_id])
+            if found != backend:
+                raise ValueError(
+                    f"Features of {student_id} look like {found or 'unknown'} descriptors, "
+                    f"gallery uses {backend}; extract them again with one backend"
+                )
+
+        if student_ids:
+            descriptors = np.ascontiguousarray(
+                np.concatenate([features[student_id] for student_id in student_ids]),
+                dtype=dtype
+            )
+        else:
+            descriptors = np.empty((0, dims), dtype=dtype)
+
+        stacked_points = None
+        if points:
+            stacked_points = np.full((offsets[-1], 2), np.nan, dtype=np.float32)
+            for i, student_id in enumerate(student_ids):
+                student_points = points.get(student_id)
+                if student_points is not None and len(student_points) == counts[i]:
+                    stacked_points[offsets[i]:offsets[i + 1]] = student_points
+
+        return cls(student_ids, descriptors, offsets, points=stacked_points, backend=backend)
+
+    @classmethod
+    def from_directory(cls, features_dir, backend=None):
+        """
+        Build a gallery from the per-student ``{student_id}.npy`` files
+        Args:
+            features_dir (str): Directory containing the .npy descriptors
+            backend (str): Only load features of this backend; the others are
+                left over from before a backend switch and are skipped
+        Returns:
+            FeatureGallery: Stacked gallery
+        """
+        features, points = {}, {}
+        for student_id, path in student_feature_files(features_dir):
+            descriptors = np.load(path)
+            if backend is not None and identify_backend(descriptors) != backend:
+                continue
+            features[student_id] = descriptors
+            student_points = load_points(features_dir, student_id)
+            if student_points is not None:
+                points[student_id] = student_points
+        return cls.from_features(features, points, backend)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-map a consolidated gallery file written by ``save``
+        Args:
+            path (str): Gallery file path
+        Returns:
+            FeatureGallery: Gallery whose descriptors are a read-only memory map
+        """
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER_V1.size:
+                raise ValueError(f"Truncated gallery file: {path}")
+
+            magic, version = struct.unpack_from('<8sI', header)
+            if magic != GALLERY_MAGIC:
+                raise ValueError(f"Not a gallery file: {path}")
+            if version == 1:
+                fields = _HEADER_V1.unpack_from(header) + (0, 0, 0, b'')
+            elif version == 2:
+                fields = _HEADER_V2.unpack_from(header) + (0, b'')
+            elif version == 3:
+                fields = _HEADER_V3.unpack_from(header) + (b'',)
+            elif version == GALLERY_VERSION:
+                fields = _HEADER.unpack_from(header)
+            else:
+                raise ValueError(f"Unsupported gallery version {version} in {path}")
+
+            (_, _, dim, n_students, n_descriptors, dtype, ids_offset, ids_length,
+             offsets_offset, data_offset, projection_offset, projection_cols, points_offset, backend) = fields
+            backend = backend.rstrip(b'\0').decode('ascii') or DEFAULT_BACKEND
+            if backend not in DESCRIPTOR_LAYOUTS:
+                raise ValueError(f"Unknown feature backend '{backend}' in {path}")
+
+            f.seek(ids_offset)
+            raw_ids = f.read(ids_length).decode('utf-8')
+            student_ids = raw_ids.split('\n') if n_students else []
+
+        offsets = np.fromfile(path, dtype='<i8', count=n_students + 1, offset=offsets_offset)
+        dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        if n_descriptors:
+            descriptors = np.memmap(path, dtype=dtype, mode='r', offset=data_offset,
+                                    shape=(n_descriptors, dim))
+        else:
+            descriptors = np.empty((0, dim), dtype=dtype)
+
+        projection = None
+        if projection_cols:
+            projection = np.fromfile(
+                path, dtype='<f4', count=(dim + 1) * projection_cols, offset=projection_offset
+            ).reshape(dim + 1, projection_cols)
+
+        points = None
+        if points_offset:
+            points = np.fromfile(path, dtype='<f4', count=n_descriptors * 2, offset=points_offset).reshape(-1, 2)
+
+        return cls(student_ids, descriptors, offsets, projection, points, backend)
+
+    def save(self, path):
+        """
+        Write the gallery as a single memory-mappable file (atomically replaced)
+        Args:
+            path (str): Destination file path
+        """
+        ids = '\n'.join(self.student_ids).encode('utf-8')
+        ids_offset = _HEADER.size
+        offsets_offset = _aligned(ids_offset + len(ids))
+        data_offset = _aligned(offsets_offset + self.offsets.nbytes)
+        dtype = self.descriptors.dtype.newbyteorder('<')
+        data_length = len(self.descriptors) * self.descriptors.shape[1] * dtype.itemsize
+
+        end = data_offset + data_length
+        projection_offset, projection_cols = 0, 0
+        if self.projection is not None:
+            projection_offset = _aligned(end)
+            projection_cols = self.projection.shape[1]
+            end = projection_offset + self.projection.size * 4
+
+        points_offset = _aligned(end) if self.points is not None else 0
+
+        header = _HEADER.pack(
+            GALLERY_MAGIC, GALLERY_VERSION, self.descriptors.shape[1],
+            len(self.student_ids), len(self.descriptors), dtype.str.encode('ascii'),
+            ids_offset, len(ids), offsets_offset, data_offset,
+            projection_offset, projection_cols, points_offset, self.backend.encode('ascii')
+        )
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(ids)
+            f.write(b'\0' * (offsets_offset - ids_offset - len(ids)))
+            f.write(self.offsets.astype('<i8').tobytes())
+            f.write(b'\0' * (data_offset - offsets_offset - self.offsets.nbytes))
+            f.write(np.ascontiguousarray(self.descriptors, dtype=dtype).tobytes())
+            if self.projection is not None:
+                f.write(b'\0' * (projection_offset - data_offset - data_length))
+                f.write(np.ascontiguousarray(self.projection, dtype='<f4').tobytes())
+            if self.points is not None:
+                f.write(b'\0' * (points_offset - f.tell()))
+                f.write(np.ascontiguousarray(self.points, dtype='<f4').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def compact(self, dtype='float32', pca_dims=0, pca_sample=100000):
+        """
+        Return a smaller copy of the gallery (binary descriptors are already
+        compact and are kept as they are)
+        Args:
+            dtype (str): Storage type, one of STORAGE_DTYPES
+            pca_dims (int): Reduce descriptors to this many PCA dimensions (0 = keep all)
+            pca_sample (int): Maximum number of rows used to fit the PCA
+        Returns:
+            FeatureGallery: Compacted gallery
+        """
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype: {dtype}")
+        if self.projection is not None:
+            raise ValueError("Gallery is already PCA-reduced")
+        if self.binary:
+            if pca_dims:
+                raise ValueError(f"{self.backend} descriptors are binary and cannot be PCA-reduced")
+            return FeatureGallery(self.student_ids, self.descriptors, self.offsets, None, self.points, self.backend)
+
+        descriptors = self.working_descriptors()
+        projection = None
+        if pca_dims:
+            if dtype == 'uint8':
+                raise ValueError("PCA-reduced descriptors cannot be stored as uint8")
+            sample = descriptors
+            if len(sample) > pca_sample:
+                rows = np.random.default_rng(0).choice(len(sample), pca_sample, replace=False)
+                sample = sample[rows]
+            mean = sample.mean(axis=0)
+            _, _, components = np.linalg.svd(sample - mean, full_matrices=False)
+            projection = np.vstack([mean, components[:pca_dims]]).astype(np.float32)
+            descriptors = (descriptors - projection[0]) @ projection[1:].T
+
+        if dtype == 'uint8':
+            descriptors = np.clip(np.rint(descriptors), 0, 255).astype(np.uint8)
+        else:
+            descriptors = np.ascontiguousarray(descriptors, dtype=dtype)
+
+        return FeatureGallery(self.student_ids, descriptors, self.offsets, projection, self.points, self.backend)
+
+    def working_descriptors(self):
+        """float32 descriptors as FLANN needs them (converted once for compact storage); binary ones as stored"""
+        if self.binary or self.descriptors.dtype == np.float32:
+            return self.descriptors
+        if self._working is None:
+            self._working = np.ascontiguousarray(self.descriptors, dtype=np.float32)
+        return self._working
+
+    def project(self, descriptors):
+        """Map frame descriptors into the gallery's descriptor space"""
+        if self.projection is None:
+            return descriptors
+        mean, components = self.projection[0], self.projection[1:]
+        return np.ascontiguousarray((descriptors - mean) @ components.T, dtype=np.float32)
+
+    def with_changes(self, updated=None, removed=(), updated_points=None):
+        """
+        Return a new gallery with some students added, replaced or removed.
+
+        Unchanged students are copied from this gallery, so only the changed
+        descriptors need to be loaded from disk.
+        Args:
+            updated (dict): ``{student_id: descriptors}`` to add or replace
+            removed (iterable): Student ids to drop
+            updated_points (dict): Keypoint positions of the updated students, if known
+        Returns:
+            FeatureGallery: New gallery; this one is left untouched
+        """
+        updated = updated or {}
+        updated_points = updated_points or {}
+        removed = set(removed)
+        features = {
+            student_id: updated.get(student_id, descriptors)
+            for student_id, descriptors in self.working_items()
+            if student_id not in removed
+        }
+        for student_id, descriptors in updated.items():
+            if student_id not in features and student_id not in removed:
+                features[student_id] = descriptors
+
+        points = {}
+        for student_id in features:
+            if student_id in updated:
+                if student_id in updated_points:
+                    points[student_id] = updated_points[student_id]
+            else:
+                student_points = self.get_points(student_id)
+                if student_points is not None:
+                    points[student_id] = student_points
+        return FeatureGallery.from_features(features, points, self.backend)
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    @property
+    def size(self):
+        """Total number of reference descriptors"""
+        return len(self.descriptors)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the stored descriptors"""
+        return self.descriptors.nbytes
+
+    def get(self, student_id):
+        """Descriptors of a single student (a view into the stacked matrix)"""
+        i = self.index[student_id]
+        return self.descriptors[self.offsets[i]:self.offsets[i + 1]]
+
+    def get_points(self, student_id):
+        """Keypoint positions of a single student, or None if they were never recorded"""
+        if self.points is None:
+            return None
+        i = self.index[student_id]
+        points = self.points[self.offsets[i]:self.offsets[i + 1]]
+        return None if len(points) and np.isnan(points[0, 0]) else points
+
+    def items(self):
+        for student_id in self.student_ids:
+            yield student_id, self.get(student_id)
+
+    def working_items(self):
+        """Like ``items`` but with the float32 descriptors used for matching"""
+        descriptors = self.working_descriptors()
+        for i, student_id in enumerate(self.student_ids):
+            yield student_id, descriptors[self.offsets[i]:self.offsets[i + 1]]
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def student_feature_files(features_dir):
+    """
+    Per-student descriptor files of a features directory
+    Returns:
+        list: (student_id, path) pairs sorted by student id; subdirectories and
+              reserved files such as a stray vocabulary are left out
+    """
+    return [
+        (os.path.splitext(name)[0], os.path.join(features_dir, name))
+        for name in sorted(os.listdir(features_dir))
+        if name.endswith('.npy') and name not in RESERVED_FEATURE_FILES
+        and os.path.isfile(os.path.join(features_dir, name))
+    ]
+
+def load_points(features_dir, student_id):
+    """Keypoint positions saved next to ``{student_id}.npy``, or None"""
+    path = os.path.join(features_dir, KEYPOINTS_DIR, f"{student_id}.npy")
+    try:
+        return np.load(path).astype(np.float32, copy=False)
+    except (OSError, ValueError):
+        return None
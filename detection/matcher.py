@@ -1,60 +1,555 @@
 """detection/matcher.py"""
 
 import os
+import threading
+import time
+from collections import namedtuple
 import numpy as np
 import cv2
-from config.settings import Settings
+from config.settings import get_settings
+from detection.face_region import FaceRegionDetector, FaceRegionStats
+from detection.feature_backend import FeatureBackend
+from detection.gallery import FeatureGallery, load_points, student_feature_files
+from detection.shortlist import VladShortlist
+from utils import metrics
 import logging
 
-settings = Settings()
+settings = get_settings()
+logger = logging.getLogger('face_detection.matcher')
+
+# Lowe's ratio test
+RATIO = 0.7
+
+# Faces whose regions overlap more than this are the same face matched twice
+MAX_FACE_OVERLAP = 0.5
+
+# Spatial fallback without reference positions: keep matches within this many
+# (scaled) median absolute deviations of the median match position
+SPREAD_MADS = 3.0
+
+# One identified face: box is (x0, y0, x1, y1) in frame coordinates
+FaceMatch = namedtuple('FaceMatch', ['student_id', 'matches', 'box', 'good_matches'])
+
+_MATCH_FACE_SECONDS = metrics.stage('match_face')
+_EXTRACT_SECONDS = metrics.stage('extract')
+_FACE_DETECT_SECONDS = metrics.stage('face_detect')
+_SHORTLIST_SECONDS = metrics.stage('shortlist')
+_SEARCH_SECONDS = metrics.stage('knn_search')
+_RATIO_TEST_SECONDS = metrics.stage('ratio_test')
+_MATCH_FACES_SECONDS = metrics.stage('match_faces')
+_GEOMETRY_SECONDS = metrics.stage('geometric_verification')
 
 class FaceMatcher:
-    def __init__(self):
-        self.sift = cv2.SIFT_create()
-        self.flann = self._init_flann()
-        self.reference_features = self._load_reference_features()
+    def __init__(self, mode=None, face_detection=None, gallery=None, shortlist_size=None,
+                 min_match_count=None, backend=None):
+        self.mode = mode or settings.MATCH_MODE
+        self.min_match_count = settings.MIN_MATCH_COUNT if min_match_count is None else min_match_count
+        self.shortlist_size = settings.SHORTLIST_SIZE if shortlist_size is None else shortlist_size
+        self.min_inliers = settings.MIN_INLIERS
+        self.max_faces = settings.MAX_FACES
+        self._vocabulary = None
+        self.face_detection = settings.FACE_DETECTION if face_detection is None else face_detection
+        self.face_region_stats = FaceRegionStats()
+        # Extractor, index and distance; the gallery must come from the same backend
+        self.backend = backend if isinstance(backend, FeatureBackend) else FeatureBackend(backend)
+        self.index_params = self.backend.index_params
+        self.search_params = self.backend.search_params
+        if settings.INDEX_PARAMS_FILE and not isinstance(backend, FeatureBackend):
+            tuned = self.backend.load_tuned_params(settings.INDEX_PARAMS_FILE)
+            if tuned:
+                logger.info(
+                    f"Using calibrated index parameters ({tuned['label']}, recall {tuned['recall']:.1%}, "
+                    f"agreement {tuned['agreement']:.1%}) from {settings.INDEX_PARAMS_FILE}"
+                )
+        # OpenCV extractors/matchers are not shared between threads (multi-camera worker pool)
+        self._local = threading.local()
+        self._reload_lock = threading.Lock()
+        self._stop_reload = threading.Event()
+        self._reload_thread = None
+        self._source_state = self._scan_sources()
+        self.gallery = gallery if gallery is not None else self._load_reference_features()
+        logger.info(
+            f"Loaded {len(self.gallery)} students ({self.gallery.size} descriptors), "
+            f"backend: {self.backend.name}/{self.backend.index}, "
+            f"match mode: {self.mode}, shortlist: {self.shortlist_size or 'off'}"
+        )
+
+    @property
+    def gallery(self):
+        return self._state[0]
+
+    @gallery.setter
+    def gallery(self, gallery):
+        if gallery.backend != self.backend.name:
+            raise ValueError(
+                f"Gallery was extracted with {gallery.backend}, matcher uses {self.backend.name}; "
+                f"re-extract the features or set FEATURE_BACKEND={gallery.backend}"
+            )
+        # Gallery and its shortlist index are swapped together as one tuple
+        self._state = (gallery, self._build_shortlist(gallery))
+
+    def _build_shortlist(self, gallery):
+        if not self.shortlist_size or len(gallery) <= self.shortlist_size:
+            return None
+        if gallery.binary:
+            # VLAD residuals need a vector space; binary descriptors are matched in full
+            logger.warning(f"Shortlist is not available for {gallery.backend} descriptors, matching all students")
+            return None
+
+        dim = gallery.descriptors.shape[1]
+        if self._vocabulary is None or self._vocabulary.shape[1] != dim:
+            vocabulary = VladShortlist.load_vocabulary(settings.VOCABULARY_FILE, dim)
+            if vocabulary is None:
+                vocabulary = VladShortlist.train_vocabulary(gallery.working_descriptors(), settings.VOCABULARY_SIZE)
+                logger.info(f"Trained a {len(vocabulary)}-word vocabulary for the shortlist")
+            self._vocabulary = vocabulary
+
+        start = time.perf_counter()
+        shortlist = VladShortlist(self._vocabulary, gallery)
+        logger.info(
+            f"Shortlist index built for {len(gallery)} students in {time.perf_counter() - start:.2f}s"
+        )
+        return shortlist
 
-    def _init_flann(self):
-        index_params = dict(algorithm=1, trees=5)
-        search_params = dict(checks=50)
-        return cv2.FlannBasedMatcher(index_params, search_params)
+    @property
+    def extractor(self):
+        if not hasattr(self._local, 'extractor'):
+            self._local.extractor = self.backend.create_extractor()
+        return self._local.extractor
+
+    @property
+    def knn_matcher(self):
+        if not hasattr(self._local, 'knn_matcher'):
+            self._local.knn_matcher = self.backend.create_matcher()
+        return self._local.knn_matcher
+
+    @property
+    def face_regions(self):
+        if not hasattr(self._local, 'face_regions'):
+            self._local.face_regions = FaceRegionDetector()
+        return self._local.face_regions
 
     def _load_reference_features(self):
-        features = {}
-        for file in os.listdir(settings.FEATURES_DIR):
-            if file.endswith('.npy'):
-                student_id = os.path.splitext(file)[0]
-                descriptors = np.load(os.path.join(settings.FEATURES_DIR, file))
-                features[student_id] = descriptors
-        return features
+        # Prefer the consolidated gallery file: it is memory-mapped, so replicas share its pages
+        if os.path.exists(settings.GALLERY_FILE):
+            return FeatureGallery.open(settings.GALLERY_FILE)
+        return FeatureGallery.from_directory(settings.FEATURES_DIR, self.backend.name)
+
+    def _scan_sources(self):
+        """Stat the gallery sources: the gallery file if present, else the .npy files"""
+        if os.path.exists(settings.GALLERY_FILE):
+            stat = os.stat(settings.GALLERY_FILE)
+            return {settings.GALLERY_FILE: (stat.st_ino, stat.st_mtime_ns, stat.st_size)}
+
+        state = {}
+        for student_id, path in student_feature_files(settings.FEATURES_DIR):
+            stat = os.stat(path)
+            state[student_id] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def reload(self):
+        """
+        Pick up added, changed or removed reference features.
+
+        The new gallery is built on the side and swapped in with a single
+        attribute assignment, so ``match_face`` keeps using the old one until
+        the swap and never sees a half-built gallery.
+        Returns:
+            bool: True if the gallery changed
+        """
+        with self._reload_lock:
+            state = self._scan_sources()
+            previous = self._source_state
+            if state == previous:
+                return False
+
+            if settings.GALLERY_FILE in state or settings.GALLERY_FILE in previous:
+                # Consolidated file: re-mapping it is cheap, no per-student parsing
+                gallery = self._load_reference_features()
+                logger.info(f"Gallery file changed, reloaded {len(gallery)} students")
+            else:
+                removed = set(previous.keys() - state.keys())
+                changed = [sid for sid, stat in state.items() if previous.get(sid) != stat]
+                updated, updated_points = {}, {}
+                for sid in changed:
+                    try:
+                        descriptors = np.load(os.path.join(settings.FEATURES_DIR, f"{sid}.npy"))
+                        if not self.backend.accepts(descriptors):
+                            # Re-extracted for another backend: never mix it into this gallery
+                            logger.warning(f"Features of {sid} are not {self.backend.name} descriptors, skipping")
+                            removed.add(sid)
+                            continue
+                        updated[sid] = descriptors
+                        points = load_points(settings.FEATURES_DIR, sid)
+                        if points is not None:
+                            updated_points[sid] = points
+                    except (OSError, ValueError) as e:
+                        # Retry on the next poll instead of dropping the student
+                        logger.warning(f"Could not load features for {sid}: {e}")
+                        if sid in previous:
+                            state[sid] = previous[sid]
+                        else:
+                            del state[sid]
+                gallery = self.gallery.with_changes(updated, removed, updated_points)
+                logger.info(
+                    f"Gallery reloaded: {len(updated)} added/changed, {len(removed)} removed, "
+                    f"{len(gallery)} students"
+                )
+
+            self.gallery = gallery
+            self._source_state = state
+            return True
+
+    def start_auto_reload(self, interval=None):
+        """Poll the feature sources in a background thread and reload on change"""
+        interval = interval or settings.GALLERY_RELOAD_INTERVAL
+        if self._reload_thread and self._reload_thread.is_alive():
+            return
+
+        def _run():
+            while not self._stop_reload.wait(interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Failed to reload reference features: {e}")
+
+        self._stop_reload.clear()
+        self._reload_thread = threading.Thread(target=_run, name='gallery-reload', daemon=True)
+        self._reload_thread.start()
+
+    def stop_auto_reload(self):
+        self._stop_reload.set()
+        if self._reload_thread:
+            self._reload_thread.join()
+            self._reload_thread = None
 
     def match_face(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        _, current_descriptors = self.sift.detectAndCompute(gray, None)
-        
-        if current_descriptors is None:
-            return None, 0, []
+        detected_face, max_matches, good_matches, _ = self.locate_face(frame)
+        return detected_face, max_matches, good_matches
+
+    def locate_face(self, frame):
+        """
+        Like ``match_face``, plus where in the frame the match was found
+        Returns:
+            tuple: (student_id or None, good match count, good matches,
+                    Nx2 frame coordinates of the matched keypoints or None)
+        """
+        with _MATCH_FACE_SECONDS.time():
+            # Frame sources may already deliver grayscale (MJPEG/replay decode)
+            gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            points, current_descriptors = self._extract_features(gray)
+
+            if current_descriptors is None:
+                return None, 0, [], None
+
+            detected_face, max_matches, good_matches = self.match_descriptors(current_descriptors)
+            if detected_face is None:
+                return None, 0, [], None
+            return detected_face, max_matches, good_matches, points[[m.trainIdx for m in good_matches]]
+
+    def match_faces(self, frame):
+        """
+        Identify every student in the frame, not just the best-voted one.
+
+        Students are taken in vote order; each must keep ``min_match_count``
+        matches on frame keypoints not already claimed by an accepted face and
+        ``min_inliers`` of them must survive the geometric check (RANSAC
+        homography from the enrolment photo, or a spatial-spread test for
+        students whose keypoint positions were not recorded).
+        Returns:
+            list: FaceMatch per identified face, best first
+        """
+        with _MATCH_FACES_SECONDS.time():
+            gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            points, current_descriptors = self._extract_features(gray)
+            if current_descriptors is None:
+                return []
+
+            gallery, shortlist = self._state
+            current_descriptors = gallery.project(current_descriptors)
+            candidates = None
+            if shortlist is not None:
+                with _SHORTLIST_SECONDS.time():
+                    candidates = shortlist.candidates(current_descriptors, max(self.shortlist_size, self.max_faces))
+
+            hits = self._gallery_hits(current_descriptors, gallery, candidates)
+            if hits is None:
+                return []
+            return self._separate_faces(gallery, points, *hits)
+
+    def _separate_faces(self, gallery, points, labels, rows, frame_indices, distances):
+        """Turn the good gallery matches of one frame into verified, non-overlapping faces"""
+        votes = np.bincount(labels, minlength=len(gallery))
+        claimed = np.zeros(len(points), dtype=bool)
+        faces = []
+
+        with _GEOMETRY_SECONDS.time():
+            for student in np.argsort(-votes, kind='stable'):
+                if votes[student] < self.min_match_count or len(faces) >= self.max_faces:
+                    break
+
+                hits = np.flatnonzero((labels == student) & ~claimed[frame_indices])
+                if len(hits) < self.min_match_count:
+                    continue
+
+                frame_points = points[frame_indices[hits]]
+                reference_points = None
+                if gallery.points is not None:
+                    reference_points = gallery.points[rows[hits]]
+                inliers = _geometric_inliers(reference_points, frame_points)
+                hits = hits[inliers]
+                if len(hits) < self.min_inliers:
+                    continue
+
+                low = points[frame_indices[hits]].min(axis=0)
+                high = points[frame_indices[hits]].max(axis=0)
+                box = (int(low[0]), int(low[1]), int(np.ceil(high[0])), int(np.ceil(high[1])))
+                if any(_overlap(box, face.box) > MAX_FACE_OVERLAP for face in faces):
+                    continue
+
+                claimed[frame_indices[hits]] = True
+                offset = gallery.offsets[student]
+                good_matches = [
+                    cv2.DMatch(int(rows[hit] - offset), int(frame_indices[hit]), float(distances[hit]))
+                    for hit in hits
+                ]
+                faces.append(FaceMatch(gallery.student_ids[student], len(hits), box, good_matches))
+        return faces
+
+    def verify(self, student_id, gray):
+        """
+        Match an image region against a single student's descriptors.
+        Used to re-confirm a tracked face without searching the whole gallery.
+        Returns:
+            int: Good matches after the ratio test (0 if the student left the gallery)
+        """
+        gallery = self.gallery
+        if student_id not in gallery.index or min(gray.shape[:2]) < 16:
+            return 0
+
+        with _EXTRACT_SECONDS.time():
+            _, descriptors = self.extractor.detectAndCompute(gray, None)
+        if descriptors is None or len(descriptors) < 2:
+            return 0
 
+        i = gallery.index[student_id]
+        reference = gallery.working_descriptors()[gallery.offsets[i]:gallery.offsets[i + 1]]
+        with _SEARCH_SECONDS.time():
+            matches = self.knn_matcher.knnMatch(reference, gallery.project(descriptors), k=2)
+        return sum(1 for pair in matches if len(pair) == 2 and pair[0].distance < RATIO * pair[1].distance)
+
+    def match_descriptors(self, current_descriptors):
+        """
+        Identify the student behind already extracted frame descriptors
+        Returns:
+            tuple: (student_id or None, good match count, good matches)
+        """
+        # Take one reference so a concurrent reload cannot swap the gallery mid-match
+        gallery, shortlist = self._state
+        current_descriptors = gallery.project(current_descriptors)
+
+        # Coarse stage: only the closest students by global (VLAD) vector get the full check
+        candidates = None
+        if shortlist is not None:
+            with _SHORTLIST_SECONDS.time():
+                candidates = shortlist.candidates(current_descriptors, self.shortlist_size)
+
+        if self.mode == 'gallery':
+            best_match, max_matches, best_good_matches = self._match_gallery(current_descriptors, gallery, candidates)
+        else:
+            best_match, max_matches, best_good_matches = self._match_per_student(current_descriptors, gallery, candidates)
+
+        if max_matches >= self.min_match_count:
+            return best_match, max_matches, best_good_matches
+
+        return None, 0, []
+
+    def _extract_features(self, gray):
+        """
+        Keypoints and descriptors of the frame (or of its face crops)
+        Returns:
+            tuple: (Nx2 keypoint positions in frame coordinates, descriptors) or (None, None)
+        """
+        if not self.face_detection:
+            with _EXTRACT_SECONDS.time():
+                keypoints, descriptors = self.extractor.detectAndCompute(gray, None)
+            if descriptors is None:
+                return None, None
+            return cv2.KeyPoint_convert(keypoints), descriptors
+
+        # Describe only the face crops; frames without a face skip matching entirely
+        stats = self.face_region_stats
+        _, crops, origins, detect_time = self.face_regions.regions_with_origins(gray)
+        _FACE_DETECT_SECONDS.observe(detect_time)
+
+        if stats.start_frame(detect_time):
+            start = time.perf_counter()
+            self.extractor.detectAndCompute(gray, None)
+            stats.record_full_sift(time.perf_counter() - start)
+
+        if not crops:
+            stats.record_without_face()
+            return None, None
+
+        start = time.perf_counter()
+        parts = [self.extractor.detectAndCompute(crop, None) for crop in crops]
+        elapsed = time.perf_counter() - start
+        stats.record_crops(elapsed)
+        _EXTRACT_SECONDS.observe(elapsed)
+
+        points, descriptors = [], []
+        for (keypoints, crop_descriptors), (x0, y0, scale) in zip(parts, origins):
+            if crop_descriptors is None:
+                continue
+            points.append(cv2.KeyPoint_convert(keypoints) / scale + (x0, y0))
+            descriptors.append(crop_descriptors)
+        if not descriptors:
+            return None, None
+        return np.vstack(points).astype(np.float32), np.vstack(descriptors)
+
+    def _match_per_student(self, current_descriptors, gallery, candidates=None):
         best_match = None
         max_matches = 0
         best_good_matches = []
 
-        for student_id, ref_descriptors in self.reference_features.items():
-            matches = self.flann.knnMatch(ref_descriptors, current_descriptors, k=2)
-            
+        items = gallery.working_items()
+        if candidates is not None:
+            descriptors = gallery.working_descriptors()
+            items = (
+                (gallery.student_ids[i], descriptors[gallery.offsets[i]:gallery.offsets[i + 1]])
+                for i in candidates
+            )
+
+        search_time = ratio_time = 0.0
+        for student_id, ref_descriptors in items:
+            start = time.perf_counter()
+            matches = self.knn_matcher.knnMatch(ref_descriptors, current_descriptors, k=2)
+            searched = time.perf_counter()
+            search_time += searched - start
+
             # Lowe's ratio test
             good_matches = []
-            for m, n in matches:
-                if m.distance < 0.7 * n.distance:
-                    good_matches.append(m)
-            
+            for pair in matches:
+                if len(pair) == 2 and pair[0].distance < RATIO * pair[1].distance:
+                    good_matches.append(pair[0])
+
             if len(good_matches) > max_matches:
                 max_matches = len(good_matches)
                 best_match = student_id
                 best_good_matches = good_matches
+            ratio_time += time.perf_counter() - searched
 
-        if max_matches >= settings.MIN_MATCH_COUNT:
-            return best_match, max_matches, best_good_matches
-        
-        return None, 0, []
-        
\ No newline at end of file
+        _SEARCH_SECONDS.observe(search_time)
+        _RATIO_TEST_SECONDS.observe(ratio_time)
+        return best_match, max_matches, best_good_matches
+
+    def _match_gallery(self, current_descriptors, gallery, candidates=None):
+        """
+        Match the whole gallery against the frame with a single KNN query.
+
+        The ratio test is evaluated per reference descriptor against its two
+        nearest frame descriptors (same direction as the per-student loop), so
+        the index is built once over the frame and queried with the stacked
+        gallery; votes are then counted per student with ``np.bincount``.
+        With ``candidates`` only the rows of those students are queried.
+        """
+        hits = self._gallery_hits(current_descriptors, gallery, candidates)
+        if hits is None:
+            return None, 0, []
+        labels, rows, frame_indices, distances = hits
+
+        votes = np.bincount(labels, minlength=len(gallery))
+        best = int(np.argmax(votes))
+        max_matches = int(votes[best])
+        if max_matches == 0:
+            return None, 0, []
+
+        best_hits = np.flatnonzero(labels == best)
+        offset = gallery.offsets[best]
+        best_good_matches = [
+            cv2.DMatch(int(rows[hit] - offset), int(frame_indices[hit]), float(distances[hit]))
+            for hit in best_hits
+        ]
+        return gallery.student_ids[best], max_matches, best_good_matches
+
+    def _gallery_hits(self, current_descriptors, gallery, candidates=None):
+        """
+        Reference descriptors that pass the ratio test against the frame
+        Returns:
+            tuple: (student labels, gallery rows, frame descriptor indices,
+                    distances), or None when nothing can be matched
+        """
+        if gallery.size == 0 or len(current_descriptors) < 2:
+            return None
+
+        reference = gallery.working_descriptors()
+        labels = gallery.labels
+        rows = None
+        if candidates is not None:
+            rows = np.concatenate([
+                np.arange(gallery.offsets[i], gallery.offsets[i + 1]) for i in candidates
+            ])
+            reference = reference[rows]
+            labels = labels[rows]
+            if len(rows) == 0:
+                return None
+
+        with _SEARCH_SECONDS.time():
+            neighbours, distances = self.backend.knn_search(current_descriptors, reference)
+
+        with _RATIO_TEST_SECONDS.time():
+            good = np.flatnonzero(distances[:, 0] < RATIO * distances[:, 1])
+
+        gallery_rows = good if rows is None else rows[good]
+        return labels[good], gallery_rows, neighbours[good, 0], distances[good, 0]
+
+
+def _geometric_inliers(reference_points, frame_points):
+    """
+    Mask of matches consistent with one face.
+
+    With enrolment positions a RANSAC homography maps the photo onto the
+    frame; otherwise matches far from the median position (in units of the
+    median absolute deviation) are dropped, which splits off votes a student
+    collected on another face.
+    """
+    if reference_points is not None and len(reference_points) >= 4 and not np.isnan(reference_points).any():
+        homography, mask = cv2.findHomography(
+            reference_points, frame_points, cv2.RANSAC, settings.HOMOGRAPHY_THRESHOLD
+        )
+        if homography is None:
+            return np.zeros(len(frame_points), dtype=bool)
+        return mask.ravel().astype(bool)
+
+    centre = np.median(frame_points, axis=0)
+    deviation = np.abs(frame_points - centre)
+    spread = np.maximum(1.4826 * np.median(deviation, axis=0), 1.0)
+    return np.all(deviation <= SPREAD_MADS * spread, axis=1)
+
+
+def _overlap(a, b):
+    """Intersection over union of two (x0, y0, x1, y1) boxes"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union else 0.0
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def get_matcher():
+    """FaceMatcher with the configured gallery, loaded on first use and shared by every camera"""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                if settings.MATCH_SHARDS > 0:
+                    # Imported here: the sharded matcher subclasses FaceMatcher
+                    from detection.sharded_matcher import ShardedMatcher
+                    _matcher = ShardedMatcher()
+                else:
+                    _matcher = FaceMatcher()
+    return _matcher
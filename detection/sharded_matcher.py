@@ -0,0 +1,236 @@
+"""detection/sharded_matcher.py"""
+
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from config.settings import get_settings
+from detection.feature_backend import FeatureBackend
+from detection.matcher import FaceMatcher, RATIO
+
+settings = get_settings()
+logger = logging.getLogger('face_detection.sharded_matcher')
+
+def _shard_worker(conn, backend_name, index, index_params, search_params, gallery_block, gallery_shape,
+                  gallery_dtype, row_start, row_end, labels):
+    """
+    Worker process: KNN search of one gallery shard against every frame.
+
+    The shard's reference rows are a view into the parent's shared memory
+    block, so the gallery is never pickled or copied into the worker.
+    Frame descriptors arrive the same way, through a shared frame buffer.
+    The parent creates and unlinks every block (spawned workers share its
+    resource tracker), so the worker only closes its views.
+    """
+    backend = FeatureBackend(backend_name, index)
+    backend.index_params = index_params
+    backend.search_params = search_params
+
+    block = shared_memory.SharedMemory(name=gallery_block)
+    gallery = np.ndarray(gallery_shape, dtype=gallery_dtype, buffer=block.buf)
+    reference = gallery[row_start:row_end]
+    frame_block = None
+
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                return
+            frame_name, rows, candidates = message
+            try:
+                if frame_block is None or frame_block.name != frame_name:
+                    if frame_block is not None:
+                        frame_block.close()
+                    frame_block = shared_memory.SharedMemory(name=frame_name)
+                frame = np.ndarray((rows, gallery_shape[1]), dtype=gallery_dtype, buffer=frame_block.buf)
+
+                shard_rows = np.arange(row_start, row_end)
+                shard_reference, shard_labels = reference, labels
+                if candidates is not None:
+                    keep = np.isin(labels, candidates)
+                    shard_rows, shard_reference, shard_labels = shard_rows[keep], reference[keep], labels[keep]
+                if len(shard_reference) == 0:
+                    conn.send(('ok', None))
+                    continue
+
+                neighbours, distances = backend.knn_search(frame, shard_reference)
+                good = np.flatnonzero(distances[:, 0] < RATIO * distances[:, 1])
+                conn.send(('ok', (shard_labels[good], shard_rows[good], neighbours[good, 0], distances[good, 0])))
+            except Exception as e:
+                conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        if frame_block is not None:
+            frame_block.close()
+        block.close()
+
+class _ShardPool:
+    """Worker processes serving one gallery, and the shared memory they read"""
+
+    def __init__(self, gallery, workers, backend, timeout=None):
+        self.gallery = gallery
+        self.timeout = timeout or settings.MATCH_SHARD_TIMEOUT
+        descriptors = np.ascontiguousarray(gallery.working_descriptors())
+        self.dtype = descriptors.dtype
+        self.dims = descriptors.shape[1]
+
+        self.block = shared_memory.SharedMemory(create=True, size=max(descriptors.nbytes, 1))
+        np.ndarray(descriptors.shape, dtype=self.dtype, buffer=self.block.buf)[:] = descriptors
+        self.frame_block = None
+        self.frame_capacity = 0
+        self.lock = threading.Lock()
+
+        # Equal row ranges: the ratio test is per reference row, so a student may span two shards
+        bounds = np.linspace(0, len(descriptors), workers + 1).astype(int)
+        context = multiprocessing.get_context('spawn')
+        self.connections, self.processes = [], []
+        for i in range(workers):
+            start, end = int(bounds[i]), int(bounds[i + 1])
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_shard_worker, name=f'match-shard-{i}', daemon=True,
+                args=(child_conn, backend.name, backend.index, dict(backend.index_params),
+                      dict(backend.search_params), self.block.name, descriptors.shape, self.dtype.str,
+                      start, end, gallery.labels[start:end])
+            )
+            process.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+    def _frame_buffer(self, rows):
+        if rows > self.frame_capacity:
+            if self.frame_block is not None:
+                self.frame_block.close()
+                self.frame_block.unlink()
+            # Grow with headroom so a busier frame does not reallocate every time
+            self.frame_capacity = max(rows * 2, 1024)
+            self.frame_block = shared_memory.SharedMemory(
+                create=True, size=self.frame_capacity * self.dims * self.dtype.itemsize
+            )
+        return np.ndarray((rows, self.dims), dtype=self.dtype, buffer=self.frame_block.buf)
+
+    def search(self, current_descriptors, candidates=None):
+        """
+        Ratio-test hits of every shard, merged
+        Returns:
+            tuple: (student labels, gallery rows, frame indices, distances) like ``_gallery_hits``
+        Raises:
+            TimeoutError: If a shard does not answer within ``timeout`` seconds (hung worker)
+            EOFError: If a shard's process is gone
+        """
+        with self.lock:
+            if not self.connections:
+                raise RuntimeError("shard pool is closed")
+            self._frame_buffer(len(current_descriptors))[:] = current_descriptors
+            message = (self.frame_block.name, len(current_descriptors), candidates)
+            for conn in self.connections:
+                conn.send(message)
+            deadline = time.monotonic() + self.timeout
+            replies = []
+            for i, conn in enumerate(self.connections):
+                # poll() also returns on EOF, where recv() raises EOFError
+                if not conn.poll(max(deadline - time.monotonic(), 0)):
+                    raise TimeoutError(f"match shard {i} did not answer within {self.timeout:.1f}s")
+                replies.append(conn.recv())
+
+        parts = []
+        for status, payload in replies:
+            if status != 'ok':
+                raise RuntimeError(f"Match shard failed: {payload}")
+            if payload is not None:
+                parts.append(payload)
+        if not parts:
+            return None
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def close(self, graceful=True):
+        """Stop the workers; ``graceful=False`` kills them at once (a hung worker would not answer)"""
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    if graceful:
+                        conn.send(None)
+                except (OSError, ValueError):
+                    pass
+            for process in self.processes:
+                if graceful:
+                    process.join(timeout=5)
+                if process.is_alive():
+                    process.kill()
+                    process.join(timeout=1)
+            for conn in self.connections:
+                conn.close()
+            for block in (self.block, self.frame_block):
+                if block is not None:
+                    block.close()
+                    block.unlink()
+            self.connections, self.processes = [], []
+            self.block = self.frame_block = None
+
+class ShardedMatcher(FaceMatcher):
+    """
+    ``FaceMatcher`` whose gallery search runs in ``workers`` processes.
+
+    The working gallery is copied once into shared memory and split into
+    equal row ranges, one per worker. For every frame the projected
+    descriptors are written to a shared frame buffer, every worker searches
+    its rows against them, and the ratio-test hits are concatenated; votes
+    are then counted exactly as in one process, so results and the
+    ``match_face``/``match_faces`` contracts are unchanged. Frames are
+    dispatched one at a time (all workers serve the same frame). A shard
+    that fails, dies or does not answer within ``MATCH_SHARD_TIMEOUT``
+    retires the pool: matching continues in-process until the gallery
+    changes and a new pool is started.
+    Only ``MATCH_MODE=gallery`` is sharded.
+    """
+
+    def __init__(self, workers=None, **kwargs):
+        self.workers = workers or settings.MATCH_SHARDS or 1
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        super().__init__(**kwargs)
+        if self.mode != 'gallery':
+            logger.warning(f"Match mode '{self.mode}' is not sharded, matching in the main process")
+        atexit.register(self.close)
+
+    @FaceMatcher.gallery.setter
+    def gallery(self, gallery):
+        FaceMatcher.gallery.fset(self, gallery)
+        if gallery.size == 0:
+            self._replace_pool(None)
+            return
+        pool = _ShardPool(gallery, self.workers, self.backend)
+        logger.info(f"Gallery of {gallery.size} descriptors sharded over {self.workers} worker processes")
+        self._replace_pool(pool)
+
+    def _replace_pool(self, pool, graceful=True):
+        with self._pool_lock:
+            old, self._pool = self._pool, pool
+        if old is not None:
+            old.close(graceful)
+
+    def _gallery_hits(self, current_descriptors, gallery, candidates=None):
+        pool = self._pool
+        if pool is None or pool.gallery is not gallery or gallery.size == 0 or len(current_descriptors) < 2:
+            return super()._gallery_hits(current_descriptors, gallery, candidates)
+
+        try:
+            return pool.search(
+                np.ascontiguousarray(current_descriptors, dtype=pool.dtype),
+                None if candidates is None else np.asarray(candidates, dtype=gallery.labels.dtype)
+            )
+        except (RuntimeError, OSError, EOFError) as e:
+            # A dead or hung worker leaves the pool unusable (replies would arrive out of step);
+            # match here until the gallery changes
+            logger.error(f"Sharded search failed ({e}), matching in the main process")
+            if self._pool is pool:
+                self._replace_pool(None, graceful=False)
+            return super()._gallery_hits(current_descriptors, gallery, candidates)
+
+    def close(self):
+        """Stop the worker processes and release the shared memory"""
+        self.stop_auto_reload()
+        self._replace_pool(None)
@@ -0,0 +1,123 @@
+"""detection/shortlist.py"""
+
+import os
+import logging
+import numpy as np
+import cv2
+
+logger = logging.getLogger('face_detection.shortlist')
+
+class VladShortlist:
+    """
+    Coarse first stage of the matcher.
+
+    Every student's descriptors are aggregated into one VLAD vector over a
+    small visual vocabulary (k-means centroids). A frame is aggregated the
+    same way and the students with the highest cosine similarity are
+    returned as candidates for the full KNN + ratio-test check, so the
+    expensive stage no longer grows with the size of the enrolment.
+    """
+
+    def __init__(self, vocabulary, gallery):
+        self.vocabulary = np.ascontiguousarray(vocabulary, dtype=np.float32)
+        self._vocabulary_sq = (self.vocabulary ** 2).sum(axis=1)
+        self.student_vectors = self._gallery_vectors(gallery)
+
+    @staticmethod
+    def train_vocabulary(descriptors, size, sample=50000, seed=0):
+        """
+        k-means vocabulary over a sample of gallery descriptors
+        Args:
+            descriptors (np.ndarray): float32 gallery descriptors
+            size (int): Number of visual words
+            sample (int): Maximum number of descriptors used for training
+        Returns:
+            np.ndarray: (size, dim) centroids
+        """
+        if len(descriptors) > sample:
+            rows = np.random.default_rng(seed).choice(len(descriptors), sample, replace=False)
+            descriptors = descriptors[rows]
+        size = min(size, len(descriptors))
+
+        cv2.setRNGSeed(seed)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+        _, _, centroids = cv2.kmeans(
+            np.ascontiguousarray(descriptors, dtype=np.float32), size, None,
+            criteria, 2, cv2.KMEANS_PP_CENTERS
+        )
+        return centroids
+
+    @staticmethod
+    def load_vocabulary(path, dim):
+        """Vocabulary saved next to the gallery, or None if missing or of another dimension"""
+        if not os.path.exists(path):
+            return None
+        vocabulary = np.load(path)
+        if vocabulary.ndim != 2 or vocabulary.shape[1] != dim:
+            logger.warning(f"Ignoring vocabulary {path}: expected {dim} dims, got {vocabulary.shape}")
+            return None
+        return vocabulary
+
+    def _assign(self, descriptors):
+        """Nearest visual word of every descriptor"""
+        distances = (self._vocabulary_sq[None, :]
+                     - 2.0 * descriptors @ self.vocabulary.T)
+        return np.argmin(distances, axis=1)
+
+    def _residual_sums(self, descriptors, groups, n_groups):
+        """
+        Sum of residuals to the nearest visual word, per group and word
+        Args:
+            descriptors (np.ndarray): float32 descriptors
+            groups (np.ndarray): Group (student) index of every descriptor
+            n_groups (int): Number of groups
+        Returns:
+            np.ndarray: (n_groups, words * dim) unnormalised VLAD vectors
+        """
+        words, dim = self.vocabulary.shape
+        sums = np.zeros((n_groups * words, dim), dtype=np.float32)
+        if len(descriptors):
+            assignment = self._assign(descriptors)
+            residuals = descriptors - self.vocabulary[assignment]
+            cells = groups.astype(np.int64) * words + assignment
+            order = np.argsort(cells, kind='stable')
+            cells = cells[order]
+            starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+            sums[cells[starts]] = np.add.reduceat(residuals[order], starts, axis=0)
+        return sums.reshape(n_groups, words * dim)
+
+    @staticmethod
+    def _normalise(vectors):
+        """Power (signed square root) then L2 normalisation"""
+        vectors = np.sign(vectors) * np.sqrt(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _gallery_vectors(self, gallery, chunk=65536):
+        descriptors = gallery.working_descriptors()
+        sums = np.zeros((len(gallery), self.vocabulary.size), dtype=np.float32)
+        # Per blok baris supaya matriks jarak tetap kecil untuk galeri besar
+        for start in range(0, gallery.size, chunk):
+            stop = min(start + chunk, gallery.size)
+            labels = gallery.labels[start:stop]
+            first, last = int(labels[0]), int(labels[-1])
+            sums[first:last + 1] += self._residual_sums(
+                descriptors[start:stop], labels - first, last - first + 1
+            )
+        return self._normalise(sums)
+
+    def candidates(self, descriptors, k):
+        """
+        Indices of the ``k`` students whose VLAD vector is closest to the frame's
+        Args:
+            descriptors (np.ndarray): float32 frame descriptors (gallery space)
+            k (int): Shortlist size
+        Returns:
+            np.ndarray: Sorted student indices
+        """
+        groups = np.zeros(len(descriptors), dtype=np.int64)
+        frame_vector = self._normalise(self._residual_sums(descriptors, groups, 1))[0]
+        scores = self.student_vectors @ frame_vector
+        if k >= len(scores):
+            return np.arange(len(scores))
+        return np.sort(np.argpartition(-scores, k)[:k])
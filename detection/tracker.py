@@ -0,0 +1,146 @@
+"""detection/tracker.py"""
+
+import time
+import logging
+import numpy as np
+import cv2
+from config.settings import get_settings
+from utils import metrics
+
+settings = get_settings()
+logger = logging.getLogger('face_detection.tracker')
+
+# Alasan track berakhir
+LOST_POINTS = 'points'
+LOST_VERIFICATION = 'verification'
+
+_TRACK_SECONDS = metrics.stage('track')
+_TRACKS_STARTED = metrics.counter('tracks_started_total', 'Identities handed over to the tracker')
+
+class FaceTracker:
+    """
+    Follows an identified face with pyramidal Lucas-Kanade optical flow.
+
+    After a full gallery match the matched keypoints (plus corners found in
+    their bounding box) are tracked on a downscaled grayscale frame, with a
+    forward-backward check to drop drifting points. While enough points
+    survive, the tracked identity is reported without running SIFT; every
+    ``verify_interval`` seconds the caller re-checks the region against the
+    tracked student only. Losing the points or failing verification ends
+    the track and the caller goes back to the full search.
+    """
+
+    def __init__(self, width=None, min_points=None, verify_interval=None, max_error=None):
+        self.width = width or settings.TRACK_WIDTH
+        self.min_points = min_points or settings.TRACK_MIN_POINTS
+        self.verify_interval = verify_interval or settings.TRACK_VERIFY_INTERVAL
+        self.max_error = max_error or settings.TRACK_MAX_ERROR
+        self.lk_params = dict(
+            winSize=(21, 21), maxLevel=3,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+        )
+        self._reset()
+
+    def _reset(self):
+        self.student_id = None
+        self.matches = 0
+        self.points = None
+        self.previous = None
+        self.scale = 1.0
+        self.verified_at = 0.0
+
+    @property
+    def active(self):
+        return self.student_id is not None
+
+    def _downscale(self, gray):
+        self.scale = min(1.0, self.width / gray.shape[1])
+        if self.scale < 1.0:
+            return cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def start(self, gray, student_id, points, matches):
+        """
+        Begin tracking after a full match
+        Args:
+            gray (np.ndarray): Frame the match was found in
+            student_id (str): Matched student
+            points (np.ndarray): Nx2 frame coordinates of the matched keypoints
+            matches (int): Good match count reported while tracking
+        Returns:
+            bool: False if there was too little texture to track
+        """
+        small = self._downscale(gray)
+        seeds = np.asarray(points, dtype=np.float32).reshape(-1, 2) * self.scale
+
+        # Corners inside the matched area track better than SIFT blob centres
+        x0, y0 = np.floor(seeds.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(seeds.max(axis=0)).astype(int)
+        mask = np.zeros_like(small)
+        mask[max(0, y0):y1 + 1, max(0, x0):x1 + 1] = 255
+        corners = cv2.goodFeaturesToTrack(small, maxCorners=100, qualityLevel=0.01, minDistance=5, mask=mask)
+        if corners is not None:
+            seeds = np.vstack([seeds, corners.reshape(-1, 2)])
+
+        if len(seeds) < self.min_points:
+            return False
+
+        self.student_id = student_id
+        self.matches = matches
+        self.points = seeds.reshape(-1, 1, 2)
+        self.previous = small
+        self.verified_at = time.time()
+        _TRACKS_STARTED.inc()
+        return True
+
+    def update(self, gray):
+        """
+        Move the tracked points to the new frame
+        Returns:
+            bool: True while the track holds
+        """
+        with _TRACK_SECONDS.time():
+            small = self._downscale(gray)
+            if small.shape != self.previous.shape:
+                self.stop(LOST_POINTS)
+                return False
+
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self.previous, small, self.points, None, **self.lk_params)
+            back, back_status, _ = cv2.calcOpticalFlowPyrLK(small, self.previous, moved, None, **self.lk_params)
+            error = np.linalg.norm((self.points - back).reshape(-1, 2), axis=1)
+            keep = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.max_error)
+
+            if np.count_nonzero(keep) < self.min_points:
+                self.stop(LOST_POINTS)
+                return False
+
+            self.points = moved[keep].reshape(-1, 1, 2)
+            self.previous = small
+            return True
+
+    def due_for_verification(self, now=None):
+        return (now or time.time()) - self.verified_at >= self.verify_interval
+
+    def region(self, shape, padding=0.25):
+        """
+        Padded bounding box of the tracked points in full-frame coordinates
+        Returns:
+            tuple: (x0, y0, x1, y1)
+        """
+        points = self.points.reshape(-1, 2) / self.scale
+        low, high = points.min(axis=0), points.max(axis=0)
+        pad = (high - low) * padding
+        x0, y0 = np.maximum(low - pad, 0).astype(int)
+        x1, y1 = np.minimum(high + pad, (shape[1], shape[0])).astype(int)
+        return x0, y0, x1, y1
+
+    def confirm(self, matches):
+        """Record a successful re-verification"""
+        self.matches = matches
+        self.verified_at = time.time()
+
+    def stop(self, reason):
+        if self.active:
+            metrics.counter('tracks_lost_total', 'Tracks ended, by reason', reason=reason).inc()
+            logger.debug(f"Lost track of {self.student_id} ({reason})")
+        self._reset()
@@ -5,21 +5,104 @@ import os
 os.environ['TZ'] = 'Asia/Jakarta'
 time.tzset()
 
+import argparse
 import logging
-from config.settings import Settings
-from detection.detector import FaceDetector
-from detection.matcher import FaceMatcher
-from services.camera_service import CameraService
-from utils.logging import configure_logging
+from utils.startup import StartupProfile
 
-configure_logging()
+# Imports are timed so --profile-startup can show where startup goes
+profile = StartupProfile()
+profile.preload('numpy', 'cv2')
+profile.preload('sqlalchemy')
+with profile.step('import config'):
+    from config.settings import get_settings
+with profile.step('import detection'):
+    from detection.detector import FaceDetector
+    from detection.matcher import get_matcher
+with profile.step('import services'):
+    from services.attendance_service import AttendanceService
+    from services.attendance_writer import create_attendance_writer
+    from services.camera_service import CameraService
+    from services.multi_camera_service import MultiCameraService
+with profile.step('import utils'):
+    from utils.logging import configure_logging
+    from utils.metrics import MetricsServer, SummaryReporter
+    from utils.retry import breaker_states
+
+with profile.step('logging'):
+    configure_logging()
+
+def preload_sessions(attendance_service):
+    # Not fatal: the cache is loaded again on the first attendance
+    try:
+        attendance_service.preload_sessions()
+    except Exception as e:
+        logging.warning(f"Failed to preload today's sessions: {str(e)}")
+
+def start_metrics(settings):
+    # Metrics are best effort: a busy port must not stop detection
+    if settings.METRICS_PORT > 0:
+        try:
+            MetricsServer(settings.METRICS_PORT, settings.METRICS_HOST).start()
+        except OSError as e:
+            logging.warning(f"Metrics endpoint disabled: {str(e)}")
+    SummaryReporter().start(settings.STATS_INTERVAL)
+
+def run_multi_camera(settings, matcher, args):
+    with profile.step('cameras and attendance service'):
+        service = MultiCameraService(settings.CAMERA_URLS, matcher)
+    with profile.step('database (session preload)'):
+        preload_sessions(service.attendance_service)
+    if args.profile_startup:
+        profile.log(logging.getLogger('startup'))
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        logging.info("Shutting down gracefully")
+        logging.info(f"Camera stats: {service.stats()}")
+        logging.info(f"Circuit breakers: {breaker_states()}")
+        if matcher.face_detection:
+            logging.info(f"Face region stats: {matcher.face_region_stats.summary()}")
+    finally:
+        service.stop()
 
 def main():
-    settings = Settings()
-    detector = FaceDetector()
-    matcher = FaceMatcher()
-    camera = CameraService()
+    parser = argparse.ArgumentParser(description="Face detection attendance service")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Log import and initialisation time per component before the first frame")
+    args = parser.parse_args()
+
+    with profile.step('settings'):
+        settings = get_settings()
+    with profile.step('metrics'):
+        start_metrics(settings)
+    with profile.step('matcher (gallery load)'):
+        matcher = get_matcher()
+
+    # Pick up students added by photos/download_photos.py without restarting
+    if settings.GALLERY_RELOAD_INTERVAL > 0:
+        matcher.start_auto_reload(settings.GALLERY_RELOAD_INTERVAL)
+
+    if len(settings.CAMERA_URLS) > 1:
+        logging.info(f"Starting face detection service for {len(settings.CAMERA_URLS)} cameras (headless mode)")
+        try:
+            run_multi_camera(settings, matcher, args)
+        finally:
+            matcher.stop_auto_reload()
+        return
+
+    with profile.step('attendance service'):
+        attendance_service = AttendanceService()
+        attendance_writer = create_attendance_writer(attendance_service)
+        if attendance_writer is not None:
+            attendance_writer.start()
+    with profile.step('database (session preload)'):
+        preload_sessions(attendance_service)
+    detector = FaceDetector(attendance_service=attendance_service, attendance_writer=attendance_writer)
+    with profile.step('camera'):
+        camera = CameraService()
 
+    if args.profile_startup:
+        profile.log(logging.getLogger('startup'))
     logging.info("Starting face detection service (headless mode)")
     
     try:
@@ -34,8 +117,18 @@ def main():
                 
     except KeyboardInterrupt:
         logging.info("Shutting down gracefully")
+        logging.info(f"Camera stats: {camera.stats()}")
+        logging.info(f"Circuit breakers: {breaker_states()}")
+        if detector.gate is not None:
+            logging.info(f"Frame gate stats: {detector.gate.stats()}")
+        if matcher.face_detection:
+            logging.info(f"Face region stats: {matcher.face_region_stats.summary()}")
     finally:
+        matcher.stop_auto_reload()
         camera.release()
+        if attendance_writer is not None:
+            attendance_writer.stop()
+            logging.info(f"Attendance writer stats: {attendance_writer.stats()}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
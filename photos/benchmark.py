@@ -0,0 +1,250 @@
+"""
+photos/benchmark.py
+Script untuk mengukur latensi, throughput, memori dan akurasi pipeline pencocokan
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from config.settings import get_settings
+from detection.benchmark import (
+    accuracy, augmented_views, compare_backends, compare_reports, descriptor_probes, environment,
+    load_photos, load_video_frames, negative_probes, peak_rss_mb, run_probes, run_stages, scale_gallery,
+    shard_scaling, summarise, synthetic_frames
+)
+from detection.detector import FaceDetector
+from detection.downloader import extract_descriptors
+from detection.enrolment import EnrolmentPipeline
+from detection.evaluation import load_labelled_frames
+from detection.feature_backend import DESCRIPTOR_LAYOUTS, FeatureBackend, INDEX_TYPES
+from detection.gallery import FeatureGallery
+from detection.matcher import FaceMatcher
+from utils.logging import configure_logging
+
+settings = get_settings()
+
+class _CountingWriter:
+    """Attendance sink for process_frame: counts confirmations, never touches the database"""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, student_id, date_str, detected_at=None):
+        self.submitted += 1
+        return True
+
+def _parse_backends(value):
+    """'sift,orb:bf,akaze' -> [('sift', 'flann'), ('orb', 'bf'), ('akaze', 'flann')]"""
+    backends = []
+    for item in value.split(','):
+        name, _, index = item.strip().partition(':')
+        index = index or 'flann'
+        if name not in DESCRIPTOR_LAYOUTS or index not in INDEX_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown backend '{item}'")
+        backends.append((name, index))
+    return backends
+
+def _parse_counts(value):
+    """'1,2,4' -> [1, 2, 4]"""
+    try:
+        counts = [int(item) for item in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected comma-separated worker counts, got '{value}'")
+    if any(count < 1 for count in counts):
+        raise argparse.ArgumentTypeError("Worker counts must be at least 1")
+    return counts
+
+def run_backend_comparison(args, logger):
+    """--backends mode: enrol --photos with every backend and compare speed and accuracy"""
+    photos = load_photos(args.photos)
+    if args.frames:
+        frames, frame_source = load_labelled_frames(args.frames), args.frames
+    else:
+        frames = augmented_views(photos, args.views_per_photo, seed=args.seed)
+        frames += synthetic_frames(args.negative_probes, seed=args.seed + 1)
+        frame_source = 'augmented'
+    logger.info(
+        f"Comparing {len(args.backends)} backends on {len(photos)} photos and {len(frames)} frames ({frame_source})"
+    )
+
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'photos': args.photos,
+            'frame_source': frame_source,
+            'frames': len(frames),
+            'min_match_count': args.min_match_count,
+            'max_keypoints': settings.MAX_KEYPOINTS,
+            'orb_features': settings.ORB_FEATURES,
+            'seed': args.seed,
+        },
+        'backends': compare_backends(args.backends, photos, frames, extract_descriptors, args.min_match_count),
+    }
+    if args.enrolment:
+        # Same photos and frames, enrolled through the face crop pipeline: gallery size and accuracy after
+        logger.info("Enrolling the photos through the enrolment pipeline")
+        report['parameters']['enrolment'] = EnrolmentPipeline().params
+        report['enrolment'] = compare_backends(
+            args.backends, photos, frames, extract_descriptors, args.min_match_count, pipeline=True
+        )
+    return report
+
+def _write_report(report, path, logger):
+    output = json.dumps(report, indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Benchmark report written to {path}")
+    else:
+        print(output)
+
+def main():
+    configure_logging()
+    logger = logging.getLogger('benchmark')
+
+    parser = argparse.ArgumentParser(description="Benchmark the face matching pipeline")
+    parser.add_argument('--features-dir', default=settings.FEATURES_DIR)
+    parser.add_argument('--gallery', help="Gallery file to benchmark instead of --features-dir")
+    parser.add_argument('--backend', default=settings.FEATURE_BACKEND, choices=sorted(DESCRIPTOR_LAYOUTS),
+                        help="Feature backend of --features-dir (a --gallery file records its own)")
+    parser.add_argument('--index', default=settings.FEATURE_INDEX, choices=INDEX_TYPES)
+    parser.add_argument('--backends', type=_parse_backends,
+                        help="Compare backends instead, e.g. 'sift,orb,orb:bf,akaze' (needs --photos)")
+    parser.add_argument('--photos', metavar='PHOTOS_DIR',
+                        help="Enrolment photos (PHOTOS_DIR/<student_id>.jpg) for --backends")
+    parser.add_argument('--enrolment', action='store_true',
+                        help="With --backends, also enrol the photos through the enrolment pipeline (ENROL_*)")
+    parser.add_argument('--views-per-photo', type=int, default=3,
+                        help="Augmented test frames per photo for --backends without --frames")
+    parser.add_argument('--students', type=int, default=0,
+                        help="Scale the gallery to this many students with synthetic distractors")
+    parser.add_argument('--frames', metavar='FRAMES_DIR',
+                        help="Labelled frames (FRAMES_DIR/<student_id>/*.jpg, none/ for strangers)")
+    parser.add_argument('--video', help="Recorded video to replay (unlabelled)")
+    parser.add_argument('--synthetic-frames', type=int, default=20,
+                        help="Synthetic frames used when neither --frames nor --video is given")
+    parser.add_argument('--probes-per-student', type=int, default=2)
+    parser.add_argument('--negative-probes', type=int, default=10,
+                        help="Synthetic face-free frames whose descriptors should match nobody")
+    parser.add_argument('--repeat', type=int, default=1, help="Passes over the frames")
+    parser.add_argument('--mode', default=settings.MATCH_MODE, choices=('gallery', 'per_student'))
+    parser.add_argument('--shortlist', type=int, default=settings.SHORTLIST_SIZE)
+    parser.add_argument('--min-match-count', type=int, default=settings.MIN_MATCH_COUNT)
+    parser.add_argument('--trees', type=int, help="KD-tree count (default: calibrated or 5)")
+    parser.add_argument('--checks', type=int, help="FLANN checks (default: calibrated or 50)")
+    parser.add_argument('--index-params', default=settings.INDEX_PARAMS_FILE,
+                        help="Calibrated index parameters to start from ('' for the defaults)")
+    parser.add_argument('--shards', type=_parse_counts,
+                        help="Also measure sharded matching with these worker process counts, e.g. '1,2,4'")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report here (default: stdout)")
+    parser.add_argument('--baseline', help="Previous JSON report to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="Allowed relative latency increase before a stage counts as regressed")
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.02,
+                        help="Allowed absolute accuracy drop")
+    args = parser.parse_args()
+
+    if args.backends:
+        if not args.photos:
+            parser.error("--backends needs --photos")
+        _write_report(run_backend_comparison(args, logger), args.output, logger)
+        return
+
+    rss_start = peak_rss_mb()
+    start = time.perf_counter()
+    if args.gallery:
+        gallery = FeatureGallery.open(args.gallery)
+    else:
+        gallery = FeatureGallery.from_directory(args.features_dir, args.backend)
+    real_students = len(gallery)
+    gallery = scale_gallery(gallery, args.students, seed=args.seed)
+    load_seconds = time.perf_counter() - start
+
+    backend = FeatureBackend(gallery.backend, args.index)
+    if args.index_params:
+        backend.load_tuned_params(args.index_params)
+    matcher = FaceMatcher(
+        mode=args.mode, gallery=gallery, shortlist_size=args.shortlist,
+        min_match_count=args.min_match_count, backend=backend
+    )
+    if args.trees is not None:
+        matcher.index_params['trees'] = args.trees
+    if args.checks is not None:
+        matcher.search_params['checks'] = args.checks
+
+    if args.frames:
+        frames, frame_source = load_labelled_frames(args.frames), args.frames
+    elif args.video:
+        frames, frame_source = load_video_frames(args.video), args.video
+    else:
+        frames, frame_source = synthetic_frames(args.synthetic_frames, seed=args.seed), 'synthetic'
+    logger.info(f"Benchmarking {len(gallery)} students ({real_students} real) on {len(frames)} frames ({frame_source})")
+
+    writer = _CountingWriter()
+    detector = FaceDetector(attendance_writer=writer)
+    extractor = matcher.backend.create_extractor()
+    timings, predictions = run_stages(matcher, detector, extractor, frames, extract_descriptors, args.repeat)
+
+    probes = descriptor_probes(gallery, per_student=args.probes_per_student, seed=args.seed)
+    probes += negative_probes(synthetic_frames(args.negative_probes, seed=args.seed + 1), extractor)
+    timings['match_descriptors'], probe_predictions = run_probes(matcher, probes)
+    sharding = None
+    if args.shards:
+        logger.info(f"Measuring sharded matching with {args.shards} worker processes")
+        sharding = shard_scaling(gallery, probes, args.shards, matcher.backend, args.min_match_count, args.repeat)
+
+    labelled = args.frames is not None
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'backend': matcher.backend.name,
+            'index': matcher.backend.index,
+            'mode': args.mode,
+            'shortlist': args.shortlist,
+            'min_match_count': args.min_match_count,
+            'index_params': dict(matcher.index_params),
+            'search_params': dict(matcher.search_params),
+            'frame_gate': settings.FRAME_GATE,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'frame_source': frame_source,
+        },
+        'gallery': {
+            'students': len(gallery),
+            'real_students': real_students,
+            'descriptors': gallery.size,
+            'dtype': str(gallery.descriptors.dtype),
+            'dims': int(gallery.descriptors.shape[1]),
+            'megabytes': gallery.nbytes / 1e6,
+            'load_seconds': load_seconds,
+        },
+        'stages': {stage: summarise(seconds) for stage, seconds in timings.items()},
+        'accuracy': {
+            'frames': accuracy([label for label, _ in frames], predictions) if labelled else None,
+            'probes': accuracy([label for label, _ in probes], probe_predictions),
+        },
+        'memory': {
+            'peak_rss_mb': peak_rss_mb(),
+            'rss_before_load_mb': rss_start,
+        },
+        'attendance_submitted': writer.submitted,
+        'sharding': sharding,
+    }
+
+    _write_report(report, args.output, logger)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.tolerance, args.accuracy_tolerance)
+        for regression in regressions:
+            logger.warning(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        logger.info(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
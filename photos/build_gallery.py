@@ -0,0 +1,79 @@
+"""
+photos/build_gallery.py
+Script untuk menggabungkan fitur st*.npy menjadi satu file galeri (memory-mapped)
+"""
+
+import argparse
+import logging
+import os
+import numpy as np
+from config.settings import get_settings
+from detection.evaluation import compare_matchers, load_labelled_frames
+from detection.feature_backend import DESCRIPTOR_LAYOUTS
+from detection.gallery import FeatureGallery, STORAGE_DTYPES
+from detection.matcher import FaceMatcher
+from detection.shortlist import VladShortlist
+from utils.logging import configure_logging
+
+settings = get_settings()
+
+def main():
+    configure_logging()
+    logger = logging.getLogger('gallery_builder')
+
+    parser = argparse.ArgumentParser(description="Build the consolidated feature gallery")
+    parser.add_argument('--features-dir', default=settings.FEATURES_DIR)
+    parser.add_argument('--backend', default=settings.FEATURE_BACKEND, choices=sorted(DESCRIPTOR_LAYOUTS),
+                        help="Feature backend of the .npy files (files of other backends are skipped)")
+    parser.add_argument('--output', default=settings.GALLERY_FILE)
+    parser.add_argument('--dtype', default=settings.GALLERY_DTYPE, choices=STORAGE_DTYPES)
+    parser.add_argument('--pca-dims', type=int, default=settings.GALLERY_PCA_DIMS)
+    parser.add_argument('--evaluate', metavar='FRAMES_DIR',
+                        help="Labelled frames (FRAMES_DIR/<student_id>/*.jpg) to compare against full precision")
+    parser.add_argument('--vocabulary', default=settings.VOCABULARY_FILE,
+                        help="Where to save the shortlist vocabulary (empty to skip)")
+    parser.add_argument('--vocabulary-size', type=int, default=settings.VOCABULARY_SIZE)
+    parser.add_argument('--shortlist', type=int, default=settings.SHORTLIST_SIZE,
+                        help="Shortlist size used by the evaluated candidate matcher (0 = off)")
+    args = parser.parse_args()
+
+    try:
+        full = FeatureGallery.from_directory(args.features_dir, args.backend)
+        gallery = full.compact(args.dtype, args.pca_dims)
+        gallery.save(args.output)
+        logger.info(
+            f"Gallery written to {args.output}: {len(gallery)} students, "
+            f"{gallery.size} {gallery.backend} descriptors ({gallery.descriptors.dtype}, {gallery.descriptors.shape[1]} dims)"
+        )
+        logger.info(
+            f"Gallery memory: {gallery.nbytes / 1e6:.2f} MB "
+            f"(full precision {full.nbytes / 1e6:.2f} MB, {gallery.nbytes / max(full.nbytes, 1):.0%})"
+        )
+
+        if args.vocabulary and not gallery.binary:
+            vocabulary = VladShortlist.train_vocabulary(gallery.working_descriptors(), args.vocabulary_size)
+            os.makedirs(os.path.dirname(args.vocabulary) or '.', exist_ok=True)
+            tmp_path = f"{args.vocabulary}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, vocabulary)
+            os.replace(tmp_path, args.vocabulary)
+            logger.info(f"Shortlist vocabulary written to {args.vocabulary}: {len(vocabulary)} words")
+
+        if args.evaluate:
+            frames = load_labelled_frames(args.evaluate)
+            report = compare_matchers(
+                FaceMatcher(gallery=full, shortlist_size=0, backend=args.backend),
+                FaceMatcher(gallery=gallery, shortlist_size=args.shortlist, backend=args.backend),
+                frames
+            )
+            logger.info(
+                f"Evaluation on {report['frames']} frames: agreement {report['agreement']:.1%} | "
+                f"accuracy {report['candidate_accuracy']:.1%} (full {report['reference_accuracy']:.1%}) | "
+                f"match {report['candidate_match_ms']:.1f} ms (full {report['reference_match_ms']:.1f} ms)"
+            )
+    except Exception as e:
+        logger.error(f"Failed to build gallery: {str(e)}", exc_info=True)
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+photos/calibrate_index.py
+Script untuk mengkalibrasi parameter indeks FLANN terhadap pencarian brute-force
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import cv2
+from config.settings import get_settings
+from detection.benchmark import augmented_views, load_photos, load_video_frames, synthetic_frames
+from detection.calibration import calibrate
+from detection.evaluation import load_labelled_frames
+from detection.feature_backend import DESCRIPTOR_LAYOUTS, FeatureBackend, save_tuned_params
+from detection.gallery import FeatureGallery
+from utils.logging import configure_logging
+
+settings = get_settings()
+
+def main():
+    configure_logging()
+    logger = logging.getLogger('index_calibration')
+
+    parser = argparse.ArgumentParser(description="Pick the fastest index parameters that keep recall and identity")
+    parser.add_argument('--features-dir', default=settings.FEATURES_DIR)
+    parser.add_argument('--gallery', help="Gallery file to calibrate for (default: GALLERY_FILE if it exists)")
+    parser.add_argument('--backend', default=settings.FEATURE_BACKEND, choices=sorted(DESCRIPTOR_LAYOUTS),
+                        help="Feature backend of --features-dir (a gallery file records its own)")
+    parser.add_argument('--frames', metavar='FRAMES_DIR', help="Labelled frames (FRAMES_DIR/<student_id>/*.jpg)")
+    parser.add_argument('--video', help="Recorded video to sample frames from")
+    parser.add_argument('--photos', metavar='PHOTOS_DIR',
+                        help="Enrolment photos to build augmented frames from when no frames are recorded")
+    parser.add_argument('--max-frames', type=int, default=10)
+    parser.add_argument('--sample', type=int, default=20000, help="Gallery descriptors used as queries")
+    parser.add_argument('--target-recall', type=float, default=0.9)
+    parser.add_argument('--target-agreement', type=float, default=0.98,
+                        help="Share of frames that must be identified as with exact search")
+    parser.add_argument('--min-match-count', type=int, default=settings.MIN_MATCH_COUNT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=settings.INDEX_PARAMS_FILE, help="Where FaceMatcher looks for the parameters")
+    parser.add_argument('--report', help="Also write every measured configuration here (JSON)")
+    parser.add_argument('--dry-run', action='store_true', help="Report only, do not save the chosen parameters")
+    args = parser.parse_args()
+
+    gallery_path = args.gallery or (settings.GALLERY_FILE if os.path.exists(settings.GALLERY_FILE) else None)
+    if gallery_path:
+        gallery = FeatureGallery.open(gallery_path)
+    else:
+        gallery = FeatureGallery.from_directory(args.features_dir, args.backend)
+    if not gallery.size:
+        logger.error("Gallery is empty, nothing to calibrate")
+        sys.exit(1)
+
+    if args.frames:
+        frames = load_labelled_frames(args.frames)
+    elif args.video:
+        frames = load_video_frames(args.video, args.max_frames)
+    elif args.photos:
+        frames = augmented_views(load_photos(args.photos), 1, seed=args.seed)
+    else:
+        logger.warning("No --frames, --video or --photos: calibrating on synthetic frames without faces")
+        frames = synthetic_frames(args.max_frames, seed=args.seed)
+    frames = frames[:args.max_frames]
+
+    extractor = FeatureBackend(gallery.backend).create_extractor()
+    frame_descriptors = []
+    for _, frame in frames:
+        _, descriptors = extractor.detectAndCompute(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), None)
+        if descriptors is not None:
+            frame_descriptors.append(gallery.project(descriptors))
+    logger.info(
+        f"Calibrating {gallery.backend} index for {len(gallery)} students ({gallery.size} descriptors) "
+        f"on {len(frame_descriptors)} frames"
+    )
+
+    def _progress(result):
+        logger.info(
+            f"{result['label']:<36} {result['search_ms']:8.1f} ms/frame | recall {result['recall']:.1%} | "
+            f"agreement {result['agreement']:.0%}"
+        )
+
+    calibration = calibrate(
+        gallery, frame_descriptors, args.target_recall, args.target_agreement, args.sample,
+        args.min_match_count, args.seed, progress=_progress
+    )
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(calibration, f, indent=2)
+
+    chosen = calibration['chosen']
+    if chosen is None:
+        best = max(calibration['results'], key=lambda result: (result['agreement'], result['recall']))
+        logger.error(
+            f"No configuration reaches recall {args.target_recall:.0%} and agreement {args.target_agreement:.0%} "
+            f"(best: {best['label']}, recall {best['recall']:.1%}, agreement {best['agreement']:.0%})"
+        )
+        sys.exit(1)
+
+    logger.info(
+        f"Chosen: {chosen['label']} at {chosen['search_ms']:.1f} ms/frame "
+        f"(recall {chosen['recall']:.1%}, agreement {chosen['agreement']:.0%})"
+    )
+    if args.dry_run:
+        return
+
+    save_tuned_params(
+        args.output, gallery.backend, chosen,
+        target_recall=args.target_recall,
+        target_agreement=args.target_agreement,
+        gallery_descriptors=gallery.size,
+        queries=calibration['queries'],
+        frames=calibration['frames'],
+        calibrated_at=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    )
+    logger.info(f"Index parameters written to {args.output}")
+
+if __name__ == "__main__":
+    main()
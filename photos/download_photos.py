@@ -3,17 +3,34 @@ photo/download_photos.py
 Script untuk mendownload foto mahasiswa dan mengekstrak fitur SIFT
 """
 
+import argparse
 import logging
-from detection.downloader import PhotoDownloader
-from utils.logging import configure_logging
+from utils.startup import StartupProfile
+
+profile = StartupProfile()
+profile.preload('numpy', 'cv2')
+profile.preload('requests', 'sqlalchemy')
+with profile.step('import detection.downloader'):
+    from detection.downloader import PhotoDownloader
+with profile.step('import utils.logging'):
+    from utils.logging import configure_logging
 
 def main():
-    configure_logging()
+    parser = argparse.ArgumentParser(description="Download student photos and extract their features")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Log import and initialisation time per component before downloading")
+    args = parser.parse_args()
+
+    with profile.step('logging'):
+        configure_logging()
     logger = logging.getLogger('photo_downloader')
     
     try:
         logger.info("Starting photo download and feature extraction process")
-        downloader = PhotoDownloader()
+        with profile.step('downloader (features and manifest)'):
+            downloader = PhotoDownloader()
+        if args.profile_startup:
+            profile.log(logger)
         
         # Step 1: Download photos and extract SIFT features
         downloader.run()
@@ -24,4 +41,4 @@ def main():
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
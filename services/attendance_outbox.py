@@ -0,0 +1,378 @@
+"""services/attendance_outbox.py"""
+
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from config.database import DB_ROW_ERRORS
+from config.settings import get_settings
+from utils import metrics
+
+settings = get_settings()
+logger = logging.getLogger('face_detection.attendance_outbox')
+
+_COMMIT_SECONDS = metrics.stage('outbox_commit')
+_REPLAY_SECONDS = metrics.stage('outbox_replay')
+_APPENDED = metrics.counter('attendance_outbox_appended_total', 'Attendance events made durable in the local outbox')
+_REPLAYED = metrics.counter('attendance_outbox_replayed_total', 'Outbox events delivered to the database')
+_REPLAY_ERRORS = metrics.counter('attendance_outbox_replay_errors_total', 'Replay batches that failed and were kept')
+_DEAD_LETTERED = metrics.counter(
+    'attendance_outbox_dead_lettered_total', 'Outbox events given up on and moved to the dead-letter table'
+)
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        event_id TEXT PRIMARY KEY,
+        student_id TEXT NOT NULL,
+        date_str TEXT NOT NULL,
+        detected_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+    )
+"""
+
+_DEAD_LETTER_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox_dead (
+        event_id TEXT PRIMARY KEY,
+        student_id TEXT NOT NULL,
+        date_str TEXT NOT NULL,
+        detected_at REAL NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT,
+        failed_at REAL NOT NULL
+    )
+"""
+
+class AttendanceOutbox:
+    """
+    Durable replacement for ``AttendanceWriter``.
+
+    ``submit`` only queues the event in memory, so the frame loop never
+    waits for the disk; a commit thread appends everything queued to a
+    local SQLite outbox (WAL, fsync on commit) in one transaction (group
+    commit: one fsync per ``commit_interval`` instead of one per event).
+    An event is durable once that commit returns, at most a commit
+    (``commit_interval`` plus one fsync) after ``submit``; ``flush`` waits
+    for it. When ``max_queue`` events are still waiting for the disk,
+    ``submit`` rejects new ones instead of blocking. A replayer thread drains
+    the outbox to the database in batches through
+    ``record_attendance_batch``, so any object with that method (a local DB
+    stand-in included) can be the target. Every event carries its own
+    attendance id and the insert ignores ids that already exist, so a batch
+    replayed after a crash or a lost commit acknowledgement is not
+    duplicated. While the database is unreachable the backlog stays on disk
+    and replay backs off up to ``max_backoff`` seconds.
+
+    An event the database rejects (``DB_ROW_ERRORS``: a constraint
+    violation or an invalid value) must not hold back the events behind it:
+    after a batch fails for such a reason, the events it contained are
+    replayed one at a time, and one that still fails ``max_attempts`` times
+    is moved to the ``outbox_dead`` table and logged. Any other failure
+    (connection, breaker open, lock timeout, but also a schema mismatch or a
+    bug in the write path) says nothing about a particular event, so it
+    never counts as an attempt: replay backs off and the events wait.
+    """
+
+    def __init__(self, attendance_service, path=None, batch_size=None, commit_interval=None,
+                 max_queue=None, replay_interval=None, max_backoff=None, max_attempts=None):
+        self.attendance_service = attendance_service
+        self.path = path or settings.ATTENDANCE_OUTBOX_FILE
+        self.batch_size = batch_size or settings.ATTENDANCE_BATCH_SIZE
+        self.commit_interval = settings.ATTENDANCE_OUTBOX_COMMIT_INTERVAL if commit_interval is None else commit_interval
+        self.max_queue = max_queue or settings.ATTENDANCE_QUEUE_SIZE
+        self.replay_interval = replay_interval or settings.ATTENDANCE_REPLAY_INTERVAL
+        self.max_backoff = max_backoff or settings.ATTENDANCE_REPLAY_MAX_BACKOFF
+        self.max_attempts = max_attempts or settings.ATTENDANCE_REPLAY_MAX_ATTEMPTS
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._pending = []
+        self._committing = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._wake_replayer = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+        self.depth = 0
+        self.appended = 0
+        self.rejected = 0
+        self.append_errors = 0
+        self.commits = 0
+        self.replayed = 0
+        self.no_session = 0
+        self.replay_errors = 0
+        self.dead_lettered = 0
+        self.last_commit_duration = 0.0
+        self.replay_rate = 0.0
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        # FULL: the WAL is fsynced on every commit, so a committed event survives power loss
+        db.execute('PRAGMA synchronous=FULL')
+        db.execute(_SCHEMA)
+        db.execute(_DEAD_LETTER_SCHEMA)
+        return db
+
+    def start(self):
+        if self._threads:
+            return self
+        self._stop.clear()
+        self._db = self._open()
+        self.depth = self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+        if self.depth:
+            logger.warning(f"{self.depth} attendance events left in {self.path} from a previous run, replaying")
+
+        metrics.gauge('attendance_outbox_pending', 'Attendance events waiting for the outbox commit',
+                      lambda: len(self._pending) + self._committing)
+        metrics.gauge('attendance_outbox_depth', 'Attendance events waiting in the local outbox', lambda: self.depth)
+        metrics.gauge('attendance_outbox_replay_rate', 'Events per second of the last replay batch', lambda: self.replay_rate)
+        self._threads = [
+            threading.Thread(target=self._commit_loop, name='outbox-commit', daemon=True),
+            threading.Thread(target=self._replay_loop, name='outbox-replay', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, student_id, date_str, detected_at=None):
+        """
+        Queue an attendance event for the next outbox commit without waiting for the disk
+        Returns:
+            bool: False if ``max_queue`` events are already waiting (event rejected)
+        """
+        row = (str(uuid.uuid4()), student_id, date_str, detected_at or time.time())
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                queued = False
+            else:
+                self._pending.append(row)
+                self._cond.notify_all()
+                queued = True
+
+        if not queued:
+            with self._lock:
+                self.rejected += 1
+            logger.error(f"Attendance outbox queue full, dropping event for {student_id}")
+        return queued
+
+    def flush(self, timeout=None):
+        """
+        Wait until every event submitted so far is committed to the outbox
+        Returns:
+            bool: False if some are still waiting after ``timeout`` seconds
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._committing, timeout)
+
+    def _commit_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stop.is_set())
+                if not self._pending:
+                    return
+            # Let events from other cameras join this commit
+            if self.commit_interval and not self._stop.is_set():
+                time.sleep(self.commit_interval)
+            with self._cond:
+                batch, self._pending = self._pending, []
+                self._committing = len(batch)
+
+            committed = self._commit(batch)
+            with self._cond:
+                if not committed and not self._stop.is_set():
+                    # Keep the events (ahead of newer ones) and try the disk again shortly
+                    self._pending[:0] = batch
+                self._committing = 0
+                self._cond.notify_all()
+            if not committed:
+                if self._stop.is_set():
+                    lost = len(batch) + len(self._pending)
+                    logger.error(f"Stopping with {lost} attendance events that never reached {self.path}")
+                    return
+                self._stop.wait(self.replay_interval)
+
+    def _commit(self, batch):
+        """Append ``batch`` in one transaction; False (and the events are kept) if SQLite failed"""
+        start = time.perf_counter()
+        committed = False
+        try:
+            with _COMMIT_SECONDS.time(), self._db_lock:
+                self._db.execute('BEGIN IMMEDIATE')
+                try:
+                    self._db.executemany(
+                        'INSERT INTO outbox (event_id, student_id, date_str, detected_at) VALUES (?, ?, ?, ?)',
+                        batch
+                    )
+                    self._db.execute('COMMIT')
+                except BaseException:
+                    self._db.execute('ROLLBACK')
+                    raise
+            committed = True
+        except sqlite3.Error as e:
+            logger.error(f"Failed to append {len(batch)} attendance events to {self.path}: {e}")
+
+        with self._lock:
+            self.commits += 1
+            self.last_commit_duration = time.perf_counter() - start
+            if committed:
+                self.depth += len(batch)
+                self.appended += len(batch)
+            else:
+                self.append_errors += 1
+        if committed:
+            _APPENDED.inc(len(batch))
+            self._wake_replayer.set()
+        return committed
+
+    def _execute_many(self, statement, params):
+        """executemany in one transaction, so a whole batch costs one fsync"""
+        with self._db_lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.executemany(statement, params)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _replay_loop(self):
+        backoff = self.replay_interval
+        backlog_started = time.time() if self.depth else None
+        while not self._stop.is_set():
+            with self._db_lock:
+                rows = self._db.execute(
+                    'SELECT event_id, student_id, date_str, detected_at, attempts FROM outbox '
+                    'ORDER BY detected_at LIMIT ?', (self.batch_size,)
+                ).fetchall()
+            if rows and rows[0][4]:
+                # The head was in a batch the database rejected: replay it alone to find the bad event
+                rows = rows[:1]
+            if not rows:
+                if backlog_started is not None:
+                    logger.info(f"Attendance outbox drained in {time.time() - backlog_started:.1f}s")
+                    backlog_started = None
+                self._wake_replayer.wait(self.replay_interval)
+                self._wake_replayer.clear()
+                continue
+
+            start = time.perf_counter()
+            try:
+                with _REPLAY_SECONDS.time():
+                    recorded = self.attendance_service.record_attendance_batch(
+                        [(student_id, date_str, detected_at, event_id)
+                         for event_id, student_id, date_str, detected_at, _ in rows]
+                    )
+            except Exception as e:
+                if backlog_started is None:
+                    backlog_started = time.time()
+                if isinstance(e, DB_ROW_ERRORS):
+                    # The database rejected the data: isolate the bad event without backing off
+                    self._replay_failed(rows, e, self.replay_interval, count_attempt=True)
+                    self._stop.wait(self.replay_interval)
+                else:
+                    # Outage or a failure unrelated to the rows: every event would fail the same way
+                    self._replay_failed(rows, e, backoff, count_attempt=False)
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            elapsed = time.perf_counter() - start
+            backoff = self.replay_interval
+            # Events without a session today were looked up and have nothing to insert either
+            try:
+                self._execute_many('DELETE FROM outbox WHERE event_id = ?', [(row[0],) for row in rows])
+            except sqlite3.Error as e:
+                # Delivered but still queued: the next replay inserts nothing new (idempotent ids)
+                logger.error(f"Failed to remove replayed events from the attendance outbox: {e}")
+                self._stop.wait(backoff)
+                continue
+            with self._lock:
+                self.depth -= len(rows)
+                self.replayed += len(recorded)
+                self.no_session += len(rows) - len(recorded)
+                self.replay_rate = len(rows) / elapsed if elapsed else 0.0
+            _REPLAYED.inc(len(recorded))
+
+    def _replay_failed(self, rows, error, backoff, count_attempt):
+        with self._lock:
+            self.replay_errors += 1
+        _REPLAY_ERRORS.inc()
+        logger.warning(
+            f"Attendance replay of {len(rows)} events failed ({error}); "
+            f"{self.depth} events kept in the outbox, retrying in {backoff:.0f}s"
+        )
+        last_error = f"{type(error).__name__}: {error}"[:500]
+        try:
+            self._execute_many(
+                'UPDATE outbox SET attempts = attempts + ?, last_error = ? WHERE event_id = ?',
+                [(int(count_attempt), last_error, row[0]) for row in rows]
+            )
+            if count_attempt and len(rows) == 1 and rows[0][4] + 1 >= self.max_attempts:
+                self._dead_letter(rows[0], last_error)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to update the attendance outbox: {e}")
+
+    def _dead_letter(self, row, last_error):
+        """Move an event the database keeps rejecting out of the replay queue"""
+        event_id, student_id, date_str, _, attempts = row
+        with self._db_lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO outbox_dead '
+                    '(event_id, student_id, date_str, detected_at, attempts, last_error, failed_at) '
+                    'SELECT event_id, student_id, date_str, detected_at, attempts, last_error, ? '
+                    'FROM outbox WHERE event_id = ?', (time.time(), event_id)
+                )
+                self._db.execute('DELETE FROM outbox WHERE event_id = ?', (event_id,))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        with self._lock:
+            self.depth -= 1
+            self.dead_lettered += 1
+        _DEAD_LETTERED.inc()
+        logger.error(
+            f"Attendance event {event_id} ({student_id} on {date_str}) rejected {attempts + 1} times, "
+            f"moved to outbox_dead in {self.path}: {last_error}"
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'depth': self.depth,
+                'appended': self.appended,
+                'rejected': self.rejected,
+                'pending': len(self._pending) + self._committing,
+                'append_errors': self.append_errors,
+                'commits': self.commits,
+                'replayed': self.replayed,
+                'no_session': self.no_session,
+                'replay_errors': self.replay_errors,
+                'dead_lettered': self.dead_lettered,
+                'replay_rate': self.replay_rate,
+                'last_commit_duration': self.last_commit_duration,
+            }
+
+    def stop(self, timeout=None):
+        """Commit whatever was submitted and stop; undelivered events stay on disk for the next start"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._wake_replayer.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
@@ -2,42 +2,164 @@
 services/attendance_service.py
 """
 
+import time
+import uuid
+import threading
+from collections import OrderedDict
 from sqlalchemy import text
-from datetime import datetime
-from config.database import DatabaseConfig
+from datetime import datetime, timedelta, timezone
+from config.database import DB_TRANSIENT_ERRORS, get_database
+from config.settings import get_settings
 import logging
+from utils import metrics
 from utils.retry import retry
 
+settings = get_settings()
 logger = logging.getLogger('face_detection.attendance')
 
+# Asia/Jakarta tidak memakai DST, jadi offset UTC+7 selalu tetap
+JAKARTA_OFFSET = timedelta(hours=7)
+
+# Termasuk waktu retry, supaya DB yang lambat terlihat di metrik
+_ATTENDANCE_WRITE_SECONDS = metrics.stage('attendance_write')
+
+# Tanggal yang disimpan di cache sesi: hari ini, plus tanggal lama yang muncul saat replay outbox
+_SESSION_CACHE_DAYS = 4
+
+class _DaySessions:
+    """Sesi satu tanggal lokal: {student_id: session_id}, waktu muat, dan negative cache"""
+    __slots__ = ('sessions', 'loaded_at', 'no_session')
+
+    def __init__(self, sessions, loaded_at):
+        self.sessions = sessions
+        self.loaded_at = loaded_at
+        # student_id -> waktu kedaluwarsa "tidak ada sesi"
+        self.no_session = {}
+
 class AttendanceService:
     def __init__(self):
-        self.db_config = DatabaseConfig()
+        self.db_config = get_database()
+
+        # Cache sesi per tanggal lokal (date_str -> _DaySessions), tanggal terlama dibuang lebih dulu
+        self._sessions_lock = threading.Lock()
+        self._days = OrderedDict()
+        # Satu range query per waktu: miss serentak menunggu hasil pemuatan yang sama
+        self._load_lock = threading.Lock()
+
+    def preload_sessions(self, date_str=None):
+        """
+        Muat pemetaan student -> session untuk hari ini dengan satu range query.
+        Returns:
+            int: Jumlah mahasiswa yang memiliki sesi
+        """
+        date_str = date_str or time.strftime("%Y-%m-%d")
+        with self.db_config.get_session() as session:
+            with self._load_lock:
+                day = self._load_sessions(session, date_str)
+        return len(day.sessions)
+
+    def _load_sessions(self, session, date_str):
+        # Rentang UTC untuk satu hari lokal, supaya index pada cs.date bisa dipakai
+        local_midnight = datetime.strptime(date_str, "%Y-%m-%d")
+        start_utc = local_midnight - JAKARTA_OFFSET
+        end_utc = start_utc + timedelta(days=1)
+
+        # Join Students sama seperti query fallback, supaya kedua jalur memberi hasil yang sama
+        sessions_query = text("""
+            SELECT ce.student_id, cs.session_id
+            FROM Students s
+            JOIN CourseEnrollments ce ON s.student_id = ce.student_id
+            JOIN ClassSessions cs ON ce.course_id = cs.course_id
+                AND ce.semester_id = cs.semester_id
+            WHERE cs.date >= :start_utc AND cs.date < :end_utc
+        """)
+
+        sessions = {}
+        for student_id, session_id in session.execute(sessions_query, {
+            'start_utc': start_utc,
+            'end_utc': end_utc
+        }):
+            sessions.setdefault(student_id, session_id)
+
+        day = _DaySessions(sessions, time.time())
+        with self._sessions_lock:
+            self._days[date_str] = day
+            self._days.move_to_end(date_str)
+            while len(self._days) > _SESSION_CACHE_DAYS:
+                self._days.popitem(last=False)
+
+        logger.info(f"Loaded {len(sessions)} student sessions for {date_str}")
+        return day
+
+    def _cached_day(self, date_str, now):
+        """Cache sesi tanggal ini jika masih berlaku (panggil dengan _sessions_lock)"""
+        day = self._days.get(date_str)
+        if day is None or now - day.loaded_at >= settings.SESSION_CACHE_TTL:
+            return None
+        self._days.move_to_end(date_str)
+        return day
+
+    def _day_sessions(self, session, date_str, now):
+        with self._sessions_lock:
+            day = self._cached_day(date_str, now)
+        if day is not None:
+            return day
+        with self._load_lock:
+            # Thread lain mungkin sudah memuat tanggal ini selama kita menunggu
+            with self._sessions_lock:
+                day = self._cached_day(date_str, now)
+            return day if day is not None else self._load_sessions(session, date_str)
+
+    def _get_session_id(self, session, student_id, date_str):
+        """
+        Cari session_id dari cache per tanggal; DB hanya disentuh saat tanggal belum
+        dimuat, saat cache kedaluwarsa, atau saat miss yang belum tercatat di negative cache.
+        """
+        now = time.time()
+        day = self._day_sessions(session, date_str, now)
+
+        with self._sessions_lock:
+            session_id = day.sessions.get(student_id)
+            if session_id is not None:
+                return session_id
+            if day.no_session.get(student_id, 0) > now:
+                return None
 
-    @retry(max_retries=3, delay=1, backoff=2)
+        # Miss: sesi mungkin dibuat setelah cache dimuat, cek sekali lalu simpan hasilnya
+        session_query = text("""
+            SELECT cs.session_id
+            FROM Students s
+            JOIN CourseEnrollments ce ON s.student_id = ce.student_id
+            JOIN ClassSessions cs ON ce.course_id = cs.course_id
+                AND ce.semester_id = cs.semester_id
+            WHERE s.student_id = :student_id
+            AND DATE(CONVERT_TZ(cs.date, 'UTC', 'Asia/Jakarta')) = :local_date
+        """)
+
+        result = session.execute(session_query, {
+            'student_id': student_id,
+            'local_date': date_str
+        }).fetchone()
+
+        with self._sessions_lock:
+            if result:
+                day.sessions[student_id] = result[0]
+            else:
+                day.no_session[student_id] = now + settings.SESSION_NEGATIVE_TTL
+        return result[0] if result else None
+
+    @metrics.timed(_ATTENDANCE_WRITE_SECONDS)
+    @retry(max_retries=3, delay=1, backoff=2, dependency='db')
     def record_attendance(self, student_id, date_str):
         """
         Menyesuaikan timezone Asia/Jakarta (UTC+7) untuk pencocokan dan penyimpanan.
         """
         with self.db_config.get_session() as session:
             try:
-                # 1. Ubah tanggal input (lokal) jadi UTC di dalam SQL
-                session_query = text("""
-                    SELECT cs.session_id
-                    FROM Students s
-                    JOIN CourseEnrollments ce ON s.student_id = ce.student_id
-                    JOIN ClassSessions cs ON ce.course_id = cs.course_id 
-                        AND ce.semester_id = cs.semester_id
-                    WHERE s.student_id = :student_id 
-                    AND DATE(CONVERT_TZ(cs.date, 'UTC', 'Asia/Jakarta')) = :local_date
-                """)
-                
-                result = session.execute(session_query, {
-                    'student_id': student_id,
-                    'local_date': date_str
-                }).fetchone()
-                
-                if not result:
+                # 1. Cari sesi hari ini (dari cache harian)
+                session_id = self._get_session_id(session, student_id, date_str)
+
+                if not session_id:
                     logger.warning(f"No session found for {student_id} on {date_str}")
                     return False
 
@@ -46,16 +168,73 @@ class AttendanceService:
                     INSERT INTO Attendances (attendance_id, session_id, student_id, timestamp)
                     VALUES (UUID(), :session_id, :student_id, CONVERT_TZ(NOW(), 'UTC', 'Asia/Jakarta'))
                 """)
-                
+
                 session.execute(insert_query, {
-                    'session_id': result[0],
+                    'session_id': session_id,
                     'student_id': student_id
                 })
-                
+
                 logger.info(f"Attendance recorded for {student_id} at 'Asia/Jakarta' timestamp")
                 return True
-                
+
             except Exception as e:
                 logger.error(f"Failed to record attendance: {str(e)}")
                 session.rollback()
                 raise
+
+    @metrics.timed(_ATTENDANCE_WRITE_SECONDS)
+    @retry(max_retries=3, delay=1, backoff=2, exceptions=DB_TRANSIENT_ERRORS, dependency='db')
+    def record_attendance_batch(self, events):
+        """
+        Catat beberapa presensi sekaligus: sesi diambil dari cache harian, lalu satu INSERT multi-baris.
+        Args:
+            events (list): (student_id, date_str, detected_at) dengan detected_at epoch detik,
+                opsional diikuti attendance_id supaya INSERT ulang (replay outbox) tidak menggandakan presensi
+        Returns:
+            list: student_id yang tercatat (satu per baris yang di-INSERT)
+        """
+        recorded = []
+        with self.db_config.get_session() as session:
+            try:
+                rows = []
+                for event in events:
+                    student_id, date_str, detected_at = event[:3]
+                    attendance_id = event[3] if len(event) > 3 else str(uuid.uuid4())
+                    session_id = self._get_session_id(session, student_id, date_str)
+                    if not session_id:
+                        logger.warning(f"No session found for {student_id} on {date_str}")
+                        continue
+                    rows.append((attendance_id, session_id, student_id, detected_at))
+
+                if not rows:
+                    return recorded
+
+                # Waktu deteksi (UTC) dipakai sebagai pengganti NOW() karena INSERT ditunda
+                values = []
+                params = {}
+                for i, (attendance_id, session_id, student_id, detected_at) in enumerate(rows):
+                    values.append(
+                        f"(:attendance_id_{i}, :session_id_{i}, :student_id_{i}, "
+                        f"CONVERT_TZ(:detected_at_{i}, 'UTC', 'Asia/Jakarta'))"
+                    )
+                    params[f'attendance_id_{i}'] = attendance_id
+                    params[f'session_id_{i}'] = session_id
+                    params[f'student_id_{i}'] = student_id
+                    params[f'detected_at_{i}'] = datetime.fromtimestamp(detected_at, timezone.utc).replace(tzinfo=None)
+
+                insert_query = text(
+                    "INSERT INTO Attendances (attendance_id, session_id, student_id, timestamp) VALUES "
+                    + ", ".join(values)
+                    # attendance_id yang sudah ada berarti batch ini pernah masuk (retry/replay), lewati saja
+                    + " ON DUPLICATE KEY UPDATE attendance_id = attendance_id"
+                )
+                session.execute(insert_query, params)
+
+                recorded = [student_id for _, _, student_id, _ in rows]
+                logger.info(f"Attendance recorded for {len(rows)} students in one batch")
+                return recorded
+
+            except Exception as e:
+                logger.error(f"Failed to record attendance batch: {str(e)}")
+                session.rollback()
+                raise
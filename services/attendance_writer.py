@@ -0,0 +1,151 @@
+"""services/attendance_writer.py"""
+
+import time
+import queue
+import logging
+import threading
+from config.settings import get_settings
+from utils import metrics
+from services.attendance_outbox import AttendanceOutbox
+
+settings = get_settings()
+logger = logging.getLogger('face_detection.attendance_writer')
+
+class AttendanceWriter:
+    """
+    Background writer that takes attendance off the frame loop.
+
+    ``submit`` only puts the event on a bounded queue; a worker thread drains
+    it every ``flush_interval`` seconds (or as soon as ``batch_size`` events
+    are waiting) and writes each batch with
+    ``AttendanceService.record_attendance_batch``. When the queue is full,
+    ``submit`` waits at most ``put_timeout`` seconds and then rejects the
+    event, so a stalled database can never freeze detection.
+    """
+
+    def __init__(self, attendance_service, max_queue=None, batch_size=None,
+                 flush_interval=None, put_timeout=None):
+        self.attendance_service = attendance_service
+        self.batch_size = batch_size or settings.ATTENDANCE_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.ATTENDANCE_FLUSH_INTERVAL
+        self.put_timeout = settings.ATTENDANCE_PUT_TIMEOUT if put_timeout is None else put_timeout
+        self.queue = queue.Queue(maxsize=max_queue or settings.ATTENDANCE_QUEUE_SIZE)
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.no_session = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_duration = 0.0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        metrics.gauge('attendance_queue_depth', 'Attendance events waiting to be written', self.queue.qsize)
+        self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, student_id, date_str, detected_at=None):
+        """
+        Queue an attendance event without touching the database
+        Returns:
+            bool: False if the queue stayed full (event rejected)
+        """
+        event = (student_id, date_str, detected_at or time.time())
+        try:
+            self.queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.error(f"Attendance queue full, dropping event for {student_id}")
+            return False
+
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _run(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _next_batch(self):
+        """Wait for the first event, then collect more until the batch is full or the interval ends"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Anything already waiting goes out with this batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            recorded = self.attendance_service.record_attendance_batch(batch)
+            with self._lock:
+                self.written += len(recorded)
+                self.no_session += len(batch) - len(recorded)
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} attendance events: {e}")
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.last_flush_duration = time.perf_counter() - start
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'enqueued': self.enqueued,
+                'rejected': self.rejected,
+                'written': self.written,
+                'no_session': self.no_session,
+                'failed': self.failed,
+                'batches': self.batches,
+                'last_flush_duration': self.last_flush_duration,
+            }
+
+    def stop(self, timeout=None):
+        """Stop the worker after it has flushed whatever is still queued"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+def create_attendance_writer(attendance_service):
+    """
+    Attendance sink chosen by settings (not started yet)
+    Returns:
+        AttendanceOutbox, AttendanceWriter or None (synchronous writes)
+    """
+    if not settings.ATTENDANCE_ASYNC:
+        return None
+    if settings.ATTENDANCE_OUTBOX:
+        return AttendanceOutbox(attendance_service)
+    return AttendanceWriter(attendance_service)
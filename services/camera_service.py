@@ -1,40 +1,169 @@
 """services/camera_service.py"""
 
-import cv2
+import os
 import time
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlparse
+from utils import metrics
 from utils.retry import retry
-from config.settings import Settings
+from config.settings import get_settings
+from services.frame_source import create_frame_source
 
-settings = Settings()
+settings = get_settings()
+logger = logging.getLogger('face_detection.camera')
+
+_CAMERA_READ_SECONDS = metrics.stage('camera_read')
+_RECONNECTS = metrics.counter('camera_reconnects_total', 'Camera reconnects after a read error')
+_FRAMES_DROPPED = metrics.counter('camera_frames_dropped_total', 'Stale frames replaced by a newer one before matching')
+
+def camera_dependency(url):
+    """Breaker name of a camera, without the credentials a URL may carry"""
+    parsed = urlparse(url)
+    if parsed.hostname:
+        return f"camera:{parsed.hostname}:{parsed.port}" if parsed.port else f"camera:{parsed.hostname}"
+    return f"camera:{os.path.basename(parsed.path) or url}"
 
 class CameraService:
-    def __init__(self):
-        self.cap = None
+    def __init__(self, url=None, threaded=None, buffer_size=None, source=None):
+        self.url = url or settings.CAMERA_URL
+        # MJPEG reader, OpenCV capture or file replay (see services/frame_source.py)
+        self.source = source or create_frame_source(self.url)
+        self.threaded = settings.CAMERA_THREADED if threaded is None else threaded
+        self.buffer_size = buffer_size or settings.CAMERA_BUFFER_SIZE
+        # Circuit breaker name: one per camera, so a dead camera does not fail fast for the others
+        self.dependency = camera_dependency(self.url)
+
+        # Latest-frame buffer filled by the background reader: (capture_time, frame)
+        self._frames = deque(maxlen=self.buffer_size)
+        self._frame_ready = threading.Condition()
+        self._stop = threading.Event()
+        self._reader = None
+        self._read_error = None
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.frames_delivered = 0
+        self.last_capture_latency = 0.0
+        self._total_capture_latency = 0.0
+
         self.connect()
+        if self.threaded:
+            self._start_reader()
 
-    @retry(max_retries=5, delay=2, backoff=2)
+    @retry(max_retries=5, delay=2, backoff=2, dependency=lambda service: service.dependency)
     def connect(self):
-        if self.cap:
-            self.cap.release()
-            
-        self.cap = cv2.VideoCapture(settings.CAMERA_URL)
-        if not self.cap.isOpened():
-            raise ConnectionError(f"Failed to connect to camera at {settings.CAMERA_URL}")
-        return self.cap
+        self.source.open()
+        logger.info(f"Connected to camera at {self.url} ({self.source.name} source)")
+        return self.source
+
+    def _start_reader(self):
+        self._stop.clear()
+        self._reader = threading.Thread(target=self._read_loop, name=f'camera-reader-{self.url}', daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        """Drain the stream continuously, keeping only the newest frame(s)"""
+        while not self._stop.is_set():
+            try:
+                if not self.source.is_open:
+                    self.connect()
+
+                frame = self.source.read()
+
+                with self._frame_ready:
+                    if len(self._frames) == self._frames.maxlen:
+                        self.frames_dropped += 1
+                        _FRAMES_DROPPED.inc()
+                    self._frames.append((time.time(), frame))
+                    self.frames_captured += 1
+                    self._read_error = None
+                    self._frame_ready.notify_all()
+
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                logger.warning(f"Camera reader error ({self.url}): {e}. Reconnecting...")
+                _RECONNECTS.inc()
+                with self._frame_ready:
+                    self._read_error = e
+                    self._frame_ready.notify_all()
+                try:
+                    self.connect()
+                except Exception as reconnect_error:
+                    with self._frame_ready:
+                        self._read_error = reconnect_error
+                    self._stop.wait(settings.CAMERA_RETRY_INTERVAL)
 
     def get_frame(self):
+        with _CAMERA_READ_SECONDS.time():
+            return self._read_frame()
+
+    def _read_frame(self):
+        if self.threaded:
+            return self._get_latest_frame()
+
         try:
-            if not self.cap or not self.cap.isOpened():
+            if not self.source.is_open:
                 self.connect()
-                
-            ret, frame = self.cap.read()
-            if not ret:
-                raise ConnectionError("Failed to read frame")
+
+            frame = self.source.read()
+            self.frames_captured += 1
+            self.frames_delivered += 1
             return frame
         except Exception as e:
+            _RECONNECTS.inc()
             self.connect()
             raise
 
+    def _get_latest_frame(self):
+        """Return the freshest captured frame, discarding any older ones still buffered"""
+        with self._frame_ready:
+            if not self._frames:
+                self._frame_ready.wait_for(
+                    lambda: self._frames or self._read_error is not None or self._stop.is_set(),
+                    timeout=settings.CAMERA_TIMEOUT
+                )
+            if not self._frames:
+                raise ConnectionError(
+                    f"No frame received from camera: {self._read_error or 'timeout'}"
+                )
+
+            captured_at, frame = self._frames.pop()
+            self.frames_dropped += len(self._frames)
+            _FRAMES_DROPPED.inc(len(self._frames))
+            self._frames.clear()
+
+        self.frames_delivered += 1
+        self.last_capture_latency = time.time() - captured_at
+        self._total_capture_latency += self.last_capture_latency
+        return frame
+
+    @property
+    def queue_depth(self):
+        """Frames captured but not yet taken by get_frame"""
+        return len(self._frames)
+
+    def stats(self):
+        """Capture counters: frames read, dropped as stale, delivered, and capture latency"""
+        delivered = self.frames_delivered
+        return {
+            'source': self.source.name,
+            'frames_captured': self.frames_captured,
+            'frames_dropped': self.frames_dropped,
+            'frames_delivered': delivered,
+            'queue_depth': self.queue_depth,
+            'last_capture_latency': self.last_capture_latency,
+            'avg_capture_latency': self._total_capture_latency / delivered if delivered else 0.0,
+            'corrupt_frames': getattr(self.source, 'corrupt_frames', 0),
+        }
+
     def release(self):
-        if self.cap:
-            self.cap.release()
\ No newline at end of file
+        self._stop.set()
+        if self._reader:
+            with self._frame_ready:
+                self._frame_ready.notify_all()
+            self._reader.join(timeout=settings.CAMERA_TIMEOUT)
+            self._reader = None
+        self.source.close()
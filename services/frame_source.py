@@ -0,0 +1,317 @@
+"""services/frame_source.py"""
+
+import os
+import time
+import logging
+import numpy as np
+import cv2
+import requests
+from config.settings import get_settings
+from utils.images import IMAGE_EXTENSIONS, decode_flags
+
+settings = get_settings()
+logger = logging.getLogger('face_detection.frame_source')
+
+class FrameSource:
+    """
+    Where CameraService gets its frames from.
+
+    ``open`` connects (and may be called again to reconnect), ``read`` returns
+    the next frame or raises ``ConnectionError``/``TimeoutError``, ``close``
+    releases the connection. ``grayscale`` tells consumers whether frames are
+    already single-channel.
+    """
+    name = 'source'
+    grayscale = False
+
+    def __init__(self, url):
+        self.url = url
+
+    @property
+    def is_open(self):
+        raise NotImplementedError
+
+    def open(self):
+        raise NotImplementedError
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class VideoCaptureSource(FrameSource):
+    """Any stream or device OpenCV can open (RTSP, MJPEG, V4L2, ...), decoded to BGR"""
+    name = 'opencv'
+
+    def __init__(self, url, timeout=None):
+        super().__init__(url)
+        self.timeout = settings.CAMERA_TIMEOUT if timeout is None else timeout
+        self.cap = None
+
+    @property
+    def is_open(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def open(self):
+        self.close()
+        timeout_ms = int(self.timeout * 1000)
+        self.cap = cv2.VideoCapture(self.url, cv2.CAP_ANY, [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout_ms,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout_ms,
+        ])
+        if not self.cap.isOpened():
+            raise ConnectionError(f"Failed to connect to camera at {self.url}")
+        # Hint the backend to keep as few frames queued as possible
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            raise ConnectionError("Failed to read frame")
+        return frame
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+class MjpegSource(FrameSource):
+    """
+    Streaming reader for ``multipart/x-mixed-replace`` MJPEG (e.g. the ESP32-CAM /stream).
+
+    The response is read as it arrives (``read1``) into one reusable buffer
+    and every JPEG (SOI ``FFD8`` .. EOI ``FFD9``) is handed to ``cv2.imdecode``
+    as a zero-copy view, decoded straight to grayscale at 1/``scale`` resolution.
+    ``timeout`` applies to connecting and to every socket read, so a stalled
+    camera raises ``TimeoutError`` instead of blocking the reader forever.
+    """
+    name = 'mjpeg'
+    grayscale = True
+
+    def __init__(self, url, scale=None, timeout=None, buffer_size=256 * 1024, max_frame_bytes=4 * 1024 * 1024):
+        super().__init__(url)
+        self.scale = scale or settings.FRAME_DECODE_SCALE
+        self.flags = decode_flags(self.scale, grayscale=True)
+        self.timeout = settings.CAMERA_TIMEOUT if timeout is None else timeout
+        self.max_frame_bytes = max_frame_bytes
+        self.http = requests.Session()
+        self._response = None
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0   # first unconsumed byte
+        self._end = 0     # end of received data
+        self._scan = 0    # where the EOI search resumes
+
+        self.frames_decoded = 0
+        self.corrupt_frames = 0
+
+    @property
+    def is_open(self):
+        return self._response is not None
+
+    def open(self):
+        self.close()
+        try:
+            response = self.http.get(self.url, stream=True, timeout=(self.timeout, self.timeout))
+            response.raise_for_status()
+        except requests.Timeout as e:
+            raise TimeoutError(f"Timed out connecting to camera at {self.url}") from e
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to connect to camera at {self.url}: {e}") from e
+
+        content_type = response.headers.get('Content-Type', '')
+        if 'multipart' not in content_type and 'jpeg' not in content_type:
+            response.close()
+            raise ConnectionError(f"Camera at {self.url} is not an MJPEG stream ({content_type or 'no content type'})")
+
+        response.raw.decode_content = True
+        self._response = response
+        self._start = self._end = self._scan = 0
+
+    def _fill(self):
+        """Receive more bytes into the buffer, compacting or growing it when full"""
+        if self._end == len(self._buffer):
+            pending = self._end - self._start
+            if self._start == 0:
+                if len(self._buffer) * 2 > self.max_frame_bytes:
+                    self._start = self._end = self._scan = 0
+                    raise ConnectionError(f"No complete JPEG within {self.max_frame_bytes} bytes")
+                self._view.release()
+                self._buffer = self._buffer + bytearray(len(self._buffer))
+                self._view = memoryview(self._buffer)
+            else:
+                self._view[:pending] = self._view[self._start:self._end]
+                self._scan -= self._start
+                self._start, self._end = 0, pending
+
+        try:
+            raw = self._response.raw
+            if hasattr(raw, 'read1'):
+                # Whatever has arrived (at most one socket read): readinto would wait until the
+                # whole buffer is full, holding back frames that are already here
+                data = raw.read1(len(self._buffer) - self._end)
+                received = len(data)
+                self._view[self._end:self._end + received] = data
+            else:
+                received = raw.readinto(self._view[self._end:])
+        except Exception as e:
+            if isinstance(e, TimeoutError) or 'timed out' in str(e).lower():
+                raise TimeoutError(f"No data from camera at {self.url} for {self.timeout}s") from e
+            raise ConnectionError(f"Camera stream error ({self.url}): {e}") from e
+        if not received:
+            raise ConnectionError(f"Camera stream at {self.url} ended")
+        self._end += received
+
+    def _next_jpeg(self):
+        """(offset, length) of the next complete JPEG in the buffer"""
+        while True:
+            soi = self._buffer.find(b'\xff\xd8', self._start, self._end)
+            if soi < 0:
+                # Keep a trailing 0xFF: it may be the first half of the next SOI
+                self._start = max(self._start, self._end - 1)
+                self._scan = self._start
+                self._fill()
+                continue
+            self._start = soi
+            eoi = self._buffer.find(b'\xff\xd9', max(self._scan, soi + 2), self._end)
+            if eoi < 0:
+                self._scan = max(soi + 2, self._end - 1)
+                self._fill()
+                continue
+            # A new SOI before the EOI means this JPEG was cut off mid-transfer
+            restart = self._buffer.find(b'\xff\xd8\xff', soi + 2, eoi)
+            if restart >= 0:
+                self.corrupt_frames += 1
+                self._start = self._scan = restart
+                continue
+            end = eoi + 2
+            self._start = self._scan = end
+            return soi, end - soi
+
+    def read(self):
+        if self._response is None:
+            raise ConnectionError("MJPEG source is not open")
+        while True:
+            offset, length = self._next_jpeg()
+            data = np.frombuffer(self._buffer, dtype=np.uint8, count=length, offset=offset)
+            frame = cv2.imdecode(data, self.flags)
+            if frame is not None:
+                self.frames_decoded += 1
+                return frame
+            # Truncated or corrupt JPEG (e.g. Wi-Fi hiccup): skip it, not the stream
+            self.corrupt_frames += 1
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+class ReplaySource(FrameSource):
+    """
+    Replays a video file or a directory of images (sorted by name).
+
+    Images are decoded to grayscale at 1/``scale`` like the MJPEG source; video
+    frames are converted after decoding. With ``fps`` the replay is paced to
+    that rate, otherwise frames are returned as fast as they are read.
+    """
+    name = 'replay'
+
+    def __init__(self, path, scale=None, grayscale=True, fps=None, loop=None):
+        super().__init__(path)
+        self.scale = scale or settings.FRAME_DECODE_SCALE
+        self.grayscale = grayscale
+        self.flags = decode_flags(self.scale, grayscale)
+        self.fps = settings.REPLAY_FPS if fps is None else fps
+        self.loop = settings.REPLAY_LOOP if loop is None else loop
+        self.files = None
+        self.cap = None
+        self._position = 0
+        self._last_read = 0.0
+
+    @property
+    def is_open(self):
+        return self.files is not None or (self.cap is not None and self.cap.isOpened())
+
+    def open(self):
+        self.close()
+        self._position = 0
+        if os.path.isdir(self.url):
+            self.files = sorted(
+                os.path.join(self.url, name) for name in os.listdir(self.url)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if not self.files:
+                raise ConnectionError(f"No images to replay in {self.url}")
+        else:
+            self.cap = cv2.VideoCapture(self.url)
+            if not self.cap.isOpened():
+                raise ConnectionError(f"Failed to open replay file {self.url}")
+
+    def _read_image(self):
+        if self._position >= len(self.files):
+            if not self.loop:
+                raise ConnectionError(f"Replay of {self.url} finished")
+            self._position = 0
+        path = self.files[self._position]
+        self._position += 1
+        frame = cv2.imread(path, self.flags)
+        if frame is None:
+            raise ConnectionError(f"Failed to decode {path}")
+        return frame
+
+    def _read_video(self):
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        if not ret:
+            raise ConnectionError(f"Replay of {self.url} finished")
+
+        if self.grayscale:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.scale > 1:
+            frame = cv2.resize(frame, None, fx=1 / self.scale, fy=1 / self.scale, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def read(self):
+        if self.fps:
+            delay = self._last_read + 1.0 / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_read = time.monotonic()
+        return self._read_image() if self.files is not None else self._read_video()
+
+    def close(self):
+        self.files = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+def create_frame_source(url, kind=None):
+    """
+    Pick a frame source for a camera URL
+    Args:
+        url (str): Stream URL, video file or image directory
+        kind (str): 'auto', 'opencv', 'mjpeg' or 'replay' (default: CAMERA_SOURCE, which is
+            'opencv' so upgrading does not move existing cameras to another reader;
+            'auto' sends local paths to replay and every http(s) URL to mjpeg)
+    Returns:
+        FrameSource: Unopened source
+    """
+    kind = kind or settings.CAMERA_SOURCE
+    if kind == 'auto':
+        if os.path.exists(url):
+            kind = 'replay'
+        elif url.lower().startswith(('http://', 'https://')):
+            kind = 'mjpeg'
+        else:
+            kind = 'opencv'
+
+    if kind == 'mjpeg':
+        return MjpegSource(url)
+    if kind == 'replay':
+        return ReplaySource(url)
+    if kind == 'opencv':
+        return VideoCaptureSource(url)
+    raise ValueError(f"Unknown camera source '{kind}'")
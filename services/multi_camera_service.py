@@ -0,0 +1,144 @@
+"""services/multi_camera_service.py"""
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import get_settings
+from detection.detector import FaceDetector
+from services.attendance_service import AttendanceService
+from services.attendance_writer import create_attendance_writer
+from services.camera_service import CameraService
+from utils.retry import CLOSED, breaker_states
+
+settings = get_settings()
+logger = logging.getLogger('face_detection.multi_camera')
+
+class CameraChannel:
+    """One camera stream with its own detector state and counters"""
+
+    def __init__(self, camera_id, url, attendance_service, attendance_writer=None):
+        self.camera_id = camera_id
+        self.url = url
+        self.camera = None
+        self.detector = FaceDetector(
+            attendance_service=attendance_service, camera_id=camera_id,
+            attendance_writer=attendance_writer
+        )
+        self.frames_processed = 0
+        self.in_flight = 0
+        self.errors = 0
+
+    def queue_depth(self):
+        """Frames waiting for this camera: buffered in the reader plus the one being matched"""
+        buffered = self.camera.queue_depth if self.camera else 0
+        return buffered + self.in_flight
+
+
+class MultiCameraService:
+    """
+    Serve several cameras from one process.
+
+    Every camera gets its own reader thread, reconnect/backoff and
+    ``FaceDetector`` state, while all of them share one ``FaceMatcher``
+    (one loaded gallery), one ``AttendanceService`` (one DB pool) and a pool
+    of matching workers. SIFT and FLANN release the GIL, so the worker
+    threads run on separate cores without copying the gallery.
+    """
+
+    def __init__(self, urls, matcher, workers=None):
+        self.matcher = matcher
+        self.workers = workers or settings.MATCH_WORKERS
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='match-worker')
+        self.attendance_service = AttendanceService()
+        self.attendance_writer = create_attendance_writer(self.attendance_service)
+        self.channels = [
+            CameraChannel(f"cam{i}", url, self.attendance_service, self.attendance_writer)
+            for i, url in enumerate(urls)
+        ]
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        logger.info(f"Starting {len(self.channels)} cameras with {self.workers} matching workers")
+        if self.attendance_writer is not None:
+            self.attendance_writer.start()
+        for channel in self.channels:
+            thread = threading.Thread(
+                target=self._run_channel, args=(channel,),
+                name=f'camera-{channel.camera_id}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _run_channel(self, channel):
+        while not self._stop.is_set():
+            try:
+                if channel.camera is None:
+                    channel.camera = CameraService(url=channel.url)
+
+                frame = channel.camera.get_frame()
+                channel.in_flight += 1
+                try:
+                    # One frame in flight per camera keeps its detector state sequential
+                    self.pool.submit(channel.detector.process_frame, frame, self.matcher).result()
+                finally:
+                    channel.in_flight -= 1
+                channel.frames_processed += 1
+
+            except ConnectionError as e:
+                channel.errors += 1
+                logger.warning(f"[{channel.camera_id}] Camera error: {str(e)}. Reconnecting...")
+                self._stop.wait(settings.CAMERA_RETRY_INTERVAL)
+            except Exception as e:
+                channel.errors += 1
+                logger.error(f"[{channel.camera_id}] Error processing frame: {str(e)}")
+
+    def run(self):
+        """Start all cameras and log per-camera statistics until interrupted"""
+        self.start()
+        last_counts = {channel.camera_id: 0 for channel in self.channels}
+        last_time = time.time()
+        while not self._stop.wait(settings.STATS_INTERVAL):
+            now = time.time()
+            elapsed = now - last_time
+            for channel in self.channels:
+                fps = (channel.frames_processed - last_counts[channel.camera_id]) / elapsed
+                last_counts[channel.camera_id] = channel.frames_processed
+                dropped = channel.camera.frames_dropped if channel.camera else 0
+                gate = channel.detector.gate
+                skipped = f" | skipped: {gate.stats()['skipped_ratio']:.0%}" if gate else ""
+                logger.info(
+                    f"[{channel.camera_id}] fps: {fps:.2f} | queue depth: {channel.queue_depth()} | "
+                    f"dropped: {dropped} | errors: {channel.errors}{skipped}"
+                )
+            if self.attendance_writer is not None:
+                logger.info(f"Attendance writer: {self.attendance_writer.stats()}")
+            tripped = {name: state for name, state in breaker_states().items() if state['state'] != CLOSED}
+            if tripped:
+                logger.warning(f"Circuit breakers not closed: {tripped}")
+            last_time = now
+
+    def stats(self):
+        return {
+            channel.camera_id: {
+                **(channel.camera.stats() if channel.camera else {}),
+                'url': channel.url,
+                'frames_processed': channel.frames_processed,
+                'queue_depth': channel.queue_depth(),
+                'errors': channel.errors,
+                **({'gate': channel.detector.gate.stats()} if channel.detector.gate else {}),
+            }
+            for channel in self.channels
+        }
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=settings.CAMERA_TIMEOUT)
+        self.pool.shutdown(wait=False)
+        for channel in self.channels:
+            if channel.camera:
+                channel.camera.release()
+        if self.attendance_writer is not None:
+            self.attendance_writer.stop()
@@ -0,0 +1,10 @@
+"""tests/conftest.py"""
+
+import os
+import sys
+
+# Modules are imported as top-level packages (config, detection, ...) and settings
+# resolve their directories relative to the working directory, as in main.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
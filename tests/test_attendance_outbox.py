@@ -0,0 +1,188 @@
+"""tests/test_attendance_outbox.py"""
+
+import sqlite3
+import threading
+import time
+import pytest
+from sqlalchemy import exc as sa_exc
+from services.attendance_outbox import AttendanceOutbox
+
+class _FakeAttendanceService:
+    """
+    Local stand-in for ``AttendanceService.record_attendance_batch``: keeps rows
+    by attendance id (so replays are idempotent, like the INSERT), can be
+    taken down (``down``), can fail every batch with ``error``, and rejects
+    every batch containing a student in ``rejected``
+    """
+
+    def __init__(self, rejected=()):
+        self.rows = {}
+        self.calls = 0
+        self.down = False
+        self.error = None
+        self.rejected = set(rejected)
+        self._lock = threading.Lock()
+
+    def record_attendance_batch(self, events):
+        with self._lock:
+            self.calls += 1
+            if self.down:
+                raise ConnectionError("database unreachable")
+            if self.error is not None:
+                raise self.error
+            if any(event[0] in self.rejected for event in events):
+                raise sa_exc.IntegrityError("INSERT INTO Attendances ...", {}, Exception("foreign key"))
+            for student_id, date_str, _, attendance_id in events:
+                self.rows.setdefault(attendance_id, (student_id, date_str))
+            return [event[0] for event in events]
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def _outbox(service, path, **options):
+    options = {'commit_interval': 0, 'replay_interval': 0.02, 'max_backoff': 0.05, 'max_attempts': 3, **options}
+    return AttendanceOutbox(service, path=str(path), **options)
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / 'outbox.db'
+
+def test_events_replay_once(path):
+    service = _FakeAttendanceService()
+    outbox = _outbox(service, path).start()
+    try:
+        for student_id in ('st001', 'st002', 'st003'):
+            assert outbox.submit(student_id, '2026-10-18')
+        assert outbox.flush(timeout=5)
+        assert _wait_for(lambda: outbox.stats()['depth'] == 0)
+    finally:
+        outbox.stop()
+    assert sorted(student_id for student_id, _ in service.rows.values()) == ['st001', 'st002', 'st003']
+    assert outbox.stats()['replayed'] == 3
+
+def test_backlog_survives_restart(path):
+    service = _FakeAttendanceService()
+    service.down = True
+    outbox = _outbox(service, path).start()
+    for student_id in ('st001', 'st002'):
+        assert outbox.submit(student_id, '2026-10-18')
+    assert _wait_for(lambda: service.calls >= 2)
+    outbox.stop()
+    assert not service.rows
+
+    service.down = False
+    restarted = _outbox(service, path).start()
+    try:
+        assert restarted.stats()['depth'] == 2
+        assert _wait_for(lambda: restarted.stats()['depth'] == 0)
+    finally:
+        restarted.stop()
+    assert len(service.rows) == 2
+
+def test_replay_after_lost_acknowledgement_is_not_duplicated(path):
+    service = _FakeAttendanceService()
+    outbox = _outbox(service, path)
+    outbox.start()
+    outbox.stop()
+    # An event delivered before a crash, but never deleted from the outbox
+    with sqlite3.connect(str(path)) as db:
+        db.execute("INSERT INTO outbox (event_id, student_id, date_str, detected_at) "
+                   "VALUES ('event-1', 'st001', '2026-10-18', 1.0)")
+    service.rows['event-1'] = ('st001', '2026-10-18')
+
+    outbox = _outbox(service, path).start()
+    try:
+        assert _wait_for(lambda: outbox.stats()['depth'] == 0)
+    finally:
+        outbox.stop()
+    assert list(service.rows) == ['event-1']
+
+def test_rejected_event_is_dead_lettered_and_the_rest_drain(path):
+    service = _FakeAttendanceService(rejected={'bad'})
+    outbox = _outbox(service, path).start()
+    try:
+        for student_id in ('st001', 'bad', 'st002', 'st003'):
+            assert outbox.submit(student_id, '2026-10-18')
+        assert outbox.flush(timeout=5)
+        assert _wait_for(lambda: outbox.stats()['depth'] == 0)
+        stats = outbox.stats()
+    finally:
+        outbox.stop()
+
+    assert sorted(student_id for student_id, _ in service.rows.values()) == ['st001', 'st002', 'st003']
+    assert stats['dead_lettered'] == 1
+    with sqlite3.connect(str(path)) as db:
+        dead = db.execute('SELECT student_id, attempts, last_error FROM outbox_dead').fetchall()
+    assert len(dead) == 1
+    student_id, attempts, last_error = dead[0]
+    assert (student_id, attempts) == ('bad', 3)
+    assert last_error.startswith('IntegrityError')
+
+def test_outage_does_not_count_as_attempts(path):
+    service = _FakeAttendanceService()
+    service.down = True
+    outbox = _outbox(service, path, max_attempts=2).start()
+    try:
+        assert outbox.submit('st001', '2026-10-18')
+        assert _wait_for(lambda: service.calls >= 5)
+        assert outbox.stats()['dead_lettered'] == 0
+        service.down = False
+        assert _wait_for(lambda: outbox.stats()['depth'] == 0)
+    finally:
+        outbox.stop()
+    assert [student_id for student_id, _ in service.rows.values()] == ['st001']
+
+def test_errors_unrelated_to_the_rows_do_not_count_as_attempts(path):
+    service = _FakeAttendanceService()
+    service.error = sa_exc.ProgrammingError("INSERT INTO Attendances ...", {}, Exception("no such column"))
+    outbox = _outbox(service, path, max_attempts=2).start()
+    try:
+        for student_id in ('st001', 'st002'):
+            assert outbox.submit(student_id, '2026-10-18')
+        assert _wait_for(lambda: service.calls >= 5)
+        stats = outbox.stats()
+        assert (stats['dead_lettered'], stats['depth']) == (0, 2)
+        service.error = None
+        assert _wait_for(lambda: outbox.stats()['depth'] == 0)
+    finally:
+        outbox.stop()
+    assert sorted(student_id for student_id, _ in service.rows.values()) == ['st001', 'st002']
+    with sqlite3.connect(str(path)) as db:
+        assert db.execute('SELECT COUNT(*) FROM outbox_dead').fetchone()[0] == 0
+
+def test_submit_does_not_wait_for_the_commit(path):
+    service = _FakeAttendanceService()
+    service.down = True
+    outbox = _outbox(service, path, commit_interval=0.5).start()
+    try:
+        start = time.monotonic()
+        for student_id in ('st001', 'st002', 'st003'):
+            assert outbox.submit(student_id, '2026-10-18')
+        assert time.monotonic() - start < 0.2
+        assert outbox.flush(timeout=5)
+        stats = outbox.stats()
+        assert (stats['pending'], stats['appended'], stats['commits']) == (0, 3, 1)
+        with sqlite3.connect(str(path)) as db:
+            assert db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0] == 3
+    finally:
+        outbox.stop()
+
+def test_submit_rejects_when_the_queue_is_full(path):
+    outbox = _outbox(_FakeAttendanceService(), path, max_queue=2)
+    # Not started: nothing drains the queue
+    assert outbox.submit('st001', '2026-10-18')
+    assert outbox.submit('st002', '2026-10-18')
+    assert not outbox.submit('st003', '2026-10-18')
+    assert outbox.stats()['rejected'] == 1
+
+    outbox.start()
+    try:
+        assert outbox.flush(timeout=5)
+        assert outbox.stats()['appended'] == 2
+    finally:
+        outbox.stop()
@@ -0,0 +1,99 @@
+"""tests/test_attendance_service.py"""
+
+import threading
+import time
+import pytest
+from services import attendance_service as attendance_module
+from services.attendance_service import AttendanceService
+
+class _Result(list):
+    def fetchone(self):
+        return self[0] if self else None
+
+class _FakeSession:
+    """
+    Stand-in for a SQLAlchemy session: answers the daily range query and the
+    per-student fallback from ``sessions = {date_str: {student_id: session_id}}``
+    """
+
+    def __init__(self, sessions, delay=0.0):
+        self.sessions = sessions
+        self.delay = delay
+        self.range_queries = []
+        self.fallback_queries = []
+        self._lock = threading.Lock()
+
+    def execute(self, query, params):
+        if 'start_utc' in params:
+            # Local day D starts at D-1 17:00 UTC
+            date_str = (params['start_utc'] + attendance_module.JAKARTA_OFFSET).strftime('%Y-%m-%d')
+            with self._lock:
+                self.range_queries.append(date_str)
+            time.sleep(self.delay)
+            return _Result(self.sessions.get(date_str, {}).items())
+        with self._lock:
+            self.fallback_queries.append((params['student_id'], params['local_date']))
+        session_id = self.sessions.get(params['local_date'], {}).get(params['student_id'])
+        return _Result([(session_id,)] if session_id else [])
+
+@pytest.fixture
+def service():
+    # The constructor only keeps the lazy database handle; no connection is made
+    return AttendanceService()
+
+SESSIONS = {
+    '2026-10-17': {'st001': 'sess-17a', 'st002': 'sess-17b'},
+    '2026-10-18': {'st001': 'sess-18a'},
+}
+
+def test_sessions_are_cached_per_date(service):
+    db = _FakeSession(SESSIONS)
+    assert service._get_session_id(db, 'st001', '2026-10-18') == 'sess-18a'
+    # Replaying an older event loads that date next to today instead of replacing it
+    assert service._get_session_id(db, 'st001', '2026-10-17') == 'sess-17a'
+    assert service._get_session_id(db, 'st002', '2026-10-17') == 'sess-17b'
+    assert service._get_session_id(db, 'st001', '2026-10-18') == 'sess-18a'
+    assert db.range_queries == ['2026-10-18', '2026-10-17']
+
+def test_negative_cache_survives_other_dates(service):
+    db = _FakeSession(SESSIONS)
+    assert service._get_session_id(db, 'st002', '2026-10-18') is None
+    assert service._get_session_id(db, 'st002', '2026-10-17') == 'sess-17b'
+    assert service._get_session_id(db, 'st002', '2026-10-18') is None
+    assert db.fallback_queries == [('st002', '2026-10-18')]
+
+def test_session_created_after_load_is_found_once(service):
+    db = _FakeSession({'2026-10-18': {}})
+    service._get_session_id(db, 'st003', '2026-10-18')
+    db.sessions['2026-10-18']['st004'] = 'sess-late'
+    assert service._get_session_id(db, 'st004', '2026-10-18') == 'sess-late'
+    assert service._get_session_id(db, 'st004', '2026-10-18') == 'sess-late'
+    assert db.fallback_queries == [('st003', '2026-10-18'), ('st004', '2026-10-18')]
+
+def test_concurrent_misses_share_one_load(service):
+    db = _FakeSession(SESSIONS, delay=0.05)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(service._get_session_id(db, 'st001', '2026-10-18')))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['sess-18a'] * 8
+    assert db.range_queries == ['2026-10-18']
+
+def test_expired_cache_is_reloaded(service, monkeypatch):
+    db = _FakeSession(SESSIONS)
+    service._get_session_id(db, 'st001', '2026-10-18')
+    monkeypatch.setattr(attendance_module.settings, 'SESSION_CACHE_TTL', 0)
+    service._get_session_id(db, 'st001', '2026-10-18')
+    assert db.range_queries == ['2026-10-18', '2026-10-18']
+
+def test_old_dates_are_evicted(service):
+    db = _FakeSession({})
+    dates = [f'2026-10-{day:02d}' for day in range(10, 10 + attendance_module._SESSION_CACHE_DAYS + 1)]
+    for date_str in dates:
+        service._get_session_id(db, 'st001', date_str)
+    assert list(service._days) == dates[1:]
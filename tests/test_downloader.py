@@ -0,0 +1,203 @@
+"""tests/test_downloader.py"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+import pytest
+from config.settings import get_settings
+from detection.downloader import PhotoDownloader
+from detection.gallery import KEYPOINTS_DIR
+from models.student import Student
+from utils import retry as retry_module
+
+settings = get_settings()
+
+class _PhotoServer:
+    """
+    Local stand-in for the photo host: serves ``photos`` (path -> JPEG bytes)
+    with an ETag, answers a matching If-None-Match with 304, and fails the
+    first request for every path in ``fail_once`` with a 503
+    """
+
+    def __init__(self, photos, fail_once=()):
+        self.photos = dict(photos)
+        self.fail_once = set(fail_once)
+        self.statuses = []
+        self._lock = threading.Lock()
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with server._lock:
+                    content = server.photos.get(self.path)
+                    failing = self.path in server.fail_once
+                    server.fail_once.discard(self.path)
+                etag = f'"{hashlib.sha1(content).hexdigest()}"' if content is not None else None
+                if failing:
+                    status = 503
+                elif content is None:
+                    status = 404
+                elif self.headers.get('If-None-Match') == etag:
+                    status = 304
+                else:
+                    status = 200
+                with server._lock:
+                    server.statuses.append((self.path, status))
+
+                self.send_response(status)
+                if status in (200, 304):
+                    self.send_header('ETag', etag)
+                body = content if status == 200 else b''
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def count(self, status):
+        with self._lock:
+            return sum(1 for _, seen in self.statuses if seen == status)
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+def _photo(seed):
+    """A textured JPEG that gives SIFT plenty of keypoints, different per seed"""
+    rng = np.random.default_rng(seed)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (240, 240), dtype=np.uint8), (5, 5), 0)
+    for _ in range(12):
+        x, y = (int(v) for v in rng.integers(20, 220, 2))
+        cv2.circle(image, (x, y), int(rng.integers(5, 25)), int(rng.integers(0, 256)), -1)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+def _students(server, count):
+    students = []
+    for i in range(1, count + 1):
+        student_id = f"st9{i:02d}"
+        server.photos.setdefault(f"/{student_id}.jpg", _photo(i))
+        students.append(Student(student_id, f"Student {i}", f"{server.url}/{student_id}.jpg"))
+    return students
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    # Retries back off for seconds; the stand-in server needs none of it
+    monkeypatch.setattr(retry_module.time, 'sleep', lambda seconds: None)
+
+@pytest.fixture
+def use_features_dir(monkeypatch):
+    """Point the downloader's outputs at a directory; nothing is written to the shipped features"""
+    def _use(directory):
+        directory = str(directory)
+        monkeypatch.setattr(settings, 'FEATURES_DIR', directory)
+        monkeypatch.setattr(settings, 'MANIFEST_FILE', os.path.join(directory, 'manifest.json'))
+        monkeypatch.setattr(settings, 'GALLERY_FILE', os.path.join(directory, 'gallery.bin'))
+        return directory
+    return _use
+
+def _saved_features(directory):
+    files = {}
+    for subdirectory in ('', KEYPOINTS_DIR):
+        path = os.path.join(directory, subdirectory)
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.npy'):
+                files[os.path.join(subdirectory, name)] = np.load(os.path.join(path, name))
+    return files
+
+def test_concurrent_download_matches_sequential(tmp_path, use_features_dir, caplog):
+    caplog.set_level(logging.INFO, logger='face_detection.downloader')
+    with _PhotoServer({}) as server:
+        students = _students(server, 12)
+        # One photo fails once and must be fetched again by the retry
+        server.fail_once.add('/st903.jpg')
+
+        use_features_dir(tmp_path / 'sequential')
+        sequential = PhotoDownloader()
+        assert sequential._run_sequential(students) == 12
+
+        server.fail_once.add('/st903.jpg')
+        use_features_dir(tmp_path / 'concurrent')
+        concurrent = PhotoDownloader()
+        assert concurrent._run_concurrent(students, download_workers=4, extract_workers=2, queue_size=3) == 12
+        assert server.count(503) == 2
+
+    expected = _saved_features(str(tmp_path / 'sequential'))
+    actual = _saved_features(str(tmp_path / 'concurrent'))
+    assert len(expected) == 24
+    assert sorted(actual) == sorted(expected)
+    for name, descriptors in expected.items():
+        np.testing.assert_array_equal(actual[name], descriptors, err_msg=name)
+
+    for downloader in (sequential, concurrent):
+        assert (downloader.report['added'], downloader.report['failed']) == (12, 0)
+        assert sorted(downloader.manifest) == [student.student_id for student in students]
+    progress = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Progress:')]
+    # Every 10 students and at the end, for each path
+    assert [message.split(' |')[0] for message in progress] == [
+        'Progress: 10/12 (83.3%)', 'Progress: 12/12 (100.0%)'
+    ] * 2
+    assert progress[-1].endswith('Success: 12 | Failed: 0')
+
+def test_concurrent_download_counts_missing_photos_as_failed(tmp_path, use_features_dir):
+    with _PhotoServer({}) as server:
+        students = _students(server, 3)
+        students.append(Student('st999', 'Missing', f"{server.url}/st999.jpg"))
+        use_features_dir(tmp_path)
+        downloader = PhotoDownloader()
+        assert downloader._run_concurrent(students, download_workers=2, extract_workers=1, queue_size=2) == 3
+    assert (downloader.report['added'], downloader.report['failed']) == (3, 1)
+    assert 'st999' not in downloader.manifest
+    assert not os.path.exists(os.path.join(str(tmp_path), 'st999.npy'))
+
+def test_sync_adds_revalidates_updates_and_removes(tmp_path, use_features_dir, monkeypatch):
+    features_dir = use_features_dir(tmp_path)
+    monkeypatch.setattr(settings, 'DOWNLOAD_WORKERS', 2)
+    monkeypatch.setattr(settings, 'EXTRACT_WORKERS', 1)
+    monkeypatch.setattr(settings, 'SYNC_REMOVE_STALE', True)
+
+    def _sync(students):
+        # Stand-in for the database query; a new downloader per run, like the CLI
+        monkeypatch.setattr(PhotoDownloader, 'get_students_with_photos', lambda self: list(students))
+        report = PhotoDownloader().run()
+        return {key: report[key] for key in ('added', 'updated', 'removed', 'unchanged', 'failed')}
+
+    with _PhotoServer({}) as server:
+        students = _students(server, 4)
+        assert _sync(students) == {'added': 4, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0}
+        assert server.count(200) == 4
+        first = np.load(os.path.join(features_dir, 'st902.npy'))
+
+        # Nothing changed: every photo is revalidated with its ETag and nothing is downloaded again
+        assert _sync(students) == {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 4, 'failed': 0}
+        assert (server.count(200), server.count(304)) == (4, 4)
+
+        # A new photo for st902 and st904 no longer enrolled
+        server.photos['/st902.jpg'] = _photo(42)
+        assert _sync(students[:3]) == {'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 2, 'failed': 0}
+        assert (server.count(200), server.count(304)) == (5, 6)
+
+    assert [name for name in sorted(os.listdir(features_dir)) if name.endswith('.npy')] == [
+        'st901.npy', 'st902.npy', 'st903.npy'
+    ]
+    assert sorted(os.listdir(os.path.join(features_dir, KEYPOINTS_DIR))) == ['st901.npy', 'st902.npy', 'st903.npy']
+    assert not np.array_equal(np.load(os.path.join(features_dir, 'st902.npy')), first)
+    with open(os.path.join(features_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == ['st901', 'st902', 'st903']
+    assert manifest['st902']['content_hash'] == hashlib.sha256(_photo(42)).hexdigest()
@@ -0,0 +1,184 @@
+"""tests/test_frame_source.py"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+import pytest
+from services.frame_source import MjpegSource, ReplaySource, VideoCaptureSource, create_frame_source
+
+BOUNDARY = b'frame'
+
+def _jpeg(level, width=160, height=120):
+    """A JPEG whose decoded pixels are all close to ``level``, so frames can be told apart"""
+    image = np.full((height, width, 3), level, dtype=np.uint8)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+def _part(payload):
+    return (b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+            + f'Content-Length: {len(payload)}\r\n\r\n'.encode() + payload + b'\r\n')
+
+class _MjpegServer:
+    """
+    Local stand-in for an ESP32-CAM ``/stream``: every request gets the parts
+    of ``script`` (bytes to send, or a float to pause that many seconds),
+    written with chunked transfer encoding in ``chunk``-byte pieces, and the
+    connection is closed at the end of the script
+    """
+
+    def __init__(self, script, chunk=97):
+        self.script = script
+        self.chunk = chunk
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY.decode()}')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                try:
+                    for item in server.script:
+                        if isinstance(item, float):
+                            time.sleep(item)
+                            continue
+                        for i in range(0, len(item), server.chunk):
+                            piece = item[i:i + server.chunk]
+                            self.wfile.write(f'{len(piece):x}\r\n'.encode() + piece + b'\r\n')
+                            self.wfile.flush()
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/stream'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def _levels(source, count):
+    return [int(round(source.read().mean())) for _ in range(count)]
+
+def test_mjpeg_reads_chunked_parts_downscaled_to_grayscale():
+    levels = [40, 80, 120, 160, 200]
+    with _MjpegServer([_part(_jpeg(level)) for level in levels]) as server:
+        # A buffer smaller than one JPEG exercises growing and compacting it
+        source = MjpegSource(server.url, scale=2, timeout=2, buffer_size=1024)
+        source.open()
+        try:
+            frame = source.read()
+            assert frame.shape == (60, 80) and frame.ndim == 2
+            assert [int(round(frame.mean()))] + _levels(source, 4) == pytest.approx(levels, abs=2)
+            assert source.frames_decoded == 5 and source.corrupt_frames == 0
+        finally:
+            source.close()
+
+def test_mjpeg_skips_truncated_and_corrupt_jpegs():
+    good, other = _jpeg(60), _jpeg(180)
+    # Cut off mid-transfer: the next part's SOI arrives before this one's EOI
+    truncated = good[:len(good) // 2]
+    # Complete SOI..EOI, but the entropy-coded data is garbage
+    corrupt = b'\xff\xd8\xff\xe0' + bytes(range(1, 200)) + b'\xff\xd9'
+    with _MjpegServer([_part(truncated), _part(corrupt), _part(good), _part(other)]) as server:
+        source = MjpegSource(server.url, scale=1, timeout=2)
+        source.open()
+        try:
+            assert _levels(source, 2) == pytest.approx([60, 180], abs=2)
+            assert source.corrupt_frames == 2
+            assert source.frames_decoded == 2
+        finally:
+            source.close()
+
+def test_mjpeg_read_times_out_on_a_stalled_camera():
+    with _MjpegServer([_part(_jpeg(100)), 5.0]) as server:
+        source = MjpegSource(server.url, scale=1, timeout=0.3)
+        source.open()
+        try:
+            source.read()
+            start = time.monotonic()
+            with pytest.raises(TimeoutError):
+                source.read()
+            assert time.monotonic() - start < 3
+        finally:
+            source.close()
+
+def test_mjpeg_reconnects_after_the_server_drops():
+    with _MjpegServer([_part(_jpeg(50)), _part(_jpeg(150))]) as server:
+        source = MjpegSource(server.url, scale=1, timeout=2)
+        source.open()
+        try:
+            assert _levels(source, 2) == pytest.approx([50, 150], abs=2)
+            with pytest.raises(ConnectionError):
+                source.read()
+            # CameraService reconnects by opening the source again
+            source.open()
+            assert _levels(source, 1) == pytest.approx([50], abs=2)
+            assert server.requests == 2
+        finally:
+            source.close()
+
+def test_mjpeg_rejects_a_non_stream_response():
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'hi')
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        source = MjpegSource(f'http://127.0.0.1:{httpd.server_address[1]}/', timeout=2)
+        with pytest.raises(ConnectionError, match='not an MJPEG stream'):
+            source.open()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+def test_replay_directory_in_name_order(tmp_path):
+    for name, level in (('b.png', 100), ('a.png', 50), ('c.jpg', 150)):
+        cv2.imwrite(str(tmp_path / name), np.full((40, 60, 3), level, dtype=np.uint8))
+    (tmp_path / 'notes.txt').write_text('not an image')
+
+    source = ReplaySource(str(tmp_path), scale=1, loop=True, fps=0)
+    source.open()
+    assert _levels(source, 4) == pytest.approx([50, 100, 150, 50], abs=2)
+    assert source.read().shape == (40, 60)
+
+    once = ReplaySource(str(tmp_path), scale=1, loop=False, fps=0)
+    once.open()
+    _levels(once, 3)
+    with pytest.raises(ConnectionError, match='finished'):
+        once.read()
+
+def test_replay_of_an_empty_directory_fails_to_open(tmp_path):
+    with pytest.raises(ConnectionError):
+        ReplaySource(str(tmp_path)).open()
+
+def test_create_frame_source_defaults_to_opencv(tmp_path):
+    assert isinstance(create_frame_source('http://camera/stream'), VideoCaptureSource)
+    assert isinstance(create_frame_source('http://camera/stream', 'auto'), MjpegSource)
+    assert isinstance(create_frame_source(str(tmp_path), 'auto'), ReplaySource)
+    with pytest.raises(ValueError):
+        create_frame_source('http://camera/stream', 'webrtc')
@@ -0,0 +1,108 @@
+"""tests/test_gallery.py"""
+
+import numpy as np
+import pytest
+from detection import gallery as gallery_module
+from detection.gallery import FeatureGallery, GALLERY_MAGIC, student_feature_files
+
+def _features(backend='sift', students=3, seed=0):
+    rng = np.random.default_rng(seed)
+    features, points = {}, {}
+    for i in range(students):
+        rows = 20 + i
+        if backend == 'sift':
+            features[f'st{i:03d}'] = rng.integers(0, 120, size=(rows, 128)).astype(np.float32)
+        else:
+            features[f'st{i:03d}'] = rng.integers(0, 256, size=(rows, 32), dtype=np.uint8)
+        points[f'st{i:03d}'] = rng.uniform(0, 256, size=(rows, 2)).astype(np.float32)
+    return features, points
+
+def _assert_same(loaded, original):
+    assert loaded.student_ids == original.student_ids
+    assert loaded.backend == original.backend
+    np.testing.assert_array_equal(loaded.offsets, original.offsets)
+    np.testing.assert_array_equal(np.asarray(loaded.descriptors), np.asarray(original.descriptors))
+    for name in ('projection', 'points'):
+        expected = getattr(original, name)
+        if expected is None:
+            assert getattr(loaded, name) is None
+        else:
+            np.testing.assert_allclose(getattr(loaded, name), expected, rtol=1e-6)
+
+def _rewrite_header(path, version):
+    """Turn a current gallery file into one written by an older version (same offsets)"""
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    fields = list(gallery_module._HEADER.unpack_from(data))
+    fields[1] = version
+    old = {1: gallery_module._HEADER_V1, 2: gallery_module._HEADER_V2, 3: gallery_module._HEADER_V3}[version]
+    packed = old.pack(*fields[:_field_count(old)])
+    data[:gallery_module._HEADER.size] = packed.ljust(gallery_module._HEADER.size, b'\0')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _field_count(header):
+    return len(header.unpack(bytes(header.size)))
+
+@pytest.mark.parametrize('dtype,pca_dims', [('float32', 0), ('float16', 0), ('uint8', 0), ('float16', 16)])
+def test_save_open_round_trip(tmp_path, dtype, pca_dims):
+    features, points = _features()
+    original = FeatureGallery.from_features(features, points).compact(dtype, pca_dims)
+    path = str(tmp_path / 'gallery.bin')
+    original.save(path)
+
+    loaded = FeatureGallery.open(path)
+    _assert_same(loaded, original)
+    assert loaded.get_points('st001') is not None
+
+def test_binary_backend_round_trip(tmp_path):
+    features, points = _features('orb')
+    original = FeatureGallery.from_features(features, points)
+    assert original.backend == 'orb'
+    path = str(tmp_path / 'gallery.bin')
+    original.save(path)
+    _assert_same(FeatureGallery.open(path), original)
+
+def test_empty_gallery_round_trip(tmp_path):
+    original = FeatureGallery.from_features({})
+    path = str(tmp_path / 'gallery.bin')
+    original.save(path)
+    loaded = FeatureGallery.open(path)
+    assert len(loaded) == 0 and loaded.size == 0
+
+@pytest.mark.parametrize('version,compact', [(1, False), (2, True), (3, False)])
+def test_opens_older_versions(tmp_path, version, compact):
+    features, points = _features()
+    original = FeatureGallery.from_features(features, points if version >= 3 else None)
+    if compact:
+        original = original.compact('float16', 16)
+    path = str(tmp_path / 'gallery.bin')
+    original.save(path)
+    _rewrite_header(path, version)
+
+    loaded = FeatureGallery.open(path)
+    # Versions before 4 do not record the backend: SIFT
+    assert loaded.backend == 'sift'
+    _assert_same(loaded, original)
+
+def test_rejects_foreign_and_future_files(tmp_path):
+    path = tmp_path / 'gallery.bin'
+    path.write_bytes(b'not a gallery' + bytes(200))
+    with pytest.raises(ValueError, match='Not a gallery'):
+        FeatureGallery.open(str(path))
+
+    features, _ = _features()
+    FeatureGallery.from_features(features).save(str(path))
+    data = bytearray(path.read_bytes())
+    data[len(GALLERY_MAGIC):len(GALLERY_MAGIC) + 4] = (99).to_bytes(4, 'little')
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match='Unsupported gallery version'):
+        FeatureGallery.open(str(path))
+
+def test_student_feature_files_skip_reserved_and_subdirectories(tmp_path):
+    for name in ('st002.npy', 'st001.npy', 'vocabulary.npy', 'manifest.json'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'keypoints').mkdir()
+    (tmp_path / 'keypoints' / 'st001.npy').write_bytes(b'')
+
+    assert [student_id for student_id, _ in student_feature_files(str(tmp_path))] == ['st001', 'st002']
@@ -0,0 +1,117 @@
+"""tests/test_matcher.py"""
+
+import os
+import shutil
+import time
+import numpy as np
+import pytest
+from detection.benchmark import descriptor_probes
+from detection.feature_backend import FeatureBackend
+from detection.gallery import FeatureGallery
+from detection.matcher import FaceMatcher
+from config.settings import get_settings
+
+settings = get_settings()
+
+# The shipped features, read before a test points FEATURES_DIR elsewhere
+ROOT_FEATURES = settings.FEATURES_DIR
+
+@pytest.fixture(scope='module')
+def gallery():
+    gallery = FeatureGallery.from_directory(settings.FEATURES_DIR, 'sift')
+    if not len(gallery):
+        pytest.skip("No SIFT reference features in FEATURES_DIR")
+    return gallery
+
+def _matcher(mode, gallery):
+    # Brute force, so both modes see exact neighbours
+    return FaceMatcher(mode=mode, gallery=gallery, shortlist_size=0, backend=FeatureBackend('sift', 'bf'))
+
+def test_gallery_mode_agrees_with_per_student(gallery):
+    probes = descriptor_probes(gallery, per_student=2, seed=0)
+    stacked, per_student = _matcher('gallery', gallery), _matcher('per_student', gallery)
+
+    for label, descriptors in probes:
+        expected = per_student.match_descriptors(descriptors)[0]
+        assert stacked.match_descriptors(descriptors)[0] == expected
+        assert expected == label
+
+def test_unrelated_descriptors_match_nobody(gallery):
+    rows = gallery.offsets[1]
+    # One student's descriptors with their dimensions reversed share no structure with anyone
+    probe = gallery.working_descriptors()[:rows][:, ::-1].copy()
+    assert _matcher('gallery', gallery).match_descriptors(probe)[0] is None
+
+@pytest.fixture
+def features_dir(tmp_path, monkeypatch):
+    """Per-student features of three shipped students in a directory reload can change"""
+    for student_id in ('st001', 'st002', 'st003'):
+        source = os.path.join(settings.FEATURES_DIR, f"{student_id}.npy")
+        if not os.path.exists(source):
+            pytest.skip(f"No reference features for {student_id} in FEATURES_DIR")
+    for student_id in ('st001', 'st002'):
+        _copy_features(student_id, tmp_path, student_id)
+    monkeypatch.setattr(settings, 'FEATURES_DIR', str(tmp_path))
+    monkeypatch.setattr(settings, 'GALLERY_FILE', str(tmp_path / 'missing_gallery.npz'))
+    return tmp_path
+
+def _copy_features(source_id, directory, student_id):
+    """Write ``source_id``'s shipped descriptors as ``student_id`` and make the change visible to a stat"""
+    target = os.path.join(str(directory), f"{student_id}.npy")
+    previous = os.stat(target).st_mtime_ns if os.path.exists(target) else 0
+    shutil.copyfile(os.path.join(ROOT_FEATURES, f"{source_id}.npy"), target)
+    mtime = max(os.stat(target).st_mtime_ns, previous + 1_000_000_000)
+    os.utime(target, ns=(mtime, mtime))
+
+def _probe(student_id):
+    descriptors = np.load(os.path.join(ROOT_FEATURES, f"{student_id}.npy"))
+    return np.ascontiguousarray(descriptors[:300])
+
+def _reloading_matcher():
+    return FaceMatcher(mode='gallery', shortlist_size=0, backend=FeatureBackend('sift', 'bf'))
+
+def test_reload_picks_up_added_changed_and_removed_features(features_dir):
+    matcher = _reloading_matcher()
+    assert matcher.gallery.student_ids == ['st001', 'st002']
+    assert not matcher.reload()
+
+    _copy_features('st003', features_dir, 'st004')
+    _copy_features('st003', features_dir, 'st001')
+    os.remove(str(features_dir / 'st002.npy'))
+    assert matcher.reload()
+
+    assert sorted(matcher.gallery.student_ids) == ['st001', 'st004']
+    # st001 now holds st003's descriptors, st002 is gone
+    assert matcher.match_descriptors(_probe('st003'))[0] in ('st001', 'st004')
+    assert matcher.match_descriptors(_probe('st002'))[0] is None
+    assert not matcher.reload()
+
+def test_corrupt_features_keep_the_previous_gallery(features_dir):
+    matcher = _reloading_matcher()
+    assert matcher.match_descriptors(_probe('st001'))[0] == 'st001'
+
+    with open(str(features_dir / 'st001.npy'), 'wb') as f:
+        f.write(b'not a numpy file')
+    (features_dir / 'st009.npy').write_bytes(b'\x93NUMPY truncated')
+    matcher.reload()
+
+    assert matcher.gallery.student_ids == ['st001', 'st002']
+    assert matcher.match_descriptors(_probe('st001'))[0] == 'st001'
+    assert matcher.match_descriptors(_probe('st002'))[0] == 'st002'
+
+    # Fixed on disk: the next poll picks it up
+    _copy_features('st003', features_dir, 'st001')
+    assert matcher.reload()
+    assert matcher.match_descriptors(_probe('st003'))[0] == 'st001'
+
+def test_auto_reload_polls_in_the_background(features_dir):
+    matcher = _reloading_matcher()
+    matcher.start_auto_reload(interval=0.05)
+    try:
+        _copy_features('st003', features_dir, 'st003')
+        deadline = time.monotonic() + 5
+        while 'st003' not in matcher.gallery.student_ids and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        matcher.stop_auto_reload()
+    assert matcher.match_descriptors(_probe('st003'))[0] == 'st003'
@@ -0,0 +1,161 @@
+"""tests/test_retry.py"""
+
+import asyncio
+import pytest
+from utils import retry as retry_module
+from utils.retry import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, RetryBudget, retry
+
+class _Clock:
+    """Replaces time.monotonic in utils.retry so breaker timeouts need no sleeping"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(retry_module.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(retry_module.time, 'sleep', lambda seconds: None)
+
+def _fail():
+    raise ConnectionError("down")
+
+def _breaker(name, **options):
+    options = {'failure_threshold': 3, 'reset_timeout': 30, **options}
+    return CircuitBreaker(name, **options)
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = _breaker('test-open')
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(_fail)
+    assert breaker.state == CLOSED
+    with pytest.raises(ConnectionError):
+        breaker.call(_fail)
+    assert breaker.state == OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call(calls.append, 1)
+    assert not calls
+    assert breaker.stats()['rejected'] == 1
+
+def test_success_resets_the_failure_count(clock):
+    breaker = _breaker('test-reset')
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(_fail)
+    breaker.call(lambda: None)
+    with pytest.raises(ConnectionError):
+        breaker.call(_fail)
+    assert breaker.state == CLOSED
+
+def test_half_open_trial_closes_or_reopens(clock):
+    breaker = _breaker('test-half-open', failure_threshold=1)
+    with pytest.raises(ConnectionError):
+        breaker.call(_fail)
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+
+    # Only one trial call goes through; a failure reopens for another reset_timeout
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_failure(ConnectionError("still down"))
+    assert breaker.state == OPEN
+    clock.now += 29
+    assert breaker.state == OPEN
+
+    clock.now += 1
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED
+    assert breaker.stats()['opened'] == 2
+
+def test_errors_outside_trip_on_do_not_open(clock):
+    breaker = _breaker('test-trip-on', failure_threshold=1, trip_on=(ConnectionError,))
+    for _ in range(3):
+        with pytest.raises(KeyError):
+            breaker.call(lambda: {}['missing'])
+    assert breaker.state == CLOSED
+
+def test_budget_caps_retries_at_a_share_of_calls():
+    budget = RetryBudget('test-budget', ratio=0.5, max_tokens=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+
+def test_retry_stops_when_the_budget_is_spent(monkeypatch):
+    monkeypatch.setattr(retry_module, '_budgets', {'test-spent': RetryBudget('test-spent', ratio=0, max_tokens=1)})
+    calls = []
+
+    @retry(max_retries=5, delay=0.01, dependency='test-spent')
+    def flaky():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        flaky()
+    # First attempt plus the single retry the budget allows
+    assert len(calls) == 2
+
+def test_retry_does_not_retry_an_open_breaker(monkeypatch):
+    breaker = _breaker('test-no-retry', failure_threshold=1)
+    monkeypatch.setattr(retry_module, '_breakers', {'test-no-retry': breaker})
+    calls = []
+
+    @retry(max_retries=5, delay=0.01, dependency='test-no-retry')
+    def flaky():
+        calls.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(CircuitOpenError):
+        flaky()
+    assert len(calls) == 1
+
+def test_retry_succeeds_after_transient_failures():
+    attempts = []
+
+    @retry(max_retries=3, delay=0.01)
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("down")
+        return 'ok'
+
+    assert flaky() == 'ok'
+    assert len(attempts) == 3
+
+def test_retry_wraps_coroutines(monkeypatch):
+    async def no_wait(seconds):
+        return None
+    monkeypatch.setattr(retry_module.asyncio, 'sleep', no_wait)
+    attempts = []
+
+    @retry(max_retries=2, delay=0.01)
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise ConnectionError("down")
+        return 'ok'
+
+    assert asyncio.run(flaky()) == 'ok'
+    assert len(attempts) == 2
+
+def test_backoff_is_capped_and_jittered():
+    delays = list(retry_module._backoff_delays(6, 1, 2, 4, jitter=False))
+    assert delays == [1, 2, 4, 4, 4]
+    for delay, jittered in zip(delays, retry_module._backoff_delays(6, 1, 2, 4, jitter=True)):
+        assert delay / 2 <= jittered <= delay
@@ -0,0 +1,53 @@
+"""tests/test_sharded_matcher.py"""
+
+import os
+import signal
+import numpy as np
+import pytest
+from config.settings import get_settings
+from detection.benchmark import descriptor_probes
+from detection.feature_backend import FeatureBackend
+from detection.gallery import FeatureGallery
+from detection.matcher import FaceMatcher
+from detection.sharded_matcher import ShardedMatcher
+
+settings = get_settings()
+
+@pytest.fixture(scope='module')
+def gallery():
+    gallery = FeatureGallery.from_directory(settings.FEATURES_DIR, 'sift')
+    if not len(gallery):
+        pytest.skip("No SIFT reference features in FEATURES_DIR")
+    return gallery
+
+@pytest.fixture
+def sharded(gallery, monkeypatch):
+    monkeypatch.setattr(settings, 'MATCH_SHARD_TIMEOUT', 1.0)
+    matcher = ShardedMatcher(workers=2, gallery=gallery, shortlist_size=0, backend=FeatureBackend('sift', 'bf'))
+    yield matcher
+    matcher.close()
+
+def test_sharded_search_matches_in_process(gallery, sharded):
+    single = FaceMatcher(gallery=gallery, shortlist_size=0, backend=FeatureBackend('sift', 'bf'))
+    for _, descriptors in descriptor_probes(gallery, per_student=1, seed=0):
+        assert sharded.match_descriptors(descriptors)[:2] == single.match_descriptors(descriptors)[:2]
+    assert sharded._pool is not None
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGSTOP'), reason="needs SIGSTOP")
+def test_hung_worker_falls_back_in_process(gallery, sharded):
+    probe = np.ascontiguousarray(gallery.working_descriptors()[:gallery.offsets[1]])
+    expected = sharded._gallery_hits(probe, sharded.gallery)
+    os.kill(sharded._pool.processes[1].pid, signal.SIGSTOP)
+
+    hits = sharded._gallery_hits(probe, sharded.gallery)
+    assert sharded._pool is None
+    for column, expected_column in zip(hits, expected):
+        np.testing.assert_array_equal(np.sort(column), np.sort(expected_column))
+
+def test_dead_worker_falls_back_in_process(gallery, sharded):
+    probe = np.ascontiguousarray(gallery.working_descriptors()[:gallery.offsets[1]])
+    sharded._pool.processes[0].kill()
+    sharded._pool.processes[0].join()
+
+    assert sharded.match_descriptors(probe)[0] == gallery.student_ids[0]
+    assert sharded._pool is None
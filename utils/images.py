@@ -0,0 +1,26 @@
+"""utils/images.py"""
+
+import cv2
+
+# cv2.imdecode/imread flags that let libjpeg scale down while decoding (DCT scaling)
+_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def decode_flags(scale, grayscale):
+    """imdecode flag for a reduction factor of 1, 2, 4 or 8"""
+    flags = _GRAYSCALE_FLAGS if grayscale else _COLOR_FLAGS
+    if scale not in flags:
+        raise ValueError(f"Unsupported decode scale {scale}, expected one of {sorted(flags)}")
+    return flags[scale]
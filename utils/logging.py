@@ -1,10 +1,10 @@
 """utils/logging.py"""
 
 import logging
-from config.settings import Settings
+from config.settings import get_settings
 import os
 
-settings = Settings()
+settings = get_settings()
 
 def configure_logging():
     logging.basicConfig(
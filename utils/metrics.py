@@ -0,0 +1,275 @@
+"""utils/metrics.py"""
+
+import bisect
+import logging
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('face_detection.metrics')
+
+# Upper bounds (seconds) of the latency buckets, from sub-millisecond to a stalled DB
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Pipeline stage histogram shared by camera, matcher, detector and attendance
+STAGE_SECONDS = 'face_stage_seconds'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+class Counter:
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class Gauge:
+    """Value read on demand from a callback (pool sizes, queue depths)"""
+
+    def __init__(self, labels, function):
+        self.labels = labels
+        self.function = function
+
+    @property
+    def value(self):
+        try:
+            return float(self.function())
+        except Exception:
+            return float('nan')
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram: ``observe`` is one bisect and three
+    additions under a lock, cheap enough for every frame.
+    """
+
+    def __init__(self, labels, buckets=DEFAULT_BUCKETS):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def time(self):
+        """``with histogram.time():`` observes the duration of the block"""
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q, counts=None):
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        counts = counts if counts is not None else self.snapshot()[0]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """Named metric families; each family holds one metric per label set"""
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help_text, labels, factory):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = {'kind': kind, 'help': help_text, 'metrics': {}}
+            elif family['kind'] != kind:
+                raise ValueError(f"Metric {name} already registered as a {family['kind']}")
+            metric = family['metrics'].get(key)
+            if metric is None:
+                metric = family['metrics'][key] = factory(key)
+            return metric
+
+    def counter(self, name, help_text, **labels):
+        return self._get('counter', name, help_text, labels, Counter)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get('histogram', name, help_text, labels, lambda key: Histogram(key, buckets))
+
+    def gauge(self, name, help_text, function, **labels):
+        """Register (or replace) a callback gauge"""
+        gauge = self._get('gauge', name, help_text, labels, lambda key: Gauge(key, function))
+        gauge.function = function
+        return gauge
+
+    def families(self):
+        with self._lock:
+            return [(name, family['kind'], family['help'], list(family['metrics'].values()))
+                    for name, family in sorted(self._families.items())]
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, kind, help_text, metrics in self.families():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics:
+                if kind == 'histogram':
+                    counts, total_sum, count = metric.snapshot()
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets + ('+Inf',), counts):
+                        cumulative += bucket_count
+                        labels = _format_labels(metric.labels + (('le', bound),))
+                        lines.append(f"{name}_bucket{labels} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(metric.labels)} {total_sum}")
+                    lines.append(f"{name}_count{_format_labels(metric.labels)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(metric.labels)} {metric.value}")
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+def counter(name, help_text, **labels):
+    return REGISTRY.counter(name, help_text, **labels)
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS, **labels):
+    return REGISTRY.histogram(name, help_text, buckets, **labels)
+
+def gauge(name, help_text, function, **labels):
+    return REGISTRY.gauge(name, help_text, function, **labels)
+
+def stage(name):
+    """Histogram of one pipeline stage in ``face_stage_seconds``"""
+    return REGISTRY.histogram(STAGE_SECONDS, 'Time spent per pipeline stage in seconds', stage=name)
+
+def timed(histogram_metric):
+    """Decorator: observe the duration of every call (including its retries)"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with histogram_metric.time():
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class SummaryReporter:
+    """Builds the periodic summary log line from what changed since the previous one"""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self._previous = {}
+
+    def line(self):
+        stages, counters, gauges = [], [], []
+        for name, kind, _, metrics in self.registry.families():
+            for metric in metrics:
+                label = ','.join(str(value) for _, value in metric.labels)
+                key = (name, metric.labels)
+                if kind == 'histogram':
+                    counts, total_sum, count = metric.snapshot()
+                    previous_counts, previous_sum, previous_count = self._previous.get(key, ([0] * len(counts), 0.0, 0))
+                    self._previous[key] = (counts, total_sum, count)
+                    delta = [now - before for now, before in zip(counts, previous_counts)]
+                    n = count - previous_count
+                    if n:
+                        stages.append(
+                            f"{label or name} n={n} avg={(total_sum - previous_sum) / n * 1000:.1f}ms "
+                            f"p50={metric.quantile(0.5, delta) * 1000:.1f}ms p95={metric.quantile(0.95, delta) * 1000:.1f}ms"
+                        )
+                elif kind == 'counter':
+                    if metric.value:
+                        counters.append(f"{name.replace('_total', '')}{'[' + label + ']' if label else ''}={metric.value}")
+                else:
+                    gauges.append(f"{name}{'[' + label + ']' if label else ''}={metric.value:g}")
+
+        parts = [' | '.join(stages) or 'no frames']
+        if counters:
+            parts.append('counters: ' + ' '.join(counters))
+        if gauges:
+            parts.append(' '.join(gauges))
+        return ' || '.join(parts)
+
+    def start(self, interval, stop_event=None):
+        """Log the summary every ``interval`` seconds from a daemon thread"""
+        stop_event = stop_event or threading.Event()
+
+        def _run():
+            while not stop_event.wait(interval):
+                logger.info(f"Metrics: {self.line()}")
+
+        threading.Thread(target=_run, name='metrics-summary', daemon=True).start()
+        return stop_event
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood detection.log
+        pass
+
+class MetricsServer:
+    """Serve ``/metrics`` in Prometheus text format from a daemon thread"""
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics endpoint on http://{self.server.server_address[0]}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
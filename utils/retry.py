@@ -1,22 +1,286 @@
 """utils/retry.py"""
 
 import time
+import random
+import asyncio
 import logging
+import threading
 from functools import wraps
+from config.settings import get_settings
+from utils import metrics
+
+settings = get_settings()
+logger = logging.getLogger('face_detection.retry')
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+# Gauge values of circuit_breaker_state
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency keeps failing.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    every call is rejected with ``CircuitOpenError`` without touching the
+    dependency. Once ``reset_timeout`` seconds have passed it lets
+    ``half_open_calls`` trial calls through: a success closes it again, a
+    failure reopens it for another ``reset_timeout``. Only exceptions in
+    ``trip_on`` count as failures (a 404 for one photo says nothing about
+    the photo server).
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, half_open_calls=1,
+                 trip_on=(Exception,)):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or settings.BREAKER_RESET_TIMEOUT
+        self.half_open_calls = half_open_calls
+        self.trip_on = trip_on
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self.rejected = 0
+        self.opened = 0
+
+        self._rejected_total = metrics.counter(
+            'circuit_breaker_rejected_total', 'Calls failed fast by an open circuit breaker', dependency=name
+        )
+        self._opened_total = metrics.counter(
+            'circuit_breaker_opened_total', 'Times a circuit breaker opened', dependency=name
+        )
+        metrics.gauge(
+            'circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)',
+            lambda: _STATE_VALUES[self.state], dependency=name
+        )
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._trials = 0
+            return self._state
+
+    def allow(self):
+        """Reserve a call, or raise ``CircuitOpenError``"""
+        state = self.state
+        with self._lock:
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return
+            self.rejected += 1
+            retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0)
+        self._rejected_total.inc()
+        raise CircuitOpenError(f"Circuit breaker '{self.name}' is open (retry in {retry_in:.0f}s)")
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"Circuit breaker '{self.name}' closed")
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self, error=None):
+        if error is not None and not isinstance(error, self.trip_on):
+            # Not the dependency's fault: counts as a working call
+            self.record_success()
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opened += 1
+                    self._opened_total.inc()
+                    logger.warning(
+                        f"Circuit breaker '{self.name}' opened after {self._failures} failures: {error}"
+                    )
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, f, *args, **kwargs):
+        self.allow()
+        try:
+            result = f(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, f, *args, **kwargs):
+        self.allow()
+        try:
+            result = await f(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+class RetryBudget:
+    """
+    Token bucket that caps retries at a share of calls.
+
+    Every call deposits ``ratio`` tokens and every retry spends one, so
+    retries can never exceed ``ratio`` of the traffic for long, however many
+    callers are failing at once; ``max_tokens`` allows short bursts.
+    """
+
+    def __init__(self, name, ratio=None, max_tokens=None):
+        self.name = name
+        self.ratio = settings.RETRY_BUDGET_RATIO if ratio is None else ratio
+        self.max_tokens = max_tokens or settings.RETRY_BUDGET_TOKENS
+        self.tokens = float(self.max_tokens)
+        self._lock = threading.Lock()
+        self._exhausted_total = metrics.counter(
+            'retry_budget_exhausted_total', 'Retries skipped because the retry budget was spent', dependency=name
+        )
+        metrics.gauge('retry_budget_tokens', 'Retries currently allowed by the budget', lambda: self.tokens,
+                      dependency=name)
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self):
+        """True if a retry may go ahead"""
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+        self._exhausted_total.inc()
+        return False
+
+_breakers = {}
+_budgets = {}
+_registry_lock = threading.Lock()
+
+def circuit_breaker(name, **options):
+    """Shared breaker of a dependency; ``options`` apply when it is first created"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **options)
+        return breaker
+
+def retry_budget(name):
+    with _registry_lock:
+        budget = _budgets.get(name)
+        if budget is None:
+            budget = _budgets[name] = RetryBudget(name)
+        return budget
+
+def breaker_states():
+    """Current state of every circuit breaker, by dependency"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+def _backoff_delays(max_retries, delay, backoff, max_delay, jitter):
+    """Sleep before each retry: exponential, capped, with 'equal jitter' so callers do not retry in step"""
+    current_delay = delay
+    for _ in range(max_retries - 1):
+        wait = min(current_delay, max_delay)
+        yield wait / 2 + random.uniform(0, wait / 2) if jitter else wait
+        current_delay *= backoff
+
+def retry(max_retries=3, delay=1, backoff=2, exceptions=(Exception,), dependency=None,
+          jitter=True, max_delay=None):
+    """
+    Retry a call that does I/O.
+
+    Keep the decorated function down to the I/O step, so a retry never
+    repeats work that already succeeded. Coroutine functions get the same
+    policy with ``asyncio.sleep`` instead of blocking the thread.
+    Args:
+        dependency (str or callable): Breaker and retry budget to use ('db',
+            'photo_http', ...); a callable gets the call's arguments and
+            returns the name (one breaker per camera)
+        jitter (bool): Randomise each delay between half and all of it
+        max_delay (float): Longest single wait (default RETRY_MAX_DELAY)
+    """
+    max_delay = max_delay or settings.RETRY_MAX_DELAY
 
-def retry(max_retries=3, delay=1, backoff=2, exceptions=(Exception,)):
     def decorator(f):
+        retries = metrics.counter('retries_total', 'Calls retried after a failure', function=f.__qualname__)
+
+        def _policy(args, kwargs):
+            name = dependency(*args, **kwargs) if callable(dependency) else dependency
+            if name is None:
+                return None, None
+            return circuit_breaker(name), retry_budget(name)
+
+        def _should_retry(e, attempt, delays, budget):
+            if isinstance(e, CircuitOpenError):
+                return None
+            wait = next(delays, None)
+            if wait is None:
+                return None
+            if budget is not None and not budget.withdraw():
+                logger.warning(f"{f.__qualname__} failed ({e}); retry budget of '{budget.name}' spent, not retrying")
+                return None
+            retries.inc()
+            logger.warning(f"Attempt {attempt + 1} failed: {str(e)}. Retrying in {wait:.1f} seconds...")
+            return wait
+
+        if asyncio.iscoroutinefunction(f):
+            @wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                breaker, budget = _policy(args, kwargs)
+                if budget is not None:
+                    budget.deposit()
+                delays = _backoff_delays(max_retries, delay, backoff, max_delay, jitter)
+                attempt = 0
+                while True:
+                    try:
+                        if breaker is None:
+                            return await f(*args, **kwargs)
+                        return await breaker.call_async(f, *args, **kwargs)
+                    except exceptions as e:
+                        wait = _should_retry(e, attempt, delays, budget)
+                        if wait is None:
+                            raise
+                    await asyncio.sleep(wait)
+                    attempt += 1
+            return async_wrapper
+
         @wraps(f)
         def wrapper(*args, **kwargs):
-            current_delay = delay
-            for attempt in range(max_retries):
+            breaker, budget = _policy(args, kwargs)
+            if budget is not None:
+                budget.deposit()
+            delays = _backoff_delays(max_retries, delay, backoff, max_delay, jitter)
+            attempt = 0
+            while True:
                 try:
-                    return f(*args, **kwargs)
+                    if breaker is None:
+                        return f(*args, **kwargs)
+                    return breaker.call(f, *args, **kwargs)
                 except exceptions as e:
-                    if attempt == max_retries - 1:
+                    wait = _should_retry(e, attempt, delays, budget)
+                    if wait is None:
                         raise
-                    logging.warning(f"Attempt {attempt + 1} failed: {str(e)}. Retrying in {current_delay} seconds...")
-                    time.sleep(current_delay)
-                    current_delay *= backoff
+                time.sleep(wait)
+                attempt += 1
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,49 @@
+"""utils/startup.py"""
+
+import time
+import importlib
+from contextlib import contextmanager
+
+class StartupProfile:
+    """
+    Wall time of every import and initialisation step of an entry point.
+
+    Steps are recorded whether or not the report is asked for (one
+    ``perf_counter`` pair each), so entry points can time their module-level
+    imports before the command line is parsed. Libraries are charged to the
+    first step that imports them, which is why entry points import the heavy
+    ones (numpy, cv2, SQLAlchemy) in steps of their own.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def preload(self, *modules):
+        """Import third-party modules as a step of their own"""
+        with self.step(f"import {', '.join(modules)}"):
+            for module in modules:
+                importlib.import_module(module)
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        return {
+            'total_seconds': total,
+            'steps': [{'step': name, 'seconds': seconds} for name, seconds in self.steps],
+        }
+
+    def log(self, logger):
+        report = self.report()
+        total = report['total_seconds']
+        logger.info(f"Startup profile ({total * 1000:.0f} ms since the first import):")
+        for step in report['steps']:
+            share = step['seconds'] / total if total else 0.0
+            logger.info(f"  {step['step']:<36} {step['seconds'] * 1000:8.1f} ms {share:6.1%}")